@@ -0,0 +1,258 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+Benchmark Grocker orchestration overhead against an in-process Docker stand-in.
+
+Usage:
+    python benchmarks/run.py [--objects 10000] [--latency build=0.01] [--output results.json]
+    python benchmarks/run.py --compare results.json [--tolerance 1.5]
+
+Scenarios are generators yielding the function to time (optionally with a
+function preparing its argument before each run, out of the timing), so that
+their fixtures are cleaned up once they are closed.
+
+Each scenario reports its best and median wall time and its peak memory
+allocation (when tracemalloc is available). When comparing with a previous
+result file, the script exits with a non-zero status if a scenario got slower
+than the tolerated ratio.
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import os.path
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2.7
+    tracemalloc = None
+
+from click.testing import CliRunner
+
+from grocker import __main__ as grocker_main
+from grocker import six
+from grocker import utils
+from grocker.builders import op
+from grocker.engines import dockerpy
+from grocker.engines import fake as fakedocker
+
+SCENARIOS = []
+
+
+def scenario(function):
+    SCENARIOS.append(function)
+    return function
+
+
+@contextlib.contextmanager
+def silent():
+    old_stdout = sys.stdout
+    sys.stdout = io.StringIO() if sys.version_info[0] > 2 else io.BytesIO()
+    try:
+        yield
+    finally:
+        sys.stdout = old_stdout
+
+
+@contextlib.contextmanager
+def fake_docker_client(client):
+    old_get_client = utils.docker_get_client
+    utils.docker_get_client = lambda min_version=None, base_url=None: client
+    try:
+        yield client
+    finally:
+        utils.docker_get_client = old_get_client
+
+
+def big_config(size):
+    config = utils.parse_config([])
+    config['dependencies'] = [
+        {'libdep{}'.format(i): ['libdep{}-dev'.format(i), 'libdep{}-doc'.format(i)]}
+        for i in range(size)
+    ]
+    config['repositories'] = {
+        'repo{}'.format(i): {'uri': 'deb http://repo{}.example.com/ jessie main'.format(i), 'key': 'KEY'}
+        for i in range(size // 10)
+    }
+    return config
+
+
+@scenario
+def parse_config(args):
+    with six.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, '.grocker.yml')
+        with io.open(path, 'w') as fp:
+            fp.write(u'dependencies:\n')
+            for i in range(args.objects // 10):
+                fp.write(u'  - libdep{0}: libdep{0}-dev\n'.format(i))
+        yield lambda: utils.parse_config([path], runtime='python3.4')
+
+
+@scenario
+def config_identifier(args):
+    config = big_config(args.objects // 10)
+    yield lambda: utils.config_identifier(config)
+
+
+@scenario
+def docker_build_context(args):
+    def run():
+        with op.docker_build_context('resources/docker/runner-image'):
+            pass
+    yield run
+
+
+@scenario
+def inspect_stream(args):
+    stream = [
+        json.dumps({'stream': 'Step {} : RUN something\n'.format(i)}).encode('utf-8')
+        for i in range(args.objects)
+    ]
+
+    def run():
+        with silent():
+            dockerpy._inspect_stream(iter(stream))  # pylint: disable=protected-access
+    yield run
+
+
+@scenario
+def purge(args):
+    def prepare():
+        return fakedocker.FakeDockerClient(
+            latencies=args.latencies,
+            images=args.objects,
+            volumes=args.objects // 10,
+            containers=args.objects // 10,
+        )
+
+    def run(client):
+        with fake_docker_client(client):
+            CliRunner().invoke(grocker_main.main, ['purge', '--including-final-images'], catch_exceptions=False)
+    yield run, prepare
+
+
+@scenario
+def build(args):
+    with six.TemporaryDirectory() as tmp_dir:
+        pip_conf = os.path.join(tmp_dir, 'pip.conf')
+        with io.open(pip_conf, 'w') as fp:
+            fp.write(u'[global]\nindex-url = http://pypi.example.com/simple\n')
+
+        def prepare():  # A new daemon for each run, so that every stage is built
+            return fakedocker.FakeDockerClient(
+                latencies=args.latencies,
+                build_output_lines=args.objects // 10,
+                run_output=[b'Building wheels...\n'] * (args.objects // 10),
+            )
+
+        def run(client):
+            with fake_docker_client(client):
+                CliRunner().invoke(
+                    grocker_main.main,
+                    ['--ledger', '', 'build', '--pip-conf', pip_conf, '--image-prefix', 'registry.example.com',
+                     'grocker-test-project==2.0'],
+                    catch_exceptions=False,
+                )
+        yield run, prepare
+
+
+def measure(function, repeat, prepare=None):
+    """Time `function` (called with the result of `prepare()`, if any) `repeat` times."""
+    timings = []
+    peak = None
+    for _ in range(repeat):
+        args = (prepare(),) if prepare else ()
+        gc.collect()
+        if tracemalloc:
+            tracemalloc.start()
+        start = time.time()
+        function(*args)
+        timings.append(time.time() - start)
+        if tracemalloc:
+            peak = max(peak or 0, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    timings.sort()
+    return {
+        'best': timings[0],
+        'median': timings[len(timings) // 2],
+        'peak_memory': peak,
+    }
+
+
+def run_scenarios(args):
+    results = {}
+    for function in SCENARIOS:
+        if args.scenario and function.__name__ not in args.scenario:
+            continue
+        setup = function(args)
+        run = next(setup)
+        run, prepare = run if isinstance(run, tuple) else (run, None)
+        results[function.__name__] = measure(run, args.repeat, prepare)
+        setup.close()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        ratio = result['best'] / max(baseline[name]['best'], 1e-9)
+        if ratio > tolerance:
+            regressions.append('{}: {:.2f}x slower than baseline'.format(name, ratio))
+    return regressions
+
+
+def parse_latency(value):
+    operation, _, seconds = value.partition('=')
+    if operation not in fakedocker.DEFAULT_LATENCIES:
+        raise argparse.ArgumentTypeError('Unknown operation: {}'.format(operation))
+    return operation, float(seconds)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(description='Benchmark Grocker orchestration layer')
+    parser.add_argument('--objects', type=int, default=10000, help='number of Docker objects / stream lines')
+    parser.add_argument(
+        '--latency', type=parse_latency, action='append', default=[], metavar='<operation>=<seconds>',
+        help='latency of a fake Docker daemon operation ({})'.format(', '.join(sorted(fakedocker.DEFAULT_LATENCIES))),
+    )
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scenario', action='append', help='only run this scenario')
+    parser.add_argument('--output', metavar='<filename>', help='json file where results are written')
+    parser.add_argument('--compare', metavar='<filename>', help='json file containing baseline results')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='tolerated slowdown ratio')
+    return parser
+
+
+def main():
+    args = arg_parser().parse_args()
+    args.latencies = dict(args.latency)
+
+    results = run_scenarios(args)
+    for name, result in sorted(results.items()):
+        print('{:<24} best {:>9.4f}s  median {:>9.4f}s  peak memory {:>12} B'.format(
+            name, result['best'], result['median'], result['peak_memory'] or 'n/a',
+        ))
+
+    if args.output:
+        with io.open(args.output, 'w') as fp:
+            fp.write(six.smart_text(json.dumps(results, indent=2, sort_keys=True)))
+
+    if args.compare:
+        with io.open(args.compare) as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        for regression in regressions:
+            print(regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
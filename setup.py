@@ -35,6 +35,9 @@ setup(
         ":python_version == '2.7'": [
             'enum34',
         ],
+        'zstd': [
+            'zstandard',
+        ],
     },
     license='BSD',
     classifiers=[
@@ -3,16 +3,25 @@
 # Copyright (c) Polyconseil SAS. All rights reserved.
 
 
+import functools
 import logging
+import os.path
+import time
 
 import click
 
 from . import __version__
+from . import bench
 from . import builders
 from . import cleanners
+from . import engines
 from . import helpers
+from . import ledger as build_ledger
 from . import loggers
+from . import server
+from . import trace
 from . import utils
+from . import watch
 
 logger = logging.getLogger('grocker')
 
@@ -20,19 +29,233 @@ logger = logging.getLogger('grocker')
 @click.group()
 @click.version_option(__version__)
 @click.option('-v', '--verbose', count=True)
-def main(verbose):
+@click.option(
+    '--engine', type=click.Choice(engines.ENGINES), default='docker', envvar='GROCKER_ENGINE',
+    help="container engine used to build and run images",
+)
+@click.option(
+    '--ledger', default=build_ledger.DEFAULT_PATH, envvar='GROCKER_LEDGER', metavar='<filename>',
+    help="SQLite database where builds are recorded (an empty value disables it)",
+)
+@click.option(
+    '--retries', default=4, envvar='GROCKER_RETRIES', metavar='<count>',
+    help="retries of a failed engine call (with exponential backoff)",
+)
+@click.option(
+    '--rate-limit', default=0.0, envvar='GROCKER_RATE_LIMIT', metavar='<calls/s>',
+    help="maximum rate of calls to each Docker host (0 for no limit)",
+)
+@click.option(
+    '--trace', 'trace_path', type=click.Path(exists=False), metavar='<filename>',
+    help="write a Chrome trace of the stages and engine calls (see chrome://tracing or ui.perfetto.dev)",
+)
+@click.pass_context
+def main(ctx, verbose, engine, ledger, retries, rate_limit, trace_path):
     loggers.setup(verbose > 0)
+    ctx.obj = {'engine': engine, 'ledger': ledger, 'policy': engines.Policy(retries=retries, rate=rate_limit)}
+    if trace_path:
+        tracer = trace.start()
+        ctx.call_on_close(lambda: write_trace(tracer, trace_path))
+
+
+def write_trace(tracer, path):
+    trace.stop()
+    tracer.write(path)
+    logger.info('Trace of %d spans written in %s.', len(tracer.events), path)
+
+
+def get_engine(obj, base_url=None):
+    kwargs = {'base_url': base_url} if base_url else {}
+    return engines.get_engine(obj['engine'], policy=obj['policy'], tracing=trace.is_started(), **kwargs)
+
+
+def get_ledger(obj):
+    return build_ledger.Ledger(obj['ledger']) if obj['ledger'] else None
 
 
 @main.command()
 @click.option('-a', '--all-versions/--only-old-versions', default=False)
 @click.option('-f', '--including-final-images/--excluding-final-images', default=False)
-def purge(all_versions, including_final_images):
+@click.pass_obj
+def purge(obj, all_versions, including_final_images):
     """Purge Grocker created Docker stuff"""
-    docker_client = utils.docker_get_client()
-    cleanners.docker_purge_container(docker_client, current_version=all_versions)
-    cleanners.docker_purge_volumes(docker_client, current_version=all_versions)
-    cleanners.docker_purge_images(docker_client, current_version=all_versions, runner=including_final_images)
+    engine = get_engine(obj)
+    cleanners.docker_purge_container(engine, current_version=all_versions)
+    cleanners.docker_purge_volumes(engine, current_version=all_versions)
+    cleanners.docker_purge_images(engine, current_version=all_versions, runner=including_final_images)
+
+
+def compile_dependencies(engine, pool, config, release, pip_conf_path, collect):
+    logger.info('Compiling dependencies...')
+    timings = collect.setdefault('timings', {})
+    cache = collect.setdefault('cache', {})
+    with helpers.timed(timings, 'root'):
+        builders.get_or_build_root_image(engine, config, cache)
+    with helpers.timed(timings, 'compiler'):
+        compiler = builders.get_or_build_compiler_image(engine, config, cache)
+    collect['compiler_image'] = compiler.tags[0]
+
+    with helpers.timed(timings, 'wheels'), helpers.pip_conf(pip_conf_path=pip_conf_path) as pip_conf:
+        report = builders.distributed.compile_wheels(
+            engine=engine,
+            pool=pool,
+            config=config,
+            release=release,
+            pip_conf=pip_conf,
+        )
+    collect['wheels'] = builders.wheels.summarize_wheel_report(report)
+    log_wheel_report(collect['wheels'])
+
+
+def log_wheel_report(summary, count=5):
+    logger.info(
+        'Wheels: %d compiled (in %.1fs), %d downloaded, %d reused.',
+        summary['compiled'], summary['compile_time'], summary['downloaded'], summary['reused'],
+    )
+    slowest = [entry for entry in summary['packages'][:count] if entry['duration']]
+    if slowest:
+        logger.info('Slowest compilations: %s', ', '.join(
+            '{} {:.1f}s ({:.0f}%)'.format(
+                entry['requirement'], entry['duration'], 100.0 * entry['duration'] / summary['compile_time'],
+            )
+            for entry in slowest
+        ))
+
+
+def build_runner_image(engine, config, image_name, release, fingerprint, collect):
+    logger.info('Building image...')
+    timings = collect.setdefault('timings', {})
+    cache = collect.setdefault('cache', {})
+    with helpers.timed(timings, 'root'):
+        root_image = builders.get_or_build_root_image(engine, config, cache)
+    collect['root_image'] = root_image.tags[0]
+    if builders.is_multi_stage(config):
+        with helpers.timed(timings, 'compiler'):
+            compiler = builders.get_or_build_compiler_image(engine, config, cache)
+        collect['compiler_image'] = compiler.tags[0]
+    with helpers.timed(timings, 'runner'):
+        builders.build_runner_image(
+            engine=engine,
+            config=config,
+            name=image_name,
+            release=release,
+            labels={'grocker.runner.fingerprint': fingerprint},
+        )
+    cache['runner'] = 'built'
+    collect['size'] = engine.get_image(image_name).size
+
+
+def push_runner_image(engine, image_name, collect):
+    if not builders.is_prefixed_image(image_name):
+        logger.warning('Not pushing any image since the registry is unclear in %s', image_name)
+    else:
+        logger.info('Pushing image...')
+        with helpers.timed(collect.setdefault('timings', {}), 'push'):
+            image = builders.docker_push_image(engine, image_name)
+        collect['hash'] = [x.split('@')[1] for x in image.digests][0]
+
+
+def export_image(engine, image_name, output, compression='gzip', previous_manifest=None, workers=None):
+    logger.info('Exporting image %s to %s...', image_name, output)
+    result = builders.oci.export_image(
+        engine, image_name, output,
+        compression=compression, previous_manifest=previous_manifest, workers=workers,
+    )
+    logger.info(
+        'Exported %d layers (%d skipped) in %s (%d bytes, manifest in %s): %s',
+        result['layers'], result['skipped_layers'], result['archive'], result['size'], result['manifest'],
+        ', '.join('{} {:.1f}s'.format(step, result['timings'][step]) for step in ('transfer', 'compress', 'write')),
+    )
+    return result
+
+
+def log_eta(ledger, config, stage=None):
+    estimate = ledger.estimate(config, stage) if ledger else None
+    if estimate:
+        logger.info('Expected %s time: ~%ds (median of %d previous builds)', stage or 'build', *estimate)
+
+
+def build_stages(engine, pool, config, release, collect, pip_conf=None, ledger=None,
+                 build_dependencies=True, build_image=True, push=True, force=False):
+    image_name = collect['image']
+    if build_image:
+        fingerprint = builders.runner_fingerprint(engine, config, release, collect.setdefault('cache', {}))
+        reusable = not force and utils.is_pinned_release(config, release)
+        image = builders.find_runner_image(engine, image_name, fingerprint) if reusable else None
+        if image:
+            logger.info('Image %s was already built from the same release and config.', image_name)
+            build_dependencies = build_image = False
+            collect['reused'] = True
+            collect.setdefault('cache', {})['runner'] = 'reused'
+            collect['size'] = image.size
+
+    if build_dependencies:
+        log_eta(ledger, config, 'wheels')
+        compile_dependencies(engine, pool, config, release, pip_conf, collect)
+
+    if build_image:
+        log_eta(ledger, config, 'runner')
+        build_runner_image(engine, config, image_name, release, fingerprint, collect)
+
+    if push:
+        push_runner_image(engine, image_name, collect)
+
+
+def collect_engine_calls(collect, all_engines, counters):
+    """Collect the engine calls, retries and throttled calls made since `counters` were taken."""
+    current = engines.policy.get_counters(all_engines)
+    calls = collect['engine_calls'] = {name: round(current[name] - counters[name], 3) for name in current}
+    if calls['retries'] or calls['throttled']:
+        logger.info(
+            'Engine calls: %d (%d retried, %d throttled for %.1fs)',
+            calls['calls'], calls['retries'], calls['throttled'], calls['throttled_time'],
+        )
+
+
+def build_release(engine, pool, config, release, pip_conf=None, image_name=None, ledger=None, **options):
+    """
+    Build the runner image of `release` (compiling its dependencies first) and push it
+
+    Args:
+        engine (grocker.engines.Engine): the engine used to build the images
+        pool (list): other engines sharing the compilation of the dependencies
+        config (dict): the Grocker config
+        release (str): the release to build
+        pip_conf (str): pip configuration file (by default use pip config getter)
+        image_name (str): the runner image name (by default computed from config and release)
+        ledger (grocker.ledger.Ledger): where the build is recorded (and ETAs come from)
+        options: the `build_dependencies`, `build_image`, `push` and `force` flags
+
+    Returns:
+        dict: the collected information (image name, ...)
+    """
+    collect = {'release': release}
+    collect['image'] = image_name or utils.default_image_name(config, release)
+
+    utils.check_config(config)
+
+    started = time.time()
+    all_engines = [engine] + list(pool)
+    counters = engines.policy.get_counters(all_engines)
+    log_eta(ledger, config)
+    try:
+        with trace.span('build', 'build', release=release, image=collect['image']):
+            build_stages(engine, pool, config, release, collect, pip_conf, ledger, **options)
+    except Exception as e:
+        collect_engine_calls(collect, all_engines, counters)
+        if ledger:
+            ledger.record(engine.name, config, collect, 'failed', started, error=str(e))
+        raise
+    collect_engine_calls(collect, all_engines, counters)
+    if ledger:
+        ledger.record(engine.name, config, collect, 'reused' if collect.get('reused') else 'succeeded', started)
+
+    if collect.get('timings'):
+        logger.info('Stage timings: %s', ', '.join(
+            '{} {:.1f}s'.format(stage, collect['timings'][stage])
+            for stage in watch.STAGES + ('push',) if stage in collect['timings']
+        ))
+    return collect
 
 
 @main.command()
@@ -49,6 +272,41 @@ def purge(all_versions, including_final_images):
     '--pip-constraint', type=click.Path(exists=True), metavar='<filename>',
     help="pip constraint file used to download dependencies",
 )
+@click.option(
+    '--wheel-cache', metavar='<url|directory>',
+    help="remote wheel cache shared between builds (HTTP URL or shared directory)",
+)
+@click.option(
+    '--pip-cache', is_flag=True, default=None,
+    help="keep pip downloads in a data volume between builds",
+)
+@click.option(
+    '--package-cache', metavar='<managed|url>',
+    help="OS package caching proxy used to build root and compiler images ('managed' to let Grocker run it)",
+)
+@click.option(
+    '--docker-host', multiple=True, metavar='<url>',
+    help="additional Docker host used to compile dependencies (eg. tcp://docker-2:2375)",
+)
+@click.option(
+    '--build-slots', type=int, metavar='<count>',
+    help="maximum number of heavy stages (compilation, image builds) run at the same time on a Docker host",
+)
+@click.option('--compiler-cpus', type=float, metavar='<count>', help="CPUs available to the compiler container")
+@click.option('--compiler-memory', metavar='<size>', help="memory limit of the compiler container (eg. 4g)")
+@click.option(
+    '--build-jobs', type=int, metavar='<count>',
+    help="parallel jobs of native extension builds (by default, the compiler CPUs or the Docker host cores)",
+)
+@click.option(
+    '--ccache', is_flag=True, default=None,
+    help="compile native extensions through ccache, keeping its cache in a data volume between builds",
+)
+@click.option('--compiler-tmpfs', metavar='<size>', help="size of the tmpfs where pip builds the source distributions")
+@click.option(
+    '--compiler-superset', is_flag=True, default=None,
+    help="reuse a compiler image providing more packages than needed instead of building one",
+)
 @click.option('-e', '--entrypoint', metavar='<entrypoint>', help="Docker entrypoint to use to run this image")
 @click.option('--volume', multiple=True, metavar='<volume>', help="Container storage and configuration area")
 @click.option('--port', multiple=True, metavar='<port>', help="Port on which a container will listen for connections")
@@ -61,6 +319,14 @@ def purge(all_versions, including_final_images):
     help="base name for the image (eg '<image-prefix>/<image-base-name>:<image-version>')",
 )
 @click.option('-n', '--image-name', metavar='<name>', help="name used to tag the build image")
+@click.option(
+    '--runner-build-mode', type=click.Choice(['wheel-server', 'multi-stage']),
+    help="how the runner venv is built (from a wheel server or in a compiler based stage)",
+)
+@click.option(
+    '--wheel-server-idle-timeout', type=int, metavar='<seconds>',
+    help="share the wheel server with the next builds, until it is idle for <seconds>",
+)
 @click.option(
     '--result-file', type=click.Path(exists=False), metavar='<filename>',
     help="yaml file where results (image name, ...) are written",
@@ -77,67 +343,403 @@ def purge(all_versions, including_final_images):
     '--push/--no-push', default=True,
     help='push the image',
 )
+@click.option(
+    '--force', is_flag=True,
+    help='build the image even if an image was already built from the same release and config',
+)
+@click.option(
+    '--export', type=click.Path(exists=False), metavar='<filename>',
+    help='export the image as an OCI image layout archive',
+)
+@click.option(
+    '--export-compression', type=click.Choice(builders.oci.COMPRESSIONS), default='gzip',
+    help='compression of the exported layers (zstd needs the zstandard package)',
+)
+@click.option(
+    '--previous-export', type=click.Path(exists=True), metavar='<filename>',
+    help='export manifest of the layers the target already has (they are not exported again)',
+)
+@click.option(
+    '--watch', is_flag=True,
+    help='build again the invalidated stages each time a config, constraint or pip config file changes',
+)
 @click.argument('release')
-def build(release, build_dependencies, build_image, push, **kwargs):
+@click.pass_obj
+def build(obj, release, build_dependencies, build_image, push, force, **kwargs):
     """
     Build docker image for <release> (version specifiers can be used).
     """
-    collect = {}  # will contain all collected information
-    docker_client = utils.docker_get_client()
-    collect['release'] = release
+    engine = get_engine(obj)
+    options = dict(
+        build_dependencies=build_dependencies, build_image=build_image, push=push, force=force, ledger=get_ledger(obj),
+    )
+    if kwargs['watch']:
+        watch_build(obj, engine, release, kwargs, **options)
+    else:
+        config = parse_build_config(kwargs)
+        build_and_collect(obj, engine, config, release, kwargs, **options)
 
-    config = utils.parse_config(
+
+def parse_build_config(kwargs):
+    return utils.parse_config(
         kwargs['config'],
         runtime=kwargs['runtime'],
         entrypoint_name=kwargs['entrypoint'],
         pip_constraint=kwargs['pip_constraint'],
+        wheel_cache=kwargs['wheel_cache'],
+        pip_cache=kwargs['pip_cache'],
+        package_cache=kwargs['package_cache'],
+        docker_hosts=kwargs['docker_host'],
+        build_slots=kwargs['build_slots'],
+        compiler_cpus=kwargs['compiler_cpus'],
+        compiler_memory=kwargs['compiler_memory'],
+        build_jobs=kwargs['build_jobs'],
+        ccache=kwargs['ccache'],
+        compiler_tmpfs=kwargs['compiler_tmpfs'],
+        compiler_superset=kwargs['compiler_superset'],
         docker_image_prefix=kwargs['image_prefix'],
         image_base_name=kwargs['image_base_name'],
         volumes=kwargs['volume'],
         ports=kwargs['port'],
+        runner_build_mode=kwargs['runner_build_mode'],
+        wheel_server_idle_timeout=kwargs['wheel_server_idle_timeout'],
     )
-    image_name = kwargs['image_name'] or utils.default_image_name(config, release)
-    collect['image'] = image_name
 
-    # Raise if grocker do not known the runtime
-    if config['runtime'] not in config['system']['runtime']:
-        raise RuntimeError('Unknown runtime: %s', config['runtime'])
 
-    if build_dependencies:
-        logger.info('Compiling dependencies...')
-        builders.get_or_build_root_image(docker_client, config)
-        compiler = builders.get_or_build_compiler_image(docker_client, config)
-        collect['compiler_image'] = compiler.tags[0]
+def build_and_collect(obj, engine, config, release, kwargs, **options):
+    pool = [get_engine(obj, base_url=host) for host in config['docker_hosts']]
+    collect = build_release(
+        engine, pool, config, release,
+        pip_conf=kwargs['pip_conf'],
+        image_name=kwargs['image_name'],
+        **options
+    )
 
-        with helpers.pip_conf(pip_conf_path=kwargs['pip_conf']) as pip_conf:
-            builders.compile_wheels(
-                docker_client=docker_client,
-                config=config,
-                release=release,
-                pip_conf=pip_conf,
+    if kwargs['export']:
+        with helpers.timed(collect.setdefault('timings', {}), 'export'):
+            collect['export'] = export_image(
+                engine, collect['image'], kwargs['export'],
+                compression=kwargs['export_compression'], previous_manifest=kwargs['previous_export'],
             )
 
-    if build_image:
-        logger.info('Building image...')
-        root_image = builders.get_or_build_root_image(docker_client, config)
-        collect['root_image'] = root_image.tags[0]
-        builders.build_runner_image(
-            docker_client=docker_client,
-            config=config,
-            name=image_name,
-            release=release,
+    if kwargs['result_file']:
+        helpers.dump_yaml(kwargs['result_file'], collect)
+    return collect
+
+
+def watch_build(obj, engine, release, kwargs, **options):
+    """
+    Build <release>, then build again the invalidated stages each time a build input changes
+
+    Root and compiler images are found by name, so only the wheels and runner
+    stages are skipped when they are not invalidated.
+    """
+    keys = None
+    constraint = kwargs['pip_constraint']
+    while True:
+        paths = list(kwargs['config'] or ['.grocker.yml']) + [kwargs['pip_conf'], constraint]
+        paths = sorted(set(path for path in paths if path))
+        mtimes = watch.get_mtimes(paths)
+        try:
+            config = parse_build_config(kwargs)
+            constraint = config['pip_constraint']
+            image_name = kwargs['image_name'] or utils.default_image_name(config, release)
+            current = watch.stage_keys(config, release, image_name, kwargs['pip_conf'])
+            stages = watch.invalidated_stages(keys, current)
+            logger.info('Invalidated stages: %s', ', '.join(stages) or 'none')
+            if stages:
+                build_and_collect(obj, engine, config, release, kwargs, **dict(
+                    options,
+                    build_dependencies=options['build_dependencies'] and 'wheels' in stages,
+                    build_image=options['build_image'] and 'runner' in stages,
+                    push=options['push'] and 'runner' in stages,
+                    force=options['force'] or keys is not None,  # the runner inputs changed
+                ))
+            keys = current
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error('Build failed: %s', e)
+
+        if constraint and constraint not in paths:
+            continue  # the constraint file is known from the config, watch it too
+        logger.info('Watching %s...', ', '.join(paths))
+        watch.wait_for_changes(paths, mtimes)
+
+
+@main.command('export')
+@click.argument('image')
+@click.argument('output', type=click.Path(exists=False))
+@click.option(
+    '--compression', type=click.Choice(builders.oci.COMPRESSIONS), default='gzip',
+    help='compression of the exported layers (zstd needs the zstandard package)',
+)
+@click.option(
+    '--previous-manifest', type=click.Path(exists=True), metavar='<filename>',
+    help='export manifest of the layers the target already has (they are not exported again)',
+)
+@click.option('-w', '--workers', type=int, metavar='<count>', help='number of layers compressed in parallel')
+@click.pass_obj
+def export_command(obj, image, output, compression, previous_manifest, workers):
+    """
+    Export <image> as an OCI image layout archive.
+    """
+    engine = get_engine(obj)
+    export_image(engine, image, output, compression, previous_manifest, workers)
+
+
+def format_metric(metric, value):
+    if metric == 'rss':
+        return '{:.1f}MiB'.format(value / 1024.0 / 1024)
+    return '{:.1f}ms'.format(value * 1e3)
+
+
+@main.command('bench-image')
+@click.argument('image')
+@click.option('-n', '--runs', default=5, metavar='<count>', help="number of cold starts measured")
+@click.option(
+    '--probe-command', metavar='<command>',
+    help="command given to the image entrypoint to time it (eg. '--version')",
+)
+@click.option(
+    '--package', metavar='<package>', help="package to import (by default, the top-level package of the app)",
+)
+@click.option(
+    '--result-file', type=click.Path(exists=False), metavar='<filename>',
+    help="yaml file where results (latencies, import times, memory, ...) are written",
+)
+@click.option(
+    '--baseline', type=click.Path(exists=True), metavar='<filename>',
+    help="result file of a previous benchmark: fail if a metric regressed",
+)
+@click.option(
+    '--tolerance', default=20.0, metavar='<percent>', help="regression allowed on the median of each metric",
+)
+@click.pass_obj
+def bench_image(obj, image, runs, probe_command, package, result_file, baseline, tolerance):
+    """
+    Measure the cold start (latencies, import time and memory) of <image>.
+    """
+    engine = get_engine(obj)
+    try:
+        result = bench.bench_image(
+            engine, image, runs, command=probe_command.split() if probe_command else None, package=package,
         )
+    except bench.BenchError as e:
+        raise click.ClickException(str(e))
 
-    if push:
-        if not builders.is_prefixed_image(image_name):
-            logger.warning('Not pushing any image since the registry is unclear in %s', image_name)
-        else:
-            logger.info('Pushing image...')
-            image = builders.docker_push_image(docker_client, image_name)
-            collect['hash'] = [x.split('@')[1] for x in image.attrs['RepoDigests']][0]
+    for metric in bench.METRICS:
+        if metric in result['metrics']:
+            logger.info('%s: %s', metric, ', '.join(
+                '{} {}'.format(key, format_metric(metric, result['metrics'][metric][key]))
+                for key in ('first', 'min', 'median', 'max')
+            ))
+    for module in result['importtime'][:5]:
+        logger.info('Slow import: %s (%.1fms)', module['module'], module['self'] * 1e3)
+    if result_file:
+        helpers.dump_yaml(result_file, {'bench': result})
 
-    if kwargs['result_file']:
-        helpers.dump_yaml(kwargs['result_file'], collect)
+    if baseline:
+        found = bench.regressions(result, helpers.load_yaml(baseline)['bench'], tolerance / 100)
+        if found:
+            raise click.ClickException('Regressions above {}%: {}'.format(tolerance, ', '.join(
+                '{} {:.4g} -> {:.4g}'.format(metric, reference, median) for metric, reference, median in found
+            )))
+
+
+@main.command()
+@click.option(
+    '-c', '--config', multiple=True, type=click.Path(exists=True), metavar='<filename>',
+    help='Grocker config file (each one is warmed up separately)',
+)
+@click.option(
+    '-r', '--runtime', multiple=True, metavar='<runtime>',
+    help="runtime to warm up (by default, all the runtimes known by the config)",
+)
+@click.option('--release', multiple=True, metavar='<release>', help="release whose dependencies are compiled")
+@click.option(
+    '--pip-conf', type=click.Path(exists=True), metavar='<filename>',
+    help="pip configuration file used to download dependencies (by default use pip config getter)",
+)
+@click.option(
+    '--pip-constraint', type=click.Path(exists=True), metavar='<filename>',
+    help="pip constraint file used to download dependencies",
+)
+@click.option(
+    '--package-cache', metavar='<managed|url>',
+    help="OS package caching proxy used to build root and compiler images ('managed' to let Grocker run it)",
+)
+@click.option(
+    '--docker-host', multiple=True, metavar='<url>',
+    help="additional Docker host used to compile dependencies (eg. tcp://docker-2:2375)",
+)
+@click.option(
+    '--build-slots', type=int, metavar='<count>',
+    help="maximum number of heavy stages (compilation, image builds) run at the same time on a Docker host",
+)
+@click.option(
+    '--image-prefix', metavar='<uri>',
+    help='docker registry or account on Docker official registry to use',
+)
+@click.option('-w', '--workers', type=int, metavar='<count>', help="number of configs warmed up at the same time")
+@click.option(
+    '--result-file', type=click.Path(exists=False), metavar='<filename>',
+    help="yaml file where results (image origins, timings, ...) are written",
+)
+@click.pass_obj
+def warm(obj, config, runtime, release, pip_conf, workers, result_file, **kwargs):
+    """
+    Pull or build builder images (and compile <release>s) ahead of builds.
+    """
+    matrix = builders.warm.config_matrix(
+        config, runtime,
+        pip_constraint=kwargs['pip_constraint'],
+        package_cache=kwargs['package_cache'],
+        docker_hosts=kwargs['docker_host'],
+        build_slots=kwargs['build_slots'],
+        docker_image_prefix=kwargs['image_prefix'],
+    )
+    engine = get_engine(obj)
+    pool = [get_engine(obj, base_url=host) for host in matrix[0][1]['docker_hosts']] if matrix else []
+    results = builders.warm.warm(engine, pool, matrix, release, pip_conf, workers)
+
+    for result in results:
+        summary = result.get('error') or ', '.join(
+            '{} {} in {:.1f}s'.format(stage, result['cache'].get(stage, 'compiled'), result['timings'][stage])
+            for stage in ('root', 'compiler', 'wheel-server', 'wheels') if stage in result['timings']
+        )
+        logger.info('%s (%s): %s', result['config'] or 'default config', result['runtime'], summary)
+    if result_file:
+        helpers.dump_yaml(result_file, {'warm': results})
+    failures = [result for result in results if 'error' in result]
+    if failures:
+        raise click.ClickException('{} of {} configs were not warmed up'.format(len(failures), len(results)))
+
+
+@main.group()
+def wheelhouse():
+    """
+    Manage the wheel volumes of the Docker host.
+    """
+
+
+@wheelhouse.command()
+@click.option('--unused-days', type=int, metavar='<days>', help="remove the wheels no build used for <days> days")
+@click.option(
+    '--unused-builds', type=int, metavar='<count>',
+    help="remove the wheels the last <count> builds of their volume did not use",
+)
+@click.option(
+    '-r', '--runtime', multiple=True, metavar='<runtime>',
+    help="only compact the wheel volumes of this runtime (by default, all of them)",
+)
+@click.option('--dry-run', is_flag=True, help="only report the wheels which would be removed")
+@click.option(
+    '--result-file', type=click.Path(exists=False), metavar='<filename>',
+    help="yaml file where results (removed wheels, freed space, ...) are written",
+)
+@click.pass_obj
+def compact(obj, unused_days, unused_builds, runtime, dry_run, result_file):
+    """
+    Remove the wheels builds did not use lately.
+    """
+    if unused_days is None and unused_builds is None:
+        raise click.UsageError('Missing option --unused-days or --unused-builds')
+    engine = get_engine(obj)
+
+    results = []
+    for volume in builders.wheels.wheel_volumes(engine, runtime):
+        image = builders.wheels.compaction_image(engine, volume)
+        if image is None:  # the compiler of another runtime may not run the compaction
+            logger.warning(
+                '%s: no %s compiler image of Grocker %s, not compacted',
+                volume.name, volume.labels.get('grocker.runtime'), __version__,
+            )
+            continue
+        result = builders.wheels.compact_wheelhouse(engine, image, volume.name, unused_days, unused_builds, dry_run)
+        if result is None:
+            logger.warning('%s: no compaction result', volume.name)
+            continue
+        logger.info(
+            '%s: %d of %d wheels %s (%.1f MiB), pip resolution time %.2fs -> %.2fs', volume.name,
+            result['removed'], result['wheels'], 'unused' if dry_run else 'removed', result['freed'] / 1024.0 / 1024,
+            result['resolution_time']['before'], result['resolution_time']['after'],
+        )
+        results.append(dict(result, volume=volume.name, runtime=volume.labels.get('grocker.runtime')))
+    logger.info(
+        '%.1f MiB %s in %d wheel volumes', sum(result['freed'] for result in results) / 1024.0 / 1024,
+        'to free' if dry_run else 'freed', len(results),
+    )
+    if result_file:
+        helpers.dump_yaml(result_file, {'compact': results})
+
+
+@main.command()
+@click.option(
+    '-c', '--config', multiple=True, type=click.Path(exists=True), metavar='<filename>',
+    help='Grocker config file (used as base config of every build)',
+)
+@click.option(
+    '--pip-conf', type=click.Path(exists=True), metavar='<filename>',
+    help="pip configuration file used to download dependencies (by default use pip config getter)",
+)
+@click.option('-b', '--bind', default='127.0.0.1:8080', metavar='<host:port>', help="address of the HTTP API")
+@click.option(
+    '--state-dir', default='~/.cache/grocker/server', metavar='<directory>',
+    help="directory where the build queue and logs are stored",
+)
+@click.option('-w', '--workers', default=1, metavar='<count>', help="number of builds run at the same time")
+@click.pass_obj
+def serve(obj, config, pip_conf, bind, state_dir, workers):
+    """Run a build service (submit builds through its HTTP API)."""
+    host, _, port = bind.rpartition(':')
+    jobs = server.JobQueue(os.path.expanduser(state_dir))
+    build_server = server.BuildServer(
+        jobs, obj['engine'], functools.partial(build_release, ledger=get_ledger(obj)),
+        config_paths=config, pip_conf=pip_conf, policy=obj['policy'],
+    )
+    with server.capture_output(jobs):
+        build_server.start(workers)
+        server.serve((host or '127.0.0.1', int(port)), build_server)
+
+
+@main.command()
+@click.option('-n', '--limit', default=20, metavar='<count>', help="number of builds to show")
+@click.option('--release', metavar='<pattern>', help="only show releases matching this pattern (eg. 'my-project==%')")
+@click.pass_obj
+def history(obj, limit, release):
+    """Show the last builds recorded in the ledger."""
+    ledger = get_ledger(obj)
+    if ledger is None:
+        raise click.UsageError('The build ledger is disabled')
+    for build in ledger.history(limit=limit, release=release):
+        click.echo('{started}  {outcome:<9}  {duration:>8.1f}s  {runtime:<10}  {release}  {image}'.format(
+            **dict(build, started=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(build['started'])))
+        ))
+
+
+@main.command()
+@click.option('--days', type=int, metavar='<days>', help="only use the builds of the last <days> days")
+@click.pass_obj
+def stats(obj, days):
+    """Show build statistics (durations, cache hit rates, ...) from the ledger."""
+    ledger = get_ledger(obj)
+    if ledger is None:
+        raise click.UsageError('The build ledger is disabled')
+    data = ledger.stats(since=time.time() - days * 86400 if days else None)
+
+    click.echo('Builds: {} ({})'.format(data['builds'], ', '.join(
+        '{} {}'.format(count, outcome) for outcome, count in sorted(data['outcomes'].items())
+    )))
+    click.echo('Durations (successful builds):')
+    for stage in ('build',) + watch.STAGES + ('push',):
+        if stage in data['durations']:
+            click.echo('  {:<9} median {median:>8.1f}s  mean {mean:>8.1f}s  ({count} builds)'.format(
+                stage, **data['durations'][stage]
+            ))
+    click.echo('Cache hit rates:')
+    for stage, rate in sorted(data['cache_hit_rates'].items()):
+        click.echo('  {:<9} {:>5.1f}%'.format(stage, rate * 100))
+    if data['image_size']:
+        click.echo('Mean image size: {:.1f} MiB'.format(data['image_size'] / 1024 / 1024))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+Benchmark the cold start of a runner image.
+
+Each run measures, on fresh containers:
+
+* `start`: the creation and start of a container (with the image entrypoint),
+* `entrypoint`: the run of a probe command until it exits (if one is given),
+* `interpreter`, `import` and `rss`: the interpreter startup, the import of the
+  app top-level package and the memory used once it is imported (as measured
+  by the ``resources/bench/probe.py`` script, run by the image python).
+
+Results can be compared with the ones of a previous benchmark to detect
+regressions.
+"""
+
+import json
+import logging
+import time
+
+import pkg_resources
+
+from . import ledger
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('start', 'entrypoint', 'interpreter', 'import', 'rss')
+PROBE_RESOURCE = 'resources/bench/probe.py'
+PYTHON = 'python'
+
+
+class BenchError(Exception):
+    pass
+
+
+def summarize(samples):
+    """Return the first, min, median and max of `samples`."""
+    return {
+        'first': samples[0],
+        'min': min(samples),
+        'median': ledger._median(samples),  # pylint: disable=protected-access
+        'max': max(samples),
+    }
+
+
+def run_probe(engine, image, package=None):
+    """
+    Run the probe script with the python of `image`
+
+    Returns:
+        dict: the probe results (package, python version, interpreter and import
+        durations in seconds, rss in bytes and the slowest imported modules)
+    """
+    source = pkg_resources.resource_string('grocker', PROBE_RESOURCE).decode('utf-8')
+    return_code, output = engine.run_output(
+        image, [package] if package else [], entrypoint=[PYTHON, '-c', source],
+    )
+    lines = output.decode('utf-8', 'replace').strip().splitlines()
+    if return_code or not lines:
+        raise BenchError('The probe failed in {} (exit code {}): {}'.format(
+            image, return_code, '\n'.join(lines[-5:]) or 'no output',
+        ))
+    return json.loads(lines[-1])
+
+
+def bench_image(engine, image, runs=5, command=None, package=None):
+    """
+    Benchmark the cold start of `image`
+
+    Args:
+        engine (grocker.engines.Engine): engine running the containers
+        image (str): runner image to benchmark
+        runs (int): number of runs (the first one is kept apart as `first`)
+        command (list): probe command given to the image entrypoint (eg. ['--version'])
+        package (str): package to import (by default, the top-level package of the app)
+
+    Returns:
+        dict: the image, its run count, the summary (see summarize) of each
+        metric, their samples and the slowest modules imported by the last run
+    """
+    samples = dict((metric, []) for metric in METRICS)
+    probe = {}
+    for run in range(runs):
+        logger.info('Benchmarking %s (run %d/%d)...', image, run + 1, runs)
+        start = time.time()
+        container = engine.start_container(image)
+        samples['start'].append(time.time() - start)
+        engine.remove_container(container.id, force=True)
+
+        if command:
+            start = time.time()
+            return_code, _ = engine.run_output(image, command)
+            samples['entrypoint'].append(time.time() - start)
+            if return_code:
+                raise BenchError('The probe command failed in {} (exit code {})'.format(image, return_code))
+
+        probe = run_probe(engine, image, package)
+        for metric in ('interpreter', 'import', 'rss'):
+            samples[metric].append(probe[metric])
+
+    samples = dict((metric, values) for metric, values in samples.items() if values)
+    return {
+        'image': image,
+        'runs': runs,
+        'package': probe.get('package'),
+        'python': probe.get('python'),
+        'metrics': dict((metric, summarize(values)) for metric, values in samples.items()),
+        'samples': samples,
+        'importtime': probe.get('importtime', []),
+    }
+
+
+def regressions(result, baseline, tolerance=0.2):
+    """
+    Compare the medians of `result` with the ones of `baseline` (a previous bench_image result)
+
+    Returns:
+        list: (metric, baseline median, median) tuples of the metrics more than
+        `tolerance` (a ratio) above their baseline
+    """
+    found = []
+    for metric, summary in sorted(result['metrics'].items()):
+        reference = baseline.get('metrics', {}).get(metric)
+        if reference and summary['median'] > reference['median'] * (1 + tolerance):
+            found.append((metric, reference['median'], summary['median']))
+    return found
@@ -3,35 +3,78 @@
 
 
 
-from . import build
-from .build import build_runner_image
-from . import naming
+import logging
+
+from .. import engines
+from .. import utils
+from .build import build_runner_image, get_or_build_compiler_image, get_or_build_root_image, is_multi_stage
+from . import distributed
+from . import oci
 from . import op
+from . import warm
+from . import wheels
 from .op import docker_push_image, is_prefixed_image
 from .wheels import compile_wheels
 
 
 __all__ = [
     'build_runner_image',
+    'is_multi_stage',
     'docker_push_image',
     'is_prefixed_image',
     'compile_wheels',
+    'distributed',
+    'oci',
+    'warm',
+    'wheels',
     'get_or_build_root_image',
     'get_or_build_compiler_image',
+    'find_runner_image',
+    'runner_fingerprint',
 ]
 
+logger = logging.getLogger(__name__)
+
+
+def find_runner_image(engine, name, fingerprint):
+    """
+    Find an image built from the same inputs as the runner `name`
+
+    An image (local, or in the registry for prefixed names) is a match when its
+    `grocker.runner.fingerprint` label is `fingerprint`. A local match is tagged
+    as `name` if needed. A registry image which does not match does not replace
+    the local image `name`.
+
+    Returns:
+        grocker.engines.Image: the matching image (or None)
+    """
+    try:
+        local_image = engine.get_image(name)
+        if local_image.labels.get('grocker.runner.fingerprint') == fingerprint:
+            return local_image
+    except engines.ImageNotFound:
+        local_image = None
+
+    images = engine.list_images(label='grocker.runner.fingerprint={}'.format(fingerprint))
+    if images:
+        logger.info('Tagging image %s as %s...', images[0].id, name)
+        engine.tag_image(images[0].id, name)
+        return engine.get_image(name)
 
-def get_or_build_root_image(docker_client, config):
-    return op.docker_get_or_build_image(
-        docker_client,
-        naming.image_name(config, 'root'),
-        lambda client: build.build_root_image(client, config)
-    )
+    if op.is_prefixed_image(name):
+        try:
+            image = op.docker_pull_image(engine, name)
+        except engines.NotFound:
+            return None
+        if image.labels.get('grocker.runner.fingerprint') == fingerprint:
+            return image
+        if local_image is not None and image.id != local_image.id:
+            logger.info('Image %s from the registry does not match, keeping the local one...', name)
+            engine.tag_image(local_image.id, name)
+    return None
 
 
-def get_or_build_compiler_image(docker_client, config):
-    return op.docker_get_or_build_image(
-        docker_client,
-        naming.image_name(config, 'compiler'),
-        lambda client: build.build_compiler_image(client, config)
-    )
+def runner_fingerprint(engine, config, release, cache=None):
+    """Return the fingerprint of all inputs of the runner image build (see utils.runner_identifier)."""
+    root_image = get_or_build_root_image(engine, config, cache)
+    return utils.runner_identifier(config, release, root_image.id)
@@ -5,26 +5,191 @@
 
 import contextlib
 import logging
+import os
 import os.path
 import shutil
+import tarfile
+import tempfile
+import time
+import uuid
 
-import docker.errors
 from packaging import requirements
 
 from .. import __version__
+from .. import engines
 from .. import helpers
+from .. import locks
 from .. import utils
 from . import op
 from . import naming
 
 logger = logging.getLogger(__name__)
 
+PACKAGE_CACHE_DIRECTORY = '/var/cache/apt-cacher-ng'
+PACKAGE_CACHE_PORT = 3142
+PACKAGE_CACHE_HOST = 'grocker-package-cache'  # hostname of the managed package cache in image builds
+WHEEL_SERVER_VOLUME_LABEL = 'grocker.wheel-server.volume'
+WHEEL_SERVER_LEASES_PATH = '/leases'
+WHEEL_SERVER_LEASE_TIMEOUT = 3 * 3600  # seconds after which the lease of a build which did not release it expires
+CACHE_FROM_IMAGES = 5  # maximum number of local images used as build cache
+COMPILER_BASE_LABEL = 'grocker.compiler.base'
+COMPILER_PACKAGES_LABEL = 'grocker.compiler.packages'
+
 
 def should_pull(config):
     return bool(config['docker_image_prefix'])
 
 
-def build_root_image(docker_client, config):
+def is_multi_stage(config):
+    return config['runner_build_mode'] == 'multi-stage'
+
+
+def get_or_build_root_image(engine, config, cache=None):
+    return op.docker_get_or_build_image(
+        engine,
+        naming.image_name(config, 'root'),
+        lambda client: build_root_image(client, config),
+        cache=cache,
+        role='root',
+        slots=config.get('build_slots'),
+    )
+
+
+def get_or_build_compiler_image(engine, config, cache=None):
+    cache = {} if cache is None else cache
+
+    def builder(client):
+        if config.get('compiler_superset'):
+            image = find_superset_compiler_image(client, config)
+            if image:
+                cache.setdefault('compiler', 'reused')
+                return image
+        return build_compiler_image(client, config)
+
+    return op.docker_get_or_build_image(
+        engine,
+        naming.image_name(config, 'compiler'),
+        builder,
+        cache=cache,
+        role='compiler',
+        slots=config.get('build_slots'),
+    )
+
+
+def get_or_build_wheel_server_image(engine, config, cache=None):
+    return op.docker_get_or_build_image(
+        engine,
+        naming.image_name(config, 'wheel-server'),
+        lambda client: build_wheel_server_image(client, config),
+        cache=cache,
+        role='wheel-server',
+    )
+
+
+def cache_from_images(engine, config, role):
+    """
+    Return the images whose layers the build of the `role` image of `config` can reuse
+
+    Candidates are the `role` images of the same runtime (and Grocker version)
+    built for other configs: the local ones, and the last one pushed to the
+    registry (see push_cache_image) which is pulled if needed.
+
+    Returns:
+        list: names (or ids) of local images
+    """
+    name = naming.image_name(config, role)
+    labels = {'grocker.version': __version__, 'grocker.image.role': role, 'grocker.runtime': config['runtime']}
+
+    def matches(image):
+        return all(image.labels.get(key) == value for key, value in labels.items())
+
+    candidates = [
+        image.tags[0] if image.tags else image.id
+        for image in engine.list_images(label='grocker.image.role={}'.format(role))
+        if matches(image) and name not in image.tags
+    ][:CACHE_FROM_IMAGES]
+
+    if should_pull(config):
+        latest = naming.image_name(config, role, latest=True)
+        if latest not in candidates:
+            try:
+                if matches(op.docker_pull_image(engine, latest)):
+                    candidates.insert(0, latest)
+            except engines.NotFound:
+                pass
+
+    if candidates:
+        logger.info('Using %s as build cache of %s', ', '.join(candidates), name)
+    return candidates
+
+
+def push_cache_image(engine, config, role):
+    """
+    Push the `role` image of `config` as the last one built for its runtime
+
+    See cache_from_images (root images) and find_superset_compiler_image (compiler images).
+    """
+    latest = naming.image_name(config, role, latest=True)
+    engine.tag_image(naming.image_name(config, role), latest)
+    op.docker_push_image(engine, latest)
+
+
+def compiler_labels(config):
+    """
+    Return the labels of the compiler image of `config`: its runtime, base and package set
+
+    The base identifies the root image by its config inputs, not by its name, so
+    that configs with another image prefix (eg. another registry) share it.
+    """
+    return {
+        'grocker.runtime': config['runtime'],
+        COMPILER_BASE_LABEL: '{}-{}'.format(config['runtime'], utils.config_identifier(config, 'root')),
+        COMPILER_PACKAGES_LABEL: ' '.join(sorted(set(
+            utils.get_dependencies(config, with_build_dependencies=True)
+        ))),
+    }
+
+
+def find_superset_compiler_image(engine, config):
+    """
+    Find a compiler image providing (at least) the packages needed by `config`, and tag it as its compiler image
+
+    A compiler image (local, or the last one pushed to the registry for the
+    runtime) is a match when it has the same runtime, root image inputs and
+    Grocker version as `config`, and its package set is a superset of the one of
+    `config`. The match with the fewest packages is used.
+
+    Returns:
+        grocker.engines.Image: the compiler image of `config` (or None)
+    """
+    labels = compiler_labels(config)
+    packages = set(labels.pop(COMPILER_PACKAGES_LABEL).split())
+    labels['grocker.version'] = __version__
+
+    def is_superset(image):
+        return (
+            all(image.labels.get(key) == value for key, value in labels.items())
+            and packages <= set(image.labels.get(COMPILER_PACKAGES_LABEL, '').split())
+        )
+
+    images = [image for image in engine.list_images(label=COMPILER_PACKAGES_LABEL) if is_superset(image)]
+    if not images and should_pull(config):
+        try:
+            image = op.docker_pull_image(engine, naming.image_name(config, 'compiler', latest=True))
+            images = [image] if is_superset(image) else []
+        except engines.NotFound:
+            pass
+    if not images:
+        return None
+
+    image = min(images, key=lambda image: (len(image.labels[COMPILER_PACKAGES_LABEL].split()), image.size or 0))
+    name = naming.image_name(config, 'compiler')
+    logger.info('Tagging compiler image %s (a superset of the dependencies) as %s...', image.id, name)
+    engine.tag_image(image.id, name)
+    return engine.get_image(name)
+
+
+def build_root_image(engine, config):
     with op.docker_build_context('resources/docker/root-image') as build_dir:
         context = {
             'base_image': config['system']['image'],
@@ -50,16 +215,25 @@ def build_root_image(docker_client, config):
         build_env = {
             'SYSTEM_DEPENDENCIES': ' '.join(dependencies),
         }
-        return op.docker_build_image(
-            docker_client,
-            build_dir,
-            naming.image_name(config, 'root'),
-            buildargs=build_env,
-            role='root',
-        )
+        with package_cache(engine, config) as (package_proxy, extra_hosts):
+            if package_proxy:
+                build_env['PACKAGE_PROXY'] = package_proxy
+            image = op.docker_build_image(
+                engine,
+                build_dir,
+                naming.image_name(config, 'root'),
+                buildargs=build_env,
+                extra_hosts=extra_hosts,
+                role='root',
+                labels={'grocker.runtime': config['runtime']},
+                cache_from=cache_from_images(engine, config, 'root'),
+            )
+    if should_pull(config):
+        push_cache_image(engine, config, 'root')
+    return image
 
 
-def build_compiler_image(docker_client, config):
+def build_compiler_image(engine, config):
     with op.docker_build_context('resources/docker/compiler-image') as build_dir:
         context = {
             'base_image': naming.image_name(config, 'root'),
@@ -76,26 +250,46 @@ def build_compiler_image(docker_client, config):
         build_env = {
             'SYSTEM_DEPENDENCIES': ' '.join(dependencies),
         }
-        return op.docker_build_image(
-            docker_client,
-            build_dir,
-            naming.image_name(config, 'compiler'),
-            buildargs=build_env,
-            role='compiler',
-        )
+        with package_cache(engine, config) as (package_proxy, extra_hosts):
+            if package_proxy:
+                build_env['PACKAGE_PROXY'] = package_proxy
+            image = op.docker_build_image(
+                engine,
+                build_dir,
+                naming.image_name(config, 'compiler'),
+                buildargs=build_env,
+                extra_hosts=extra_hosts,
+                role='compiler',
+                labels=compiler_labels(config),
+            )
+    # no cache_from: the compiler image is provisioned in a single step, depending on all its
+    # dependencies, the latest pushed one is only a candidate of find_superset_compiler_image
+    if should_pull(config) and config.get('compiler_superset'):
+        push_cache_image(engine, config, 'compiler')
+    return image
 
 
-def build_wheel_server_image(docker_client, config):
+def build_wheel_server_image(engine, config):
     with op.docker_build_context('resources/docker/wheel-server') as build_dir:
         return op.docker_build_image(
-            docker_client,
+            engine,
             build_dir,
             naming.image_name(config, 'wheel-server'),
             role='wheel-server',
         )
 
 
-def build_runner_image(docker_client, config, name, release):
+def build_package_cache_image(engine, config):
+    with op.docker_build_context('resources/docker/package-cache') as build_dir:
+        return op.docker_build_image(
+            engine,
+            build_dir,
+            naming.image_name(config, 'package-cache'),
+            role='package-cache',
+        )
+
+
+def build_runner_image(engine, config, name, release, labels=None):
     requirement = requirements.Requirement(release)
 
     # Markers would not make much sense here and url are unsupported.
@@ -111,6 +305,7 @@ def build_runner_image(docker_client, config, name, release):
             'app_version': helpers.get_version_from_requirement(requirement),
             'volumes': config['volumes'],
             'ports': config['ports'],
+            'compiler_image': naming.image_name(config, 'compiler') if is_multi_stage(config) else None,
         }
 
         helpers.render_template(
@@ -125,43 +320,232 @@ def build_runner_image(docker_client, config, name, release):
                 os.path.join(build_dir, 'constraints.txt'),
             )
 
-        with wheel_server(docker_client, config) as wheel_server_ip:
+        if is_multi_stage(config):
+            # The app venv is built in a compiler based stage from the wheels
+            # copied in the build context, then copied alone on the root image.
+            op.docker_export_volume(
+                engine,
+                context['compiler_image'],
+                naming.wheel_volume_name(config),
+                '/home/grocker/packages',
+                build_dir,
+            )
+            with locks.build_slot(engine, config.get('build_slots')):
+                return op.docker_build_image(
+                    engine,
+                    build_dir,
+                    name,
+                    role='runner',
+                    labels=labels,
+                    nocache=True,
+                )
+
+        with locks.build_slot(engine, config.get('build_slots')), wheel_server(engine, config) as wheel_server_ip:
             build_env = {
                 'GROCKER_WHEEL_SERVER_IP': wheel_server_ip,
             }
             return op.docker_build_image(
-                docker_client,
+                engine,
                 build_dir,
                 name,
                 role='runner',
+                labels=labels,
                 buildargs=build_env,
                 nocache=True,
             )
 
 
+def start_wheel_server(engine, config, environment=None, labels=None, volumes=None):
+    image = get_or_build_wheel_server_image(engine, config)
+
+    computed_labels = {
+        'grocker.version': __version__,
+        'grocker.image.role': 'wheel-server',
+    }
+    computed_labels.update(labels or {})
+    computed_volumes = {
+        naming.wheel_volume_name(config): {
+            'bind': '/wheels',
+            'mode': 'ro',
+        },
+    }
+    computed_volumes.update(volumes or {})
+    container = engine.start_container(
+        image.id,
+        volumes=computed_volumes,
+        environment=environment,
+        labels=computed_labels,
+    )
+    logger.info('Starting http server in container: %s', container.id)
+    logger.debug('http server running with ip: %s', container.ip_address)
+    return container
+
+
+def container_ip_address(engine, container):
+    """Return the IP address of `container`, removing it when it has none (eg. with rootless podman)."""
+    if not container.ip_address:
+        engine.remove_container(container.id, force=True)
+        raise engines.EngineError('Container {} has no IP address, builds cannot reach it'.format(container.id))
+    return container.ip_address
+
+
 @contextlib.contextmanager
-def wheel_server(docker_client, config):
+def wheel_server(engine, config):
+    """
+    Yield the IP address of a wheel server serving the wheel volume of `config`
+
+    By default, the wheel server container is started for the build and removed
+    afterwards. When `wheel_server_idle_timeout` is set, it is shared with the
+    next builds (see shared_wheel_server).
+    """
+    if config.get('wheel_server_idle_timeout'):
+        with shared_wheel_server(engine, config) as server_ip:
+            yield server_ip
+        return
+
+    container = start_wheel_server(engine, config)
+    server_ip = container_ip_address(engine, container)
+    try:
+        yield server_ip
+    finally:
+        engine.remove_container(container.id, force=True)
+
+
+def find_shared_wheel_server(engine, volume_name, state_path, idle_timeout):
+    """
+    Return the running shared wheel server of `volume_name` when it can be reused (or None)
+
+    The state file holds the id of the last started server, and its modification
+    time is the last time a build used it: builds hold a lease on the server
+    until they end (see write_wheel_server_lease), and the server counts its idle
+    time from the release of the last lease. A server idle for more than half
+    its idle timeout may stop before the build requests it, so it is not reused.
+    Exited servers are removed.
+    """
+    label = '{}={}'.format(WHEEL_SERVER_VOLUME_LABEL, volume_name)
+    for container in engine.list_containers(label=label, status='exited'):
+        try:
+            engine.remove_container(container.id)
+        except engines.EngineError as e:
+            logger.warning('Unable to remove wheel server %s: %s', container.id, e)
+
+    if not os.path.exists(state_path) or time.time() - os.path.getmtime(state_path) > idle_timeout / 2.0:
+        return None
+    with open(state_path) as fp:
+        container_id = fp.read().strip()
+    running = engine.list_containers(label=label, status='running')
+    return next((container for container in running if container.id == container_id), None)
+
+
+def write_wheel_server_lease(engine, config, directory, lease):
+    """
+    Write the `lease` file in `directory` of the lease volume of the shared wheel servers of `config`
+
+    A build holds a lease (in `leases`) until it releases it (in `released`):
+    the servers do not stop while a lease is held, for instance while the
+    runner image build installs OS packages, before pip requests the wheels.
+    """
+    with tempfile.TemporaryFile() as fp:
+        with tarfile.open(fileobj=fp, mode='w') as tar:
+            info = tarfile.TarInfo(directory)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            info.mtime = time.time()
+            tar.addfile(info)
+            info = tarfile.TarInfo('{}/{}'.format(directory, lease))
+            info.mtime = time.time()  # a lease expires after WHEEL_SERVER_LEASE_TIMEOUT seconds
+            tar.addfile(info)
+        fp.seek(0)
+        engine.import_path(
+            naming.image_name(config, 'wheel-server'),
+            WHEEL_SERVER_LEASES_PATH,
+            fp,
+            volumes={naming.wheel_server_volume_name(config): {'bind': WHEEL_SERVER_LEASES_PATH, 'mode': 'rw'}},
+        )
+
+
+@contextlib.contextmanager
+def shared_wheel_server(engine, config):
+    """
+    Yield the IP address of the long-lived wheel server of the wheel volume of `config`
+
+    The server is found (or started) under a host-wide lock, so that concurrent
+    builds share it. The build holds a lease on it until it ends, it stops by
+    itself after `wheel_server_idle_timeout` seconds without request nor lease.
+    """
+    volume_name = naming.wheel_volume_name(config)
+    idle_timeout = config['wheel_server_idle_timeout']
+    state_path = locks.lock_path(engine, 'wheel-server:{}'.format(volume_name))
+    lease = uuid.uuid4().hex
+    with locks.stage_lock(engine, 'wheel-server:{}'.format(volume_name)):
+        container = find_shared_wheel_server(engine, volume_name, state_path, idle_timeout)
+        if container:
+            logger.info('Reusing http server in container: %s', container.id)
+        else:
+            leases_volume = op.get_or_create_data_volume(
+                engine, naming.wheel_server_volume_name(config), role='wheel-server',
+            )
+            container = start_wheel_server(
+                engine, config,
+                environment={
+                    'GROCKER_IDLE_TIMEOUT': str(idle_timeout),
+                    'GROCKER_LEASE_TIMEOUT': str(WHEEL_SERVER_LEASE_TIMEOUT),
+                },
+                labels={WHEEL_SERVER_VOLUME_LABEL: volume_name},
+                volumes={leases_volume.name: {'bind': WHEEL_SERVER_LEASES_PATH, 'mode': 'rw'}},
+            )
+            container_ip_address(engine, container)
+            with open(state_path, 'w') as fp:
+                fp.write(container.id)
+        write_wheel_server_lease(engine, config, 'leases', lease)
+        os.utime(state_path, None)
+    try:
+        yield container.ip_address
+    finally:
+        try:
+            write_wheel_server_lease(engine, config, 'released', lease)
+        except engines.EngineError as e:  # the lease expires
+            logger.warning('Unable to release the lease on http server %s: %s', container.id, e)
+        os.utime(state_path, None)
+
+
+@contextlib.contextmanager
+def package_cache(engine, config):
+    """
+    Yield the URL of the OS package caching proxy used by root and compiler builds, and their extra hosts
+
+    The `package_cache` setting is either empty (no proxy, None is yielded),
+    `managed` (Grocker runs an apt-cacher-ng container storing its cache in a
+    data volume kept between builds) or the URL of an existing proxy.
+
+    The URL of the managed proxy uses the PACKAGE_CACHE_HOST hostname (given
+    to the builds as an extra host): unlike the proxy container IP address,
+    the URL is the same for every build, and so is the `PACKAGE_PROXY`
+    build-arg (which would otherwise invalidate the build cache).
+    """
+    setting = config.get('package_cache')
+    if setting != 'managed':
+        yield setting or None, None
+        return
+
     image = op.docker_get_or_build_image(
-        docker_client,
-        naming.image_name(config, 'wheel-server'),
-        lambda client: build_wheel_server_image(client, config),
+        engine,
+        naming.image_name(config, 'package-cache'),
+        lambda client: build_package_cache_image(client, config),
     )
-
-    container = docker_client.containers.run(
-        image=image.id,
+    volume = op.get_or_create_data_volume(engine, naming.package_cache_volume_name(), role='package-cache')
+    container = engine.start_container(
+        image.id,
         volumes={
-            naming.wheel_volume_name(config): {
-                'bind': '/wheels',
-                'mode': 'ro',
+            volume.name: {
+                'bind': PACKAGE_CACHE_DIRECTORY,
+                'mode': 'rw',
             },
         },
-        detach=True,
     )
-    logger.info('Starting http server in container: %s', container.id)
-    container.reload()
-    server_ip = container.attrs['NetworkSettings']['IPAddress']
-    logger.debug('http server running with ip: %s', server_ip)
+    logger.info('Starting package cache in container: %s', container.id)
+    extra_hosts = {PACKAGE_CACHE_HOST: container_ip_address(engine, container)}
     try:
-        yield server_ip
+        yield 'http://{}:{}'.format(PACKAGE_CACHE_HOST, PACKAGE_CACHE_PORT), extra_hosts
     finally:
-        helpers.retry(docker.errors.APIError)(container.remove)(force=True)
+        engine.remove_container(container.id, force=True)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+Compile dependencies on a pool of container engines (eg. several Docker hosts).
+
+Pinned requirements of the constraint file are sharded across the pool, each
+shard being compiled (without dependencies) in the wheel volume of its engine.
+A pin failing to compile in a shard (eg. one the release does not need, for
+another platform) is left to the compilation of the release.
+Compiled wheels are then gathered in the wheel volume of the main engine, where
+the release itself is compiled: already gathered wheels are found by pip.
+"""
+
+import concurrent.futures
+import logging
+import posixpath
+import tempfile
+import uuid
+
+from packaging import requirements
+
+from . import build
+from . import naming
+from . import wheels
+
+logger = logging.getLogger(__name__)
+
+
+def get_pinned_requirements(config):
+    """Return the pinned requirements (`<name>==<version>`) of the pip constraint file."""
+    if not config['pip_constraint']:
+        return []
+
+    pinned = []
+    with open(config['pip_constraint']) as fp:
+        for line in fp:
+            line = line.split('#', 1)[0].strip()
+            if not line or line.startswith('-'):
+                continue
+            try:
+                requirement = requirements.Requirement(line)
+            except requirements.InvalidRequirement:
+                logger.warning('Ignoring invalid constraint %s', line)
+                continue
+            if any(specifier.operator in ('==', '===') for specifier in requirement.specifier):
+                pinned.append(line)
+    return sorted(set(pinned))
+
+
+def shard(items, count):
+    """Split `items` in `count` shards of (almost) the same size."""
+    return [items[i::count] for i in range(count)]
+
+
+def _wheel_volumes(engine, config, mode='rw'):
+    volume = wheels.get_or_create_wheel_volume(engine, config)
+    return {volume.name: {'bind': wheels.WHEELHOUSE_MOUNT_POINT, 'mode': mode}}
+
+
+def gather_wheels(source, destination, config, report_id):
+    """
+    Copy the wheels compiled on the `source` engine in the wheel volume of the `destination` engine
+
+    Only the wheels listed by the report of the `report_id` compilation are
+    copied, with the report (the main compilation records their usage, see
+    compile.py). The other content of the source volume (wheels of other
+    builds, usage and compaction files) stays there.
+    """
+    compiler_image = naming.image_name(config, 'compiler')
+    report = wheels.read_wheel_report(source, config, report_id)
+    names = sorted(set(entry['wheel'] for entry in report if entry['wheel']))
+    names.append(posixpath.join(posixpath.relpath(wheels.REPORTS_PATH, wheels.WHEELHOUSE_MOUNT_POINT), report_id))
+    stream = source.export_paths(
+        compiler_image, wheels.WHEELHOUSE_MOUNT_POINT, names, _wheel_volumes(source, config, 'ro'),
+    )
+    with tempfile.TemporaryFile() as fp:
+        for chunk in stream:
+            fp.write(chunk)
+        fp.seek(0)
+        destination.import_path(compiler_image, wheels.WHEELHOUSE_MOUNT_POINT, fp, _wheel_volumes(destination, config))
+
+
+def _compile_shard(engine, config, requirement_list, pip_conf, report_id):
+    logger.info('Compiling %d requirements on %s...', len(requirement_list), engine)
+    build.get_or_build_root_image(engine, config)
+    build.get_or_build_compiler_image(engine, config)
+    wheels.compile_wheels(
+        engine, config, requirement_list, pip_conf, no_deps=True, report_id=report_id, keep_going=True,
+    )
+    return engine
+
+
+def compile_wheels(engine, pool, config, release, pip_conf):
+    """
+    Compile the wheels of `release` using `engine` and the `pool` of engines
+
+    Args:
+        engine (grocker.engines.Engine): the engine whose wheel volume is used to build the runner
+        pool (list): other engines sharing the compilation of the pinned requirements
+        config (dict): the Grocker config
+        release (str): the release to compile
+        pip_conf (str): pip configuration file
+
+    Returns:
+        list: the wheel report of the compilation (see wheels.read_wheel_report)
+    """
+    report_id = uuid.uuid4().hex
+    pinned = get_pinned_requirements(config)
+    if pool and not pinned:
+        logger.warning('No pinned requirement in the pip constraint file, the compilation is not distributed.')
+
+    engines = [engine] + list(pool)
+    shards = [(e, s) for e, s in zip(engines, shard(pinned, len(engines))) if s] if pool else []
+    if shards:
+        logger.info('Distributing %d requirements on %d engines...', len(pinned), len(shards))
+        # the images of the main engine are used to gather the wheels of the other shards, maybe before its own
+        build.get_or_build_root_image(engine, config)
+        build.get_or_build_compiler_image(engine, config)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            futures = [executor.submit(_compile_shard, e, config, s, pip_conf, report_id) for e, s in shards]
+            for future in concurrent.futures.as_completed(futures):
+                shard_engine = future.result()
+                if shard_engine is not engine:
+                    logger.info('Gathering wheels compiled on %s...', shard_engine)
+                    gather_wheels(shard_engine, engine, config, report_id)
+
+    wheels.compile_wheels(engine, config, release, pip_conf, report_id=report_id)
+    return wheels.read_wheel_report(engine, config, report_id)  # shard reports were gathered with their wheels
@@ -7,9 +7,12 @@ from .. import __version__
 from .. import utils
 
 
-def image_name(config, role):
+def image_name(config, role, latest=False):
+    """Return the name of the `role` image of `config` (`latest` for the last one built for its runtime)."""
     image_name_template = 'grocker-{runtime}-{role}:{version}-{hash}'
-    if role == 'wheel-server':
+    if latest:
+        image_name_template = 'grocker-{runtime}-{role}:{version}-latest'
+    if role in ('wheel-server', 'package-cache'):
         image_name_template = 'grocker-{role}:{version}'
 
     if config['docker_image_prefix']:
@@ -20,6 +23,27 @@ def image_name(config, role):
         runtime=config['runtime'],
         role=role,
         version=__version__,
+        hash=utils.config_identifier(config, 'root' if role == 'root' else 'compiler'),
+    )
+
+
+def package_cache_volume_name():
+    return 'grocker-package-cache-{version}'.format(version=__version__)
+
+
+def pip_cache_volume_name():
+    return 'grocker-pip-cache-{version}'.format(version=__version__)
+
+
+def ccache_volume_name():
+    return 'grocker-ccache-{version}'.format(version=__version__)
+
+
+def wheel_server_volume_name(config):
+    """Return the name of the volume holding the leases of the shared wheel servers of the wheel volume of `config`."""
+    return 'grocker-wheel-server-{version}-{runtime}-{hash}'.format(
+        version=__version__,
+        runtime=config['runtime'],
         hash=utils.config_identifier(config),
     )
 
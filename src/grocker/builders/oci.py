@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+Export images as OCI image layout archives (for hosts without registry access).
+
+The image is saved by the engine (`docker save` format) in a temporary
+directory, its layers are compressed in parallel, then written with its config
+and an OCI manifest in a tar archive following the OCI image layout.
+
+An export manifest (the OCI manifest and the uncompressed digest of each layer)
+is written next to the archive. Given the export manifest of a previous export,
+the layers it lists are referenced by the new manifest but not written in the
+archive: the target already has them.
+"""
+
+import concurrent.futures
+import hashlib
+import io
+import json
+import logging
+import os
+import os.path
+import tarfile
+import tempfile
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+from .. import helpers
+from .. import six
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIONS = ('gzip', 'zstd')
+CHUNK_SIZE = 1024 * 1024
+MEDIA_TYPES = {
+    'config': 'application/vnd.oci.image.config.v1+json',
+    'manifest': 'application/vnd.oci.image.manifest.v1+json',
+    'gzip': 'application/vnd.oci.image.layer.v1.tar+gzip',
+    'zstd': 'application/vnd.oci.image.layer.v1.tar+zstd',
+}
+
+
+def get_compressor(compression):
+    """Return a compression object (with `compress` and `flush` methods) for `compression`."""
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstd compression needs the zstandard package (pip install grocker[zstd])')
+        return zstandard.ZstdCompressor(threads=-1).compressobj()
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip format, no timestamp
+
+
+def compress_layer(source, destination, compression):
+    """
+    Compress the layer `source` in `destination`
+
+    Returns:
+        dict: the OCI descriptor of the compressed layer
+    """
+    compressor = get_compressor(compression)
+    digest = hashlib.sha256()
+    size = 0
+
+    def write(data):
+        digest.update(data)
+        dst.write(data)
+        return len(data)
+
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            size += write(compressor.compress(chunk))
+        size += write(compressor.flush())
+    return {'mediaType': MEDIA_TYPES[compression], 'digest': 'sha256:' + digest.hexdigest(), 'size': size}
+
+
+def save_image(engine, name, directory):
+    """
+    Save the image `name` in `directory`
+
+    Returns:
+        tuple: the image config (bytes) and the paths of its (uncompressed) layers
+    """
+    logger.info('Saving image %s...', name)
+    with tempfile.TemporaryFile() as fp:
+        for chunk in engine.save_image(name):
+            fp.write(chunk)
+        fp.seek(0)
+        with tarfile.open(fileobj=fp) as tar:
+            tar.extractall(directory)
+
+    with open(os.path.join(directory, 'manifest.json')) as fp:
+        manifest, = json.load(fp)
+    with open(os.path.join(directory, manifest['Config']), 'rb') as fp:
+        config = fp.read()
+    return config, [os.path.join(directory, layer) for layer in manifest['Layers']]
+
+
+def load_export_manifest(path):
+    """Return the layer descriptors of an export manifest by uncompressed digest."""
+    if not path:
+        return {}
+    with open(path) as fp:
+        return {layer['diff_id']: layer['descriptor'] for layer in json.load(fp)['layers']}
+
+
+def _blob(data, media_type):
+    return {'mediaType': media_type, 'digest': 'sha256:' + hashlib.sha256(data).hexdigest(), 'size': len(data)}
+
+
+def _add_file(tar, name, path=None, data=None):
+    info = tarfile.TarInfo(name)
+    if path:
+        info.size = os.path.getsize(path)
+        with open(path, 'rb') as fp:
+            tar.addfile(info, fp)
+    else:
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
+def export_image(engine, name, output, compression='gzip', previous_manifest=None, workers=None):
+    """
+    Export the image `name` as an OCI image layout archive
+
+    Args:
+        engine (grocker.engines.Engine): the engine storing the image
+        name (str): the image to export
+        output (str): the archive path (the export manifest is written in `<output>.manifest.json`)
+        compression (str): layer compression, one of COMPRESSIONS
+        previous_manifest (str): export manifest of the layers the target already has
+        workers (int): number of layers compressed in parallel (by default, depends on the CPU count)
+
+    Returns:
+        dict: the archive and export manifest paths, layer counts, archive size and timings
+        (`transfer` from the engine, `compress` and `write`)
+    """
+    get_compressor(compression)  # fail early when unavailable
+    known_layers = load_export_manifest(previous_manifest)
+    timings = {}
+    with six.TemporaryDirectory() as tmp_dir:
+        with helpers.timed(timings, 'transfer'):
+            config, layers = save_image(engine, name, os.path.join(tmp_dir, 'image'))
+        diff_ids = json.loads(config.decode('utf-8'))['rootfs']['diff_ids']
+
+        # {<diff_id>: <compressed layer path>} of the layers the target misses
+        blobs = {
+            diff_id: os.path.join(tmp_dir, diff_id.split(':')[-1])
+            for diff_id in diff_ids if diff_id not in known_layers
+        }
+        with helpers.timed(timings, 'compress'):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers or (os.cpu_count() or 1)) as executor:
+                futures = {
+                    diff_id: executor.submit(compress_layer, layers[diff_ids.index(diff_id)], path, compression)
+                    for diff_id, path in blobs.items()
+                }
+                for diff_id, future in futures.items():
+                    known_layers[diff_id] = future.result()
+
+        manifest = {
+            'schemaVersion': 2,
+            'mediaType': MEDIA_TYPES['manifest'],
+            'config': _blob(config, MEDIA_TYPES['config']),
+            'layers': [known_layers[diff_id] for diff_id in diff_ids],
+        }
+        manifest_data = json.dumps(manifest, sort_keys=True).encode('utf-8')
+        index = {
+            'schemaVersion': 2,
+            'manifests': [dict(
+                _blob(manifest_data, MEDIA_TYPES['manifest']),
+                annotations={'org.opencontainers.image.ref.name': name},
+            )],
+        }
+
+        with helpers.timed(timings, 'write'):
+            with tarfile.open(output, 'w') as tar:
+                _add_file(tar, 'oci-layout', data=b'{"imageLayoutVersion": "1.0.0"}')
+                _add_file(tar, 'index.json', data=json.dumps(index, sort_keys=True).encode('utf-8'))
+                _add_file(tar, 'blobs/sha256/' + index['manifests'][0]['digest'][7:], data=manifest_data)
+                _add_file(tar, 'blobs/sha256/' + manifest['config']['digest'][7:], data=config)
+                for diff_id, path in blobs.items():
+                    _add_file(tar, 'blobs/sha256/' + known_layers[diff_id]['digest'][7:], path=path)
+
+    manifest_path = '{}.manifest.json'.format(output)
+    with open(manifest_path, 'w') as fp:
+        json.dump({
+            'image': name,
+            'manifest': manifest,
+            'layers': [{'diff_id': diff_id, 'descriptor': known_layers[diff_id]} for diff_id in diff_ids],
+        }, fp, indent=2, sort_keys=True)
+
+    return {
+        'archive': output,
+        'manifest': manifest_path,
+        'layers': len(diff_ids),
+        'skipped_layers': len(diff_ids) - len(blobs),
+        'size': os.path.getsize(output),
+        'timings': timings,
+    }
@@ -6,13 +6,13 @@
 import contextlib
 import logging
 import os.path
-
-import docker
-import docker.errors
-import docker.utils.json_stream
+import tarfile
+import tempfile
 
 from .. import __version__
+from .. import engines
 from .. import helpers
+from .. import locks
 from .. import six
 
 logger = logging.getLogger(__name__)
@@ -30,96 +30,111 @@ def docker_build_context(context_path):
         yield build_dir
 
 
-def docker_build_image(docker_client, path, name, role=None, labels=None, **kwargs):
+def docker_build_image(engine, path, name, role=None, labels=None, **kwargs):
     computed_labels = {
         'grocker.version': __version__,
         'grocker.image.role': role,
     }
     computed_labels.update(labels or {})
-    stream = docker_client.api.build(
-        path=path,
-        tag=name,
-        rm=True,
-        forcerm=True,
-        labels=computed_labels,
-        **kwargs
-    )
-    _inspect_stream(stream)
+    if not engine.build_image(path, name, labels=computed_labels, **kwargs):
+        raise RuntimeError('Image build failed')
     try:
-        return docker_client.images.get(name)
-    except docker.errors.ImageNotFound:
+        return engine.get_image(name)
+    except engines.ImageNotFound:
         raise RuntimeError('Image build failed')
 
 
-def docker_get_or_build_image(docker_client, name, builder):
+def _get_local_image(engine, name, cache, role):
     try:
-        return docker_client.images.get(name)
-    except docker.errors.ImageNotFound:
+        image = engine.get_image(name)
+    except engines.ImageNotFound:
+        return None
+    cache.setdefault(role or name, 'local')
+    return image
+
+
+def docker_get_or_build_image(engine, name, builder, cache=None, role=None, slots=None):
+    """
+    Return the image `name`, pulled or built (and pushed) if it does not exist locally
+
+    Concurrent Grocker processes getting the same image wait for the first one
+    (see locks.stage_lock), and the build itself uses one of the `slots` build
+    slots of the engine (see locks.build_slot).
+
+    The origin of the image (`local`, `pulled` or `built`) is stored in `cache[role or name]`
+    unless an origin is already known.
+    """
+    cache = {} if cache is None else cache
+    image = _get_local_image(engine, name, cache, role)
+    if image:
+        return image
+
+    with locks.stage_lock(engine, name):
+        image = _get_local_image(engine, name, cache, role)  # got by a concurrent process meanwhile
+        if image:
+            return image
         try:
-            return docker_pull_image(docker_client, name)
-        except docker.errors.NotFound:
-            image = builder(docker_client)
+            image = docker_pull_image(engine, name)
+            cache.setdefault(role or name, 'pulled')
+        except engines.NotFound:
+            with locks.build_slot(engine, slots):
+                image = builder(engine)
             if is_prefixed_image(name):
-                image = docker_push_image(docker_client, name)
-            return image
+                image = docker_push_image(engine, name)
+            cache.setdefault(role or name, 'built')
+    return image
 
 
-def get_or_create_data_volume(docker_client, name, role, labels=None):
-    logger.info('Creating volume %s...')
+def get_or_create_data_volume(engine, name, role, labels=None):
+    logger.info('Creating volume %s...', name)
     computed_labels = {
         'grocker.version': __version__,
         'grocker.image.role': role,
     }
     computed_labels.update(labels or {})
-    return docker_client.volumes.create(
-        name=name,
-        labels=computed_labels,
-    )
+    return engine.create_volume(name, labels=computed_labels)
 
 
-def docker_pull_image(docker_client, name):
+def docker_pull_image(engine, name):
     logger.info('Pulling image %s...', name)
-    return docker_client.images.pull(name)
+    return engine.pull_image(name)
 
 
-def docker_push_image(docker_client, name):
+def docker_push_image(engine, name):
     logger.info('Pushing image %s...', name)
-    docker_client.images.push(name)
-    return docker_client.images.get(name)
+    engine.push_image(name)
+    return engine.get_image(name)
 
 
-def docker_run_container(docker_client, name, command, volumes=None, environment=None):
+def docker_run_container(engine, name, command, volumes=None, environment=None, cpus=None, memory=None,
+                         tmpfs=None):
     logger.info(
         'Running %s on image %s (volumes:%s, environment:%s)',
         command, name, volumes, environment,
     )
-    container = docker_client.containers.run(
-        image=name,
-        command=command,
-        environment=environment,
-        volumes=volumes,
-        detach=True,
+    return_code = engine.run_container(
+        name, command, volumes=volumes, environment=environment, cpus=cpus, memory=memory, tmpfs=tmpfs,
     )
-
-    stream = container.attach(stream=True, logs=True)
-    for line in stream:
-        print(line.decode('utf-8'), end='')
-    return_code = container.wait()
-    container.remove()
     if return_code != 0:
         raise RuntimeError('Container exit with a non-zero return code (%d).', return_code)
 
 
-def _inspect_stream(stream):
-    """Return some data about the stream."""
-    error = False
-    for line in docker.utils.json_stream.json_stream(stream):
-        if 'stream' in line:
-            print(line['stream'], end='')
-        elif 'error' in line:
-            print(line['error'])
-            error = True
-        else:
-            print(line)
-    print()
-    return not error
+def docker_export_volume(engine, image, volume_name, path, destination):
+    """
+    Copy the content of a volume in a local directory
+
+    Args:
+        engine (grocker.engines.Engine): a container engine
+        image (str): image used to mount the volume (the container is never started)
+        volume_name (str): volume to export
+        path (str): where the volume is mounted in the container
+        destination (str): local directory where the volume content is extracted
+    """
+    logger.info('Exporting %s from volume %s...', path, volume_name)
+    stream = engine.export_path(image, path, volumes={volume_name: {'bind': path, 'mode': 'ro'}})
+    with tempfile.TemporaryFile() as fp:
+        for chunk in stream:
+            fp.write(chunk)
+        fp.seek(0)
+        with tarfile.open(fileobj=fp) as tar:
+            tar.extractall(destination)
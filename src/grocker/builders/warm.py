@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+Warm a Docker host up (eg. a new CI node) before its first build.
+
+For each config file and runtime of the matrix, the root, compiler and wheel
+server images are pulled or built, and the wheels of the given releases are
+compiled. Matrix entries are warmed concurrently: entries sharing an image or a
+wheel volume wait for each other (see grocker.locks).
+"""
+
+import concurrent.futures
+import logging
+
+from .. import helpers
+from .. import utils
+from . import build
+from . import distributed
+
+logger = logging.getLogger(__name__)
+
+
+def config_matrix(config_paths, runtimes=None, **kwargs):
+    """
+    Return the configs to warm up, one by config file and runtime
+
+    Args:
+        config_paths (list): config files (by default, the one of the current directory)
+        runtimes (list): runtimes to warm up (by default, all the runtimes known by each config)
+        kwargs: command line settings, as in utils.parse_config
+
+    Returns:
+        list: (config path, config) tuples
+    """
+    matrix = []
+    for config_path in config_paths or [None]:
+        paths = [config_path] if config_path else []
+        known_runtimes = sorted(utils.parse_config(paths, **kwargs)['system']['runtime'])
+        for runtime in runtimes or known_runtimes:
+            config = utils.parse_config(paths, runtime=runtime, **kwargs)
+            utils.check_config(config)
+            matrix.append((config_path, config))
+    return matrix
+
+
+def warm_config(engine, pool, config, releases=(), pip_conf_path=None):
+    """
+    Get (pull or build) the images used by the builds of `config`, and compile the wheels of `releases`
+
+    Returns:
+        dict: the origin of each image (`cache`) and the time spent in each stage (`timings`)
+    """
+    collect = {'cache': {}, 'timings': {}}
+    timings, cache = collect['timings'], collect['cache']
+    with helpers.timed(timings, 'root'):
+        build.get_or_build_root_image(engine, config, cache)
+    with helpers.timed(timings, 'compiler'):
+        build.get_or_build_compiler_image(engine, config, cache)
+    if not build.is_multi_stage(config):
+        with helpers.timed(timings, 'wheel-server'):
+            build.get_or_build_wheel_server_image(engine, config, cache)
+
+    if releases:
+        with helpers.timed(timings, 'wheels'), helpers.pip_conf(pip_conf_path=pip_conf_path) as pip_conf:
+            for release in releases:
+                logger.info('Compiling the wheels of %s (%s)...', release, config['runtime'])
+                distributed.compile_wheels(engine, pool, config, release, pip_conf)
+    return collect
+
+
+def warm(engine, pool, matrix, releases=(), pip_conf_path=None, workers=None):
+    """
+    Warm `engine` up for the builds of the configs of `matrix`
+
+    Args:
+        engine (grocker.engines.Engine): the engine to warm up
+        pool (list): other engines sharing the compilation of the dependencies
+        matrix (list): (config path, config) tuples, see config_matrix
+        releases (list): releases whose wheels are compiled for each config
+        pip_conf_path (str): pip configuration file (by default use pip config getter)
+        workers (int): number of configs warmed up at the same time (by default, all of them)
+
+    Returns:
+        list: a dict by matrix entry, with its config path, runtime, cache and
+        timings (see warm_config), or the error which made it fail
+    """
+    results = [{'config': config_path, 'runtime': config['runtime']} for config_path, config in matrix]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or len(matrix) or 1) as executor:
+        futures = [
+            executor.submit(warm_config, engine, pool, config, releases, pip_conf_path)
+            for _, config in matrix
+        ]
+        for result, future in zip(results, futures):
+            try:
+                result.update(future.result())
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error(
+                    'Unable to warm up %s (%s): %s', result['config'] or 'default config', result['runtime'], e,
+                )
+                result['error'] = str(e)
+    return results
@@ -4,9 +4,19 @@
 
 
 import base64
+import json
 import logging
+import math
+import os
+import os.path
+import posixpath
+import tarfile
+import tempfile
 import zlib
 
+from .. import __version__
+from .. import engines
+from .. import locks
 from .. import six
 from .. import utils
 from . import naming
@@ -14,6 +24,14 @@ from . import op
 
 logger = logging.getLogger(__name__)
 
+WHEELHOUSE_MOUNT_POINT = '/home/grocker/packages'
+WHEEL_CACHE_MOUNT_POINT = '/home/grocker/wheel-cache'
+PIP_CACHE_MOUNT_POINT = '/home/grocker/.cache/pip'
+CCACHE_MOUNT_POINT = '/home/grocker/.cache/ccache'
+TMPFS_MOUNT_POINT = '/tmp/grocker-build'
+REPORTS_PATH = posixpath.join(WHEELHOUSE_MOUNT_POINT, '.reports')
+COMPACTION_PATH = posixpath.join(WHEELHOUSE_MOUNT_POINT, '.compaction.json')
+
 
 def get_pip_env(pip_conf):
     def get(cfg, section, option, default=None):
@@ -38,9 +56,52 @@ def get_pip_env(pip_conf):
     return env
 
 
-def compile_wheels(docker_client, config, release, pip_conf):
-    wheels_destination_volume = op.get_or_create_data_volume(
-        docker_client,
+def get_build_jobs(config):
+    """
+    Return the number of parallel jobs of native extension builds
+
+    By default, it is the CPU count of the compiler container (`compiler_cpus`)
+    or, without limit, None: the compiler then uses the cores of the Docker host.
+    """
+    return config.get('build_jobs') or int(math.ceil(config.get('compiler_cpus') or 0)) or None
+
+
+def get_wheel_cache(config):
+    """
+    Locate the remote wheel cache of this config
+
+    The `wheel_cache` setting is either an HTTP URL (wheels are stored and
+    fetched with PUT and GET requests) or a shared directory (mounted in the
+    compiler container). Wheels are stored by runtime and config identifier.
+
+    Returns:
+        tuple: the wheel cache URL seen from the compiler container (or None)
+        and the volumes to mount in the compiler container
+    """
+    wheel_cache = config.get('wheel_cache')
+    if not wheel_cache:
+        return None, {}
+
+    namespace = '{}-{}'.format(config['runtime'], utils.config_identifier(config))
+    if '://' in wheel_cache:
+        return '{}/{}'.format(wheel_cache.rstrip('/'), namespace), {}
+
+    directory = os.path.join(os.path.abspath(wheel_cache), namespace)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+        os.chmod(directory, 0o777)  # writable by the compiler container user
+    volumes = {
+        directory: {
+            'bind': WHEEL_CACHE_MOUNT_POINT,
+            'mode': 'rw',
+        },
+    }
+    return 'file://{}'.format(WHEEL_CACHE_MOUNT_POINT), volumes
+
+
+def get_or_create_wheel_volume(engine, config):
+    return op.get_or_create_data_volume(
+        engine,
         naming.wheel_volume_name(config),
         role='wheel',
         labels={
@@ -48,13 +109,174 @@ def compile_wheels(docker_client, config, release, pip_conf):
             'grocker.config.hash': utils.config_identifier(config),
         },
     )
+
+
+def get_or_create_pip_cache_volume(engine):
+    return op.get_or_create_data_volume(
+        engine,
+        naming.pip_cache_volume_name(),
+        role='pip-cache',
+    )
+
+
+def get_or_create_ccache_volume(engine):
+    return op.get_or_create_data_volume(
+        engine,
+        naming.ccache_volume_name(),
+        role='ccache',
+    )
+
+
+def compile_wheels(engine, config, release, pip_conf, no_deps=False, report_id=None, keep_going=False):
+    """
+    Compile the wheels of `release` (a requirement or a list of requirements) in the wheel volume
+
+    Dependencies are not compiled when `no_deps` is set. With `keep_going`, a
+    requirement failing to compile does not stop (nor fail) the others. Concurrent Grocker
+    processes compiling in the same wheel volume run one after the other (the
+    later ones find the wheels already compiled), each one using a build slot.
+    With a `report_id`, the compiler writes a wheel report (see read_wheel_report).
+    """
+    with locks.stage_lock(engine, naming.wheel_volume_name(config)):
+        with locks.build_slot(engine, config.get('build_slots')):
+            return _compile_wheels(engine, config, release, pip_conf, no_deps, report_id, keep_going)
+
+
+def _read_json_files(engine, image, volume_name, path):
+    """Return the content of the JSON files of `path` (a file or a directory) in the wheel volume `volume_name`."""
+    contents = []
+    with tempfile.TemporaryFile() as fp:
+        for chunk in engine.export_path(
+            image, path, volumes={volume_name: {'bind': WHEELHOUSE_MOUNT_POINT, 'mode': 'ro'}},
+        ):
+            fp.write(chunk)
+        fp.seek(0)
+        with tarfile.open(fileobj=fp) as tar:
+            for member in tar.getmembers():
+                if member.isfile() and member.name.endswith('.json'):
+                    contents.append(json.loads(tar.extractfile(member).read().decode('utf-8')))
+    return contents
+
+
+def read_wheel_report(engine, config, report_id):
+    """
+    Read the wheel reports written with `report_id` in the wheel volume
+
+    Returns:
+        list: a dict by requirement of each compiled release: `release`,
+        `requirement`, `origin` (`compiled`, `downloaded` or `reused`),
+        compile `duration` (in seconds), `wheel` file name and `size`
+    """
+    volume_name = naming.wheel_volume_name(config)
+    entries = []
+    try:
+        for report in _read_json_files(
+            engine, naming.image_name(config, 'compiler'), volume_name, posixpath.join(REPORTS_PATH, report_id),
+        ):
+            entries += report
+    except engines.NotFound:
+        logger.warning('No wheel report in volume %s.', volume_name)
+    return entries
+
+
+def wheel_volumes(engine, runtimes=None):
+    """Return the wheel volumes of this Grocker version (of the given `runtimes`)."""
+    return [
+        volume for volume in engine.list_volumes(label='grocker.image.role=wheel')
+        if volume.labels.get('grocker.version') == __version__
+        and (not runtimes or volume.labels.get('grocker.runtime') in runtimes)
+    ]
+
+
+def compaction_image(engine, volume):
+    """Return a compiler image of this Grocker version for the runtime of the wheel `volume` (or None)."""
+    for image in engine.list_images(label='grocker.image.role=compiler'):
+        if (
+            image.labels.get('grocker.version') == __version__
+            and image.labels.get('grocker.runtime') == volume.labels.get('grocker.runtime')
+            and image.tags
+        ):
+            return image.tags[0]
+    return None
+
+
+def compact_wheelhouse(engine, image, volume_name, unused_days=None, unused_builds=None, dry_run=False):
+    """
+    Remove the wheels of the wheel volume `volume_name` that builds did not use lately
+
+    The compiler records the wheels used by each compilation in the volume. A
+    wheel is removed when it was not used for `unused_days` days and by the
+    last `unused_builds` compilations (the criteria which are given).
+
+    Args:
+        engine (grocker.engines.Engine): a container engine
+        image (str): compiler image running the compaction (of the volume runtime, see compaction_image)
+        volume_name (str): wheel volume to compact
+        unused_days (int): days without use after which a wheel is removed
+        unused_builds (int): number of last compilations which did not use a removed wheel
+        dry_run (bool): only report what would be removed
+
+    Returns:
+        dict: the number of `wheels`, `removed` wheels, bytes `freed` and the
+        pip `resolution_time` (in seconds) `before` and `after` (or None if unknown)
+    """
+    command = ['--compact']
+    if unused_days is not None:
+        command += ['--unused-days', str(unused_days)]
+    if unused_builds is not None:
+        command += ['--unused-builds', str(unused_builds)]
+    if dry_run:
+        command.append('--dry-run')
+    with locks.stage_lock(engine, volume_name):  # not while a compilation uses the volume
+        op.docker_run_container(
+            engine, image, command, volumes={volume_name: {'bind': WHEELHOUSE_MOUNT_POINT, 'mode': 'rw'}},
+        )
+        try:
+            results = _read_json_files(engine, image, volume_name, COMPACTION_PATH)
+        except engines.NotFound:
+            results = []
+    return results[0] if results else None
+
+
+def summarize_wheel_report(entries):
+    """
+    Summarize a wheel report (see read_wheel_report)
+
+    A requirement is reported once: the wheels compiled or downloaded by a
+    distributed compilation are reused by the compilation of the release.
+
+    Returns:
+        dict: the count of wheels by origin, the total compile time and wheel
+        size, and the report entries (slowest compilations first)
+    """
+    origins = ('compiled', 'downloaded', 'reused')
+    requirements = {}
+    for entry in entries:
+        known = requirements.get(entry['requirement'])
+        if known is None or origins.index(entry['origin']) < origins.index(known['origin']):
+            requirements[entry['requirement']] = entry
+    entries = list(requirements.values())
+
+    summary = {origin: 0 for origin in origins}
+    for entry in entries:
+        summary[entry['origin']] += 1
+    summary['compile_time'] = round(sum(entry['duration'] or 0 for entry in entries), 3)
+    summary['size'] = sum(entry['size'] or 0 for entry in entries)
+    summary['packages'] = sorted(entries, key=lambda entry: (-(entry['duration'] or 0), entry['requirement']))
+    return summary
+
+
+def _compile_wheels(engine, config, release, pip_conf, no_deps, report_id, keep_going):
+    wheels_destination_volume = get_or_create_wheel_volume(engine, config)
     volumes = {
         wheels_destination_volume.name: {
-            'bind': '/home/grocker/packages',
+            'bind': WHEELHOUSE_MOUNT_POINT,
             'mode': 'rw',
         },
     }
-    command = ['--python', config['runtime'], release]
+    releases = [release] if isinstance(release, str) else list(release)
+    command = ['--python', config['runtime']] + (['--no-deps'] if no_deps else [])
+    command += (['--keep-going'] if keep_going else []) + releases
     environment = get_pip_env(pip_conf)
 
     if config['pip_constraint']:
@@ -62,10 +284,51 @@ def compile_wheels(docker_client, config, release, pip_conf):
             constraints = fp.read()
         environment['PIP_CONSTRAINT_CONTENT'] = base64.b64encode(zlib.compress(constraints)).decode()
 
+    wheel_cache_url, wheel_cache_volumes = get_wheel_cache(config)
+    if wheel_cache_url:
+        logger.info('-> Using wheel cache %s.', config['wheel_cache'])
+        environment['GROCKER_WHEEL_CACHE_URL'] = wheel_cache_url
+        volumes.update(wheel_cache_volumes)
+
+    if config.get('pip_cache'):
+        # pip HTTP cache (downloaded archives) and locally built wheels, kept between builds
+        pip_cache_volume = get_or_create_pip_cache_volume(engine)
+        volumes[pip_cache_volume.name] = {
+            'bind': PIP_CACHE_MOUNT_POINT,
+            'mode': 'rw',
+        }
+        environment['PIP_CACHE_DIR'] = PIP_CACHE_MOUNT_POINT
+
+    if config.get('ccache'):
+        # compiled objects, kept between builds (ccache evicts the oldest ones above ccache_size)
+        ccache_volume = get_or_create_ccache_volume(engine)
+        volumes[ccache_volume.name] = {
+            'bind': CCACHE_MOUNT_POINT,
+            'mode': 'rw',
+        }
+        environment['CCACHE_DIR'] = CCACHE_MOUNT_POINT
+        environment['CCACHE_MAXSIZE'] = str(config['ccache_size'])
+
+    tmpfs = None
+    if config.get('compiler_tmpfs'):
+        # pip unpacks and builds the source distributions in memory
+        tmpfs = {TMPFS_MOUNT_POINT: 'size={},mode=1777,exec'.format(config['compiler_tmpfs'])}
+        environment['TMPDIR'] = TMPFS_MOUNT_POINT
+
+    if report_id:
+        environment['GROCKER_REPORT_ID'] = report_id
+
+    build_jobs = get_build_jobs(config)
+    if build_jobs:
+        environment['GROCKER_BUILD_JOBS'] = str(build_jobs)
+
     return op.docker_run_container(
-        docker_client,
+        engine,
         naming.image_name(config, 'compiler'),
         command,
         volumes=volumes,
         environment=environment,
+        cpus=config.get('compiler_cpus') or None,
+        memory=config.get('compiler_memory') or None,
+        tmpfs=tmpfs,
     )
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+
+
+from .base import Container, Engine, EngineError, Image, ImageNotFound, NotFound, Volume
+from .policy import Policy, PolicyEngine
+from .tracing import TracingEngine
+
+__all__ = [
+    'Container',
+    'Engine',
+    'EngineError',
+    'Image',
+    'ImageNotFound',
+    'NotFound',
+    'Policy',
+    'PolicyEngine',
+    'TracingEngine',
+    'Volume',
+    'ENGINES',
+    'get_engine',
+]
+
+ENGINES = ('docker', 'podman', 'fake')
+
+
+def get_engine(name='docker', policy=None, tracing=False, **kwargs):
+    """
+    Instantiate a container engine
+
+    Args:
+        name (str): one of ENGINES
+        policy (Policy): call policy (retries, rate limit) applied to the engine
+        tracing (bool): record the engine calls (each try) as spans of the started tracer
+        kwargs: engine specific arguments
+
+    Returns:
+        Engine: the engine
+    """
+    if name == 'docker':
+        from .dockerpy import DockerEngine as engine_class
+    elif name == 'podman':
+        from .podman import PodmanEngine as engine_class
+    elif name == 'fake':
+        from .fake import FakeEngine as engine_class
+    else:
+        raise ValueError('Unknown engine: {}'.format(name))
+    engine = engine_class(**kwargs)
+    if tracing:
+        engine = TracingEngine(engine)
+    if policy is not None:
+        engine = PolicyEngine(engine, policy)
+    return engine
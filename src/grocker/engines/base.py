@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+
+
+import collections
+import posixpath
+import tarfile
+import tempfile
+
+CHUNK_SIZE = 2 * 1024 * 1024
+
+Image = collections.namedtuple('Image', ['id', 'tags', 'labels', 'digests', 'size'])
+Volume = collections.namedtuple('Volume', ['name', 'labels'])
+Container = collections.namedtuple('Container', ['id', 'name', 'labels', 'ip_address'])
+
+
+class EngineError(Exception):
+    """Error raised by a container engine."""
+
+
+class NotFound(EngineError):
+    """The requested object does not exist."""
+
+
+class ImageNotFound(NotFound):
+    """The requested image does not exist (locally or in the registry)."""
+
+
+class Engine(object):
+    """
+    Container engine used by Grocker to build, run and store its Docker stuff
+
+    Label filters (the `label` arguments) use the Docker syntax: either a label
+    name, or `<name>=<value>`.
+    """
+    name = None
+    base_url = None
+
+    def __str__(self):
+        return '{} engine ({})'.format(self.name, self.base_url or 'default')
+
+    def get_image(self, name):
+        """Return the local image `name` (raise ImageNotFound if it does not exist)."""
+        raise NotImplementedError()
+
+    def build_image(self, path, name, labels=None, buildargs=None, nocache=False, cache_from=None, extra_hosts=None):
+        """
+        Build the image `name` from directory `path`, return whether the build succeeded
+
+        The layers of the local images `cache_from` are reused when their build
+        steps match. `extra_hosts` (hostname: IP address) are added to the hosts
+        file of the build containers (they do not change the build cache).
+        """
+        raise NotImplementedError()
+
+    def pull_image(self, name):
+        """Pull and return image `name` (raise ImageNotFound if the registry does not know it)."""
+        raise NotImplementedError()
+
+    def push_image(self, name):
+        """Push image `name` to its registry."""
+        raise NotImplementedError()
+
+    def tag_image(self, name, new_name):
+        """Tag the local image `name` as `new_name`."""
+        raise NotImplementedError()
+
+    def list_images(self, label=None):
+        """Return the local images matching the `label` filter."""
+        raise NotImplementedError()
+
+    def remove_image(self, name):
+        raise NotImplementedError()
+
+    def save_image(self, name):
+        """Yield the local image `name` as a tar stream (`docker save` format)."""
+        raise NotImplementedError()
+
+    def create_volume(self, name, labels=None):
+        """Create (or return when it already exists) the volume `name`."""
+        raise NotImplementedError()
+
+    def list_volumes(self, label=None):
+        raise NotImplementedError()
+
+    def remove_volume(self, name):
+        raise NotImplementedError()
+
+    def run_container(self, image, command=None, volumes=None, environment=None, cpus=None, memory=None,
+                      tmpfs=None):
+        """
+        Run a container until it exits, print its output and remove it
+
+        Args:
+            image (str): image to run
+            command (list): command given to the image entrypoint
+            volumes (dict): `{<volume name>: {'bind': <path>, 'mode': 'ro' or 'rw'}}`
+            environment (dict): container environment
+            cpus (float): CPUs available to the container (by default, no limit)
+            memory (str): memory limit of the container (eg. `4g`, by default no limit)
+            tmpfs (dict): `{<path>: <mount options>}` of the tmpfs mounted in the container
+
+        Returns:
+            int: the container return code
+        """
+        raise NotImplementedError()
+
+    def run_output(self, image, command=None, entrypoint=None):
+        """
+        Run a container until it exits and remove it
+
+        Args:
+            image (str): image to run
+            command (list): command given to the entrypoint
+            entrypoint (list): entrypoint replacing the one of the image
+
+        Returns:
+            tuple: the container return code and output (stdout, bytes)
+        """
+        raise NotImplementedError()
+
+    def start_container(self, image, volumes=None, environment=None, labels=None):
+        """Start a detached container (labelled with `labels`) and return it."""
+        raise NotImplementedError()
+
+    def list_containers(self, label=None, status=None):
+        raise NotImplementedError()
+
+    def remove_container(self, container_id, force=False):
+        raise NotImplementedError()
+
+    def export_path(self, image, path, volumes=None):
+        """Yield the content of `path` in a (never started) container of `image` as a tar stream (NotFound if none)."""
+        raise NotImplementedError()
+
+    def export_paths(self, image, root, names, volumes=None):
+        """
+        Yield the files `names` of `root` in a (never started) container of `image` as a tar stream
+
+        Members of the stream are named after `names` (relative to `root`).
+        """
+        raise NotImplementedError()
+
+    def import_path(self, image, path, data, volumes=None):
+        """Extract the tar archive `data` (a file object) in `path` of a (never started) container of `image`."""
+        raise NotImplementedError()
+
+
+def merge_archives(archives):
+    """
+    Yield a tar stream of the members of `archives`
+
+    Args:
+        archives (iterable): (prefix, tar stream) tuples, the members of each
+            tar stream (an iterable of bytes) are prefixed with `prefix`
+    """
+    with tempfile.TemporaryFile() as output:
+        with tarfile.open(fileobj=output, mode='w') as merged:
+            for prefix, stream in archives:
+                with tempfile.TemporaryFile() as fp:
+                    for chunk in stream:
+                        fp.write(chunk)
+                    fp.seek(0)
+                    with tarfile.open(fileobj=fp) as tar:
+                        for member in tar:
+                            content = tar.extractfile(member) if member.isfile() else None
+                            member.name = posixpath.join(prefix, member.name) if prefix else member.name
+                            merged.addfile(member, content)
+        output.seek(0)
+        for chunk in iter(lambda: output.read(CHUNK_SIZE), b''):
+            yield chunk
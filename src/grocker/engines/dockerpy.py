@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+
+
+import contextlib
+import posixpath
+
+import docker.errors
+import docker.utils
+import docker.utils.json_stream
+import requests.exceptions
+
+from .. import utils
+from . import base
+
+
+@contextlib.contextmanager
+def _translate_errors(not_found=base.NotFound, name=None):
+    try:
+        yield
+    except docker.errors.NotFound as e:
+        raise not_found(name or str(e))
+    except (docker.errors.APIError, requests.exceptions.RequestException) as e:  # eg. a daemon timeout
+        raise base.EngineError(str(e))
+
+
+CHUNK_SIZE = 2 * 1024 * 1024
+CPU_PERIOD = 100000  # CFS scheduler period (in microseconds) of the CPU limits
+
+
+def _labels(obj):
+    return obj.attrs.get('Config', obj.attrs).get('Labels') or {}
+
+
+def _image(obj):
+    return base.Image(
+        id=obj.id,
+        tags=list(obj.tags),
+        labels=_labels(obj),
+        digests=obj.attrs.get('RepoDigests') or [],
+        size=obj.attrs.get('Size'),
+    )
+
+
+def _container(obj):
+    return base.Container(
+        id=obj.id,
+        name=obj.name,
+        labels=_labels(obj),
+        ip_address=obj.attrs.get('NetworkSettings', {}).get('IPAddress'),
+    )
+
+
+def _volume(obj):
+    return base.Volume(name=obj.name, labels=_labels(obj))
+
+
+def _filters(label=None, status=None):
+    filters = {'label': label, 'status': status}
+    return {k: v for k, v in filters.items() if v}
+
+
+def _inspect_stream(stream):
+    """Return some data about the stream."""
+    error = False
+    for line in docker.utils.json_stream.json_stream(stream):
+        if 'stream' in line:
+            print(line['stream'], end='')
+        elif 'error' in line:
+            print(line['error'])
+            error = True
+        else:
+            print(line)
+    print()
+    return not error
+
+
+class DockerEngine(base.Engine):
+    """
+    Engine using a Docker daemon through docker(-py)
+
+    Args:
+        client (docker.DockerClient): the client to use (by default, configured from environment)
+        base_url (str): the Docker daemon to use when no client is given (eg. tcp://docker-1:2375)
+    """
+    name = 'docker'
+
+    def __init__(self, client=None, base_url=None):
+        self.base_url = base_url
+        self.client = client or utils.docker_get_client(base_url=base_url)
+
+    def get_image(self, name):
+        with _translate_errors(base.ImageNotFound, name):
+            return _image(self.client.images.get(name))
+
+    def build_image(self, path, name, labels=None, buildargs=None, nocache=False, cache_from=None, extra_hosts=None):
+        with _translate_errors():
+            stream = self.client.api.build(
+                path=path,
+                tag=name,
+                rm=True,
+                forcerm=True,
+                labels=labels,
+                buildargs=buildargs,
+                nocache=nocache,
+                cache_from=cache_from,
+                extra_hosts=extra_hosts,
+            )
+            return _inspect_stream(stream)
+
+    def pull_image(self, name):
+        with _translate_errors(base.ImageNotFound, name):
+            return _image(self.client.images.pull(name))
+
+    def push_image(self, name):
+        with _translate_errors(base.ImageNotFound, name):
+            self.client.images.push(name)
+
+    def tag_image(self, name, new_name):
+        repository, tag = docker.utils.parse_repository_tag(new_name)
+        with _translate_errors(base.ImageNotFound, name):
+            self.client.images.get(name).tag(repository, tag)
+
+    def list_images(self, label=None):
+        with _translate_errors():
+            return [_image(image) for image in self.client.images.list(filters=_filters(label))]
+
+    def remove_image(self, name):
+        with _translate_errors(base.ImageNotFound, name):
+            self.client.images.remove(name)
+
+    def save_image(self, name):
+        with _translate_errors(base.ImageNotFound, name):
+            data = self.client.api.get_image(name)
+            # docker(-py) 2 returns the raw HTTP response, docker(-py) 3+ a chunk generator
+            for chunk in data.stream(CHUNK_SIZE) if hasattr(data, 'stream') else data:
+                yield chunk
+
+    def create_volume(self, name, labels=None):
+        with _translate_errors():
+            return _volume(self.client.volumes.create(name=name, labels=labels))
+
+    def list_volumes(self, label=None):
+        with _translate_errors():
+            return [_volume(volume) for volume in self.client.volumes.list(filters=_filters(label))]
+
+    def remove_volume(self, name):
+        with _translate_errors(name=name):
+            self.client.volumes.get(name).remove()
+
+    def run_container(self, image, command=None, volumes=None, environment=None, cpus=None, memory=None,
+                      tmpfs=None):
+        limits = {'tmpfs': tmpfs} if tmpfs else {}
+        if cpus:
+            limits.update(cpu_period=CPU_PERIOD, cpu_quota=int(cpus * CPU_PERIOD))
+        if memory:
+            limits['mem_limit'] = memory
+        with _translate_errors():
+            container = self.client.containers.run(
+                image=image,
+                command=command,
+                environment=environment,
+                volumes=volumes,
+                detach=True,
+                **limits
+            )
+
+            stream = container.attach(stream=True, logs=True)
+            for line in stream:
+                print(line.decode('utf-8'), end='')
+            result = container.wait()
+            container.remove()
+        # docker(-py) 3+ returns the whole wait response
+        return result['StatusCode'] if isinstance(result, dict) else result
+
+    def run_output(self, image, command=None, entrypoint=None):
+        with _translate_errors():
+            container = self.client.containers.run(image=image, command=command, entrypoint=entrypoint, detach=True)
+            try:
+                result = container.wait()
+                output = container.logs(stdout=True, stderr=False)
+            finally:
+                container.remove()
+        return (result['StatusCode'] if isinstance(result, dict) else result), output
+
+    def start_container(self, image, volumes=None, environment=None, labels=None):
+        with _translate_errors():
+            container = self.client.containers.run(
+                image=image,
+                environment=environment,
+                volumes=volumes,
+                labels=labels,
+                detach=True,
+            )
+            container.reload()
+            return _container(container)
+
+    def list_containers(self, label=None, status=None):
+        with _translate_errors():
+            return [
+                _container(container)
+                for container in self.client.containers.list(all=True, filters=_filters(label, status))
+            ]
+
+    def remove_container(self, container_id, force=False):
+        with _translate_errors(name=container_id):
+            self.client.containers.get(container_id).remove(force=force)
+
+    def export_path(self, image, path, volumes=None):
+        with _translate_errors():
+            container = self.client.containers.create(image=image, volumes=volumes)
+            try:
+                stream, _ = container.get_archive(path)
+                for chunk in stream:
+                    yield chunk
+            finally:
+                container.remove()
+
+    def export_paths(self, image, root, names, volumes=None):
+        with _translate_errors():
+            container = self.client.containers.create(image=image, volumes=volumes)
+            try:
+                archives = (
+                    (posixpath.dirname(name), container.get_archive(posixpath.join(root, name))[0]) for name in names
+                )
+                for chunk in base.merge_archives(archives):
+                    yield chunk
+            finally:
+                container.remove()
+
+    def import_path(self, image, path, data, volumes=None):
+        with _translate_errors():
+            container = self.client.containers.create(image=image, volumes=volumes)
+            try:
+                if not container.put_archive(path, data):
+                    raise base.EngineError('Unable to import archive in {}'.format(path))
+            finally:
+                container.remove()
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+In-memory engine, backed by a stand-in for the part of the docker(-py) client
+used by Grocker.
+
+Every call sleeps for the latency configured for its operation, so that
+benchmarks and tests can simulate a slow daemon without needing one.
+"""
+
+import hashlib
+import io
+import itertools
+import json
+import tarfile
+import time
+
+import docker.errors
+
+from .. import __version__
+from . import dockerpy
+
+DEFAULT_LATENCIES = {
+    'build': 0.0,
+    'get': 0.0,
+    'pull': 0.0,
+    'push': 0.0,
+    'list': 0.0,
+    'remove': 0.0,
+    'run': 0.0,
+    'save': 0.0,
+    'volume': 0.0,
+}
+BASE_LAYER = b'fake base layer'
+
+_ids = itertools.count()
+
+
+def _new_id():
+    return hashlib.sha256(str(next(_ids)).encode()).hexdigest()
+
+
+class FakeObject(object):
+    def __init__(self, client, name, labels):
+        self.client = client
+        self.id = _new_id()
+        self.name = name
+        self.attrs = {
+            'Id': self.id,
+            'Name': name,
+            'Labels': labels,
+            'Config': {'Labels': labels},
+        }
+
+    @property
+    def labels(self):
+        return self.attrs['Labels']
+
+
+class FakeImage(FakeObject):
+    def __init__(self, client, tag, labels):
+        super(FakeImage, self).__init__(client, tag, labels)
+        self.tags = [tag]
+        self.attrs['RepoDigests'] = []
+        self.attrs['Size'] = 100 * 1024 * 1024
+
+    def tag(self, repository, tag=None):
+        name = '{}:{}'.format(repository, tag or 'latest')
+        self.tags.append(name)
+        self.client.images.objects[name] = self
+        return True
+
+    def save(self, chunk_size=64 * 1024):
+        """Yield the image in the `docker save` format: a base layer shared by all images, then its own layer."""
+        self.client.sleep('save')
+        layers = [BASE_LAYER, 'fake layer of {}'.format(self.id).encode()]
+        config = {
+            'architecture': 'amd64',
+            'os': 'linux',
+            'config': {'Labels': self.labels},
+            'rootfs': {'type': 'layers', 'diff_ids': ['sha256:' + hashlib.sha256(x).hexdigest() for x in layers]},
+        }
+        manifest = [{
+            'Config': '{}.json'.format(self.id),
+            'RepoTags': self.tags,
+            'Layers': ['{}/layer.tar'.format(i) for i in range(len(layers))],
+        }]
+
+        fp = io.BytesIO()
+        with tarfile.open(fileobj=fp, mode='w') as tar:
+            files = [(name, data) for name, data in zip(manifest[0]['Layers'], layers)] + [
+                (manifest[0]['Config'], json.dumps(config).encode()),
+                ('manifest.json', json.dumps(manifest).encode()),
+            ]
+            for name, data in files:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        data = fp.getvalue()
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size]
+
+
+class FakeVolume(FakeObject):
+    def __init__(self, client, name, labels):
+        super(FakeVolume, self).__init__(client, name, labels)
+        self.files = {}  # {<path relative to the volume root>: <content>}
+
+    def remove(self):
+        self.client.sleep('remove')
+        self.client.volumes.objects.pop(self.name, None)
+
+
+class FakeContainer(FakeObject):
+    def __init__(self, client, name, labels, output=(), mounts=None):
+        super(FakeContainer, self).__init__(client, name, labels)
+        self.output = list(output)
+        self.mounts = mounts or {}  # {<mount point>: <FakeVolume>}
+        self.status = 'exited'
+        self.attrs['NetworkSettings'] = {'IPAddress': client.ip_address}
+
+    def _volume(self, path):
+        for mount_point, volume in self.mounts.items():
+            if path == mount_point or path.startswith(mount_point.rstrip('/') + '/'):
+                return mount_point, volume
+        return None, None
+
+    def attach(self, stream=False, logs=False):
+        return iter(self.output)
+
+    def wait(self):
+        self.status = 'exited'
+        return 0
+
+    def logs(self, stdout=True, stderr=True):
+        return b''.join(self.output)
+
+    def reload(self):
+        self.client.sleep('get')
+
+    def get_archive(self, path):
+        """Archive `path`, only volume content is known by the fake."""
+        mount_point, volume = self._volume(path)
+        root = path.rstrip('/').rsplit('/', 1)[-1]
+        prefix = path[len(mount_point):].strip('/') if volume else None
+        fp = io.BytesIO()
+        with tarfile.open(fileobj=fp, mode='w') as tar:
+            if volume and prefix in volume.files:  # a file
+                info = tarfile.TarInfo(root)
+                info.size = len(volume.files[prefix])
+                tar.addfile(info, io.BytesIO(volume.files[prefix]))
+            else:
+                info = tarfile.TarInfo(root)
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+                for name, content in sorted(volume.files.items() if volume else []):
+                    if prefix and not name.startswith(prefix + '/'):
+                        continue
+                    info = tarfile.TarInfo('/'.join([root, name[len(prefix) + 1:] if prefix else name]))
+                    info.size = len(content)
+                    tar.addfile(info, io.BytesIO(content))
+        return iter([fp.getvalue()]), {}
+
+    def put_archive(self, path, data):
+        data = data.read() if hasattr(data, 'read') else data
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            for member in tar.getmembers():
+                if not member.isfile():
+                    continue
+                full_path = '/'.join([path.rstrip('/'), member.name])
+                mount_point, volume = self._volume(full_path)
+                if volume is not None:
+                    volume.files[full_path[len(mount_point):].strip('/')] = tar.extractfile(member).read()
+        return True
+
+    def remove(self, force=False):
+        self.client.sleep('remove')
+        self.client.containers.objects.pop(self.id, None)
+
+
+def _match(obj, filters):
+    label = (filters or {}).get('label')
+    status = (filters or {}).get('status')
+    if status and getattr(obj, 'status', status) != status:
+        return False
+    if not label:
+        return True
+    key, _, value = label.partition('=')
+    return key in obj.labels and (not value or obj.labels[key] == value)
+
+
+class FakeCollection(object):
+    def __init__(self, client):
+        self.client = client
+        self.objects = {}
+
+    def list(self, all=False, filters=None):  # pylint: disable=redefined-builtin
+        self.client.sleep('list')
+        return [obj for obj in list(self.objects.values()) if _match(obj, filters)]
+
+    def get(self, key):
+        self.client.sleep('get')
+        try:
+            return self.objects[key]
+        except KeyError:
+            raise docker.errors.NotFound(key)
+
+
+class FakeImageCollection(FakeCollection):
+    def get(self, name):
+        self.client.sleep('get')
+        images_by_id = {image.id: image for image in self.objects.values()}
+        try:
+            return self.objects.get(name) or images_by_id[name]
+        except KeyError:
+            raise docker.errors.ImageNotFound(name)
+
+    def pull(self, name):
+        self.client.sleep('pull')
+        if name not in self.client.registry:
+            raise docker.errors.NotFound(name)
+        replaced = self.objects.get(name)
+        if replaced is not None and replaced.id != self.client.registry[name].id:  # kept untagged
+            replaced.tags.remove(name)
+            self.objects[replaced.id] = replaced
+        self.objects[name] = self.client.registry[name]
+        return self.objects[name]
+
+    def push(self, name):
+        self.client.sleep('push')
+        image = self.objects[name]
+        image.attrs['RepoDigests'] = ['{}@sha256:{}'.format(name.rsplit(':', 1)[0], image.id)]
+        self.client.registry[name] = image
+
+    def list(self, all=False, filters=None):  # pylint: disable=redefined-builtin
+        # an image is registered once by tag
+        return list({image.id: image for image in super(FakeImageCollection, self).list(all, filters)}.values())
+
+    def remove(self, name):
+        self.client.sleep('remove')
+        image = self.objects.pop(name, None)
+        if image is None:
+            raise docker.errors.ImageNotFound(name)
+        image.tags.remove(name)
+
+    def add(self, name, labels):
+        if name in self.objects:  # the tag is moved to the new image
+            self.objects[name].tags.remove(name)
+        self.objects[name] = FakeImage(self.client, name, labels)
+        return self.objects[name]
+
+
+class FakeVolumeCollection(FakeCollection):
+    def create(self, name, labels=None):
+        self.client.sleep('volume')
+        return self.objects.setdefault(name, FakeVolume(self.client, name, labels or {}))
+
+
+class FakeContainerCollection(FakeCollection):
+    def create(self, image, command=None, volumes=None, environment=None, labels=None, **kwargs):
+        self.client.sleep('run')
+        mounts = {
+            bind['bind']: self.client.volumes.objects.setdefault(name, FakeVolume(self.client, name, {}))
+            for name, bind in (volumes or {}).items()
+        }
+        container = FakeContainer(
+            self.client, 'fake-{}'.format(next(_ids)), labels or {}, self.client.run_output, mounts,
+        )
+        self.objects[container.id] = container
+        return container
+
+    def run(self, image, command=None, detach=False, **kwargs):
+        self.client.runs.append(dict(kwargs, image=image, command=command))
+        container = self.create(image, command=command, **kwargs)
+        container.status = 'running'
+        return container
+
+
+class FakeAPIClient(object):
+    def __init__(self, client):
+        self.client = client
+
+    def build(self, path, tag, labels=None, buildargs=None, **kwargs):
+        self.client.sleep('build')
+        self.client.builds.append(dict(kwargs, tag=tag, labels=labels, buildargs=buildargs))
+        if tag in self.client.failing_builds:
+            yield json.dumps({'error': 'The command returned a non-zero code: 1'}).encode('utf-8')
+            return
+        self.client.images.add(tag, labels or {})
+        for i in range(self.client.build_output_lines):
+            yield json.dumps({'stream': 'Step {}\n'.format(i)}).encode('utf-8')
+
+    def get_image(self, image):
+        return self.client.images.get(image).save()
+
+
+class FakeDockerClient(object):
+    """
+    Mimic docker.DockerClient
+
+    Args:
+        latencies (dict): seconds slept by operation (see DEFAULT_LATENCIES)
+        images (int): number of Grocker images already known by the daemon
+        volumes (int): number of Grocker volumes already known by the daemon
+        containers (int): number of exited Grocker containers already known by the daemon
+        build_output_lines (int): number of lines streamed by each build
+        run_output (list): lines written by each container
+        base_url (str): the (fake) Docker daemon URL
+
+    The arguments of every run container are recorded in `runs`, and the ones
+    of every image build in `builds`. Builds of the images named in
+    `failing_builds` fail. Containers get the `ip_address` IP address.
+    """
+
+    def __init__(self, latencies=None, images=0, volumes=0, containers=0, build_output_lines=10, run_output=(),
+                 base_url=None):
+        self.base_url = base_url
+        self.runs = []
+        self.builds = []
+        self.failing_builds = set()
+        self.ip_address = '127.0.0.1'
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.build_output_lines = build_output_lines
+        self.run_output = list(run_output)
+        self.registry = {}
+        self.api = FakeAPIClient(self)
+        self.images = FakeImageCollection(self)
+        self.volumes = FakeVolumeCollection(self)
+        self.containers = FakeContainerCollection(self)
+
+        old_labels = {'grocker.version': '0.1', 'grocker.image.role': 'compiler'}
+        for i in range(images):
+            self.images.add('grocker-old-{}:0.1'.format(i), dict(old_labels))
+        for i in range(volumes):
+            self.volumes.objects['grocker-old-{}'.format(i)] = FakeVolume(self, 'grocker-old-{}'.format(i), old_labels)
+        for i in range(containers):
+            container = FakeContainer(self, 'grocker-old-{}'.format(i), dict(old_labels))
+            self.containers.objects[container.id] = container
+
+    def sleep(self, operation):
+        latency = self.latencies[operation]
+        if latency:
+            time.sleep(latency)
+
+    def version(self):
+        return {'ApiVersion': '1.26', 'Version': __version__}
+
+
+class FakeEngine(dockerpy.DockerEngine):
+    """
+    Engine keeping everything in memory (see FakeDockerClient for arguments)
+    """
+    name = 'fake'
+
+    def __init__(self, **kwargs):
+        super(FakeEngine, self).__init__(FakeDockerClient(**kwargs), base_url=kwargs.get('base_url'))
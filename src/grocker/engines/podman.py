@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+
+
+import json
+import logging
+import posixpath
+import subprocess
+
+from . import base
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _volume_args(volumes):
+    args = []
+    for name, bind in sorted((volumes or {}).items()):
+        args += ['--volume', '{}:{}:{}'.format(name, bind['bind'], bind.get('mode', 'rw'))]
+    return args
+
+
+def _environment_args(environment):
+    args = []
+    for key, value in sorted((environment or {}).items()):
+        args += ['--env', '{}={}'.format(key, value)]
+    return args
+
+
+def _labels(attrs):
+    return attrs.get('Config', attrs).get('Labels') or attrs.get('Labels') or {}
+
+
+class PodmanEngine(base.Engine):
+    """
+    Daemonless engine: images are built with buildah, containers run with podman
+
+    Args:
+        podman (str): podman executable
+        buildah (str): buildah executable
+        base_url (str): remote podman service to use (images are then built by podman itself)
+    """
+    name = 'podman'
+
+    def __init__(self, podman='podman', buildah='buildah', base_url=None):
+        self.base_url = base_url
+        self.podman = [podman, '--url', base_url] if base_url else [podman]
+        self.builder = self.podman + ['build'] if base_url else [buildah, 'bud']
+
+    def _call(self, *args):
+        logger.debug('Running %s', ' '.join(args))
+        return subprocess.call(args)
+
+    def _output(self, *args):
+        logger.debug('Running %s', ' '.join(args))
+        try:
+            return subprocess.check_output(args, stderr=subprocess.PIPE).decode('utf-8')
+        except subprocess.CalledProcessError as e:
+            raise base.EngineError(e.stderr.decode('utf-8', 'replace') if e.stderr else str(e))
+
+    def _inspect(self, kind, ids):
+        if not ids:
+            return []
+        return json.loads(self._output(*self.podman, kind, 'inspect', *ids))
+
+    def _image(self, attrs):
+        return base.Image(
+            id=attrs['Id'],
+            tags=attrs.get('RepoTags') or [],
+            labels=_labels(attrs),
+            digests=attrs.get('RepoDigests') or [],
+            size=attrs.get('Size'),
+        )
+
+    def get_image(self, name):
+        try:
+            return self._image(self._inspect('image', [name])[0])
+        except base.EngineError:
+            raise base.ImageNotFound(name)
+
+    def build_image(self, path, name, labels=None, buildargs=None, nocache=False, cache_from=None, extra_hosts=None):
+        # --layers reuses the layers of every local image (cache_from ones included)
+        args = self.builder + ['--layers', '--tag', name]
+        for key, value in sorted((labels or {}).items()):
+            args += ['--label', '{}={}'.format(key, value)]
+        for key, value in sorted((buildargs or {}).items()):
+            args += ['--build-arg', '{}={}'.format(key, value)]
+        for host, ip_address in sorted((extra_hosts or {}).items()):
+            args += ['--add-host', '{}:{}'.format(host, ip_address)]
+        if nocache:
+            args.append('--no-cache')
+        return self._call(*(args + [path])) == 0
+
+    def pull_image(self, name):
+        if self._call(*self.podman, 'pull', name) != 0:
+            raise base.ImageNotFound(name)
+        return self.get_image(name)
+
+    def push_image(self, name):
+        if self._call(*self.podman, 'push', name) != 0:
+            raise base.EngineError('Unable to push {}'.format(name))
+
+    def tag_image(self, name, new_name):
+        try:
+            self._output(*self.podman, 'tag', name, new_name)
+        except base.EngineError:
+            raise base.ImageNotFound(name)
+
+    def list_images(self, label=None):
+        args = ['--filter', 'label={}'.format(label)] if label else []
+        ids = self._output(*self.podman, 'images', '--quiet', '--no-trunc', *args).split()
+        return [self._image(attrs) for attrs in self._inspect('image', sorted(set(ids)))]
+
+    def remove_image(self, name):
+        self._output(*self.podman, 'rmi', name)
+
+    def save_image(self, name):
+        process = subprocess.Popen(self.podman + ['save', '--format', 'docker-archive', name], stdout=subprocess.PIPE)
+        for chunk in iter(lambda: process.stdout.read(CHUNK_SIZE), b''):
+            yield chunk
+        if process.wait() != 0:
+            raise base.ImageNotFound(name)
+
+    def create_volume(self, name, labels=None):
+        try:
+            attrs = self._inspect('volume', [name])[0]
+        except base.EngineError:
+            args = []
+            for key, value in sorted((labels or {}).items()):
+                args += ['--label', '{}={}'.format(key, value)]
+            self._output(*self.podman, 'volume', 'create', *(args + [name]))
+            attrs = self._inspect('volume', [name])[0]
+        return base.Volume(name=attrs['Name'], labels=attrs.get('Labels') or {})
+
+    def list_volumes(self, label=None):
+        args = ['--filter', 'label={}'.format(label)] if label else []
+        names = self._output(*self.podman, 'volume', 'ls', '--quiet', *args).split()
+        return [
+            base.Volume(name=attrs['Name'], labels=attrs.get('Labels') or {})
+            for attrs in self._inspect('volume', names)
+        ]
+
+    def remove_volume(self, name):
+        self._output(*self.podman, 'volume', 'rm', name)
+
+    def run_container(self, image, command=None, volumes=None, environment=None, cpus=None, memory=None,
+                      tmpfs=None):
+        args = self.podman + ['run', '--rm'] + _volume_args(volumes) + _environment_args(environment)
+        if cpus:
+            args += ['--cpus', str(cpus)]
+        if memory:
+            args += ['--memory', str(memory)]
+        for path, options in sorted((tmpfs or {}).items()):
+            args += ['--tmpfs', '{}:{}'.format(path, options)]
+        return self._call(*(args + [image] + list(command or [])))
+
+    def run_output(self, image, command=None, entrypoint=None):
+        args = self.podman + ['run', '--rm']
+        if entrypoint:
+            args += ['--entrypoint', json.dumps(list(entrypoint))]
+        args += [image] + list(command or [])
+        logger.debug('Running %s', ' '.join(args))
+        process = subprocess.Popen(args, stdout=subprocess.PIPE)
+        output, _ = process.communicate()
+        return process.returncode, output
+
+    def start_container(self, image, volumes=None, environment=None, labels=None):
+        args = self.podman + ['run', '--detach'] + _volume_args(volumes) + _environment_args(environment)
+        for key, value in sorted((labels or {}).items()):
+            args += ['--label', '{}={}'.format(key, value)]
+        container_id = self._output(*(args + [image])).strip()
+        return self._container(self._inspect('container', [container_id])[0])
+
+    def _container(self, attrs):
+        return base.Container(
+            id=attrs['Id'],
+            name=attrs['Name'].lstrip('/'),
+            labels=_labels(attrs),
+            ip_address=attrs.get('NetworkSettings', {}).get('IPAddress') or None,  # none with rootless podman
+        )
+
+    def list_containers(self, label=None, status=None):
+        args = ['--filter', 'label={}'.format(label)] if label else []
+        if status:
+            args += ['--filter', 'status={}'.format(status)]
+        ids = self._output(*self.podman, 'ps', '--all', '--quiet', '--no-trunc', *args).split()
+        return [self._container(attrs) for attrs in self._inspect('container', ids)]
+
+    def remove_container(self, container_id, force=False):
+        args = self.podman + (['rm', '--force'] if force else ['rm'])
+        self._output(*(args + [container_id]))
+
+    def export_path(self, image, path, volumes=None):
+        container_id = self._output(*(self.podman + ['create'] + _volume_args(volumes) + [image])).strip()
+        try:
+            for chunk in self._copy_out(container_id, path):
+                yield chunk
+        finally:
+            self.remove_container(container_id)
+
+    def export_paths(self, image, root, names, volumes=None):
+        container_id = self._output(*(self.podman + ['create'] + _volume_args(volumes) + [image])).strip()
+        try:
+            archives = (
+                (posixpath.dirname(name), self._copy_out(container_id, posixpath.join(root, name))) for name in names
+            )
+            for chunk in base.merge_archives(archives):
+                yield chunk
+        finally:
+            self.remove_container(container_id)
+
+    def _copy_out(self, container_id, path):
+        process = subprocess.Popen(
+            self.podman + ['cp', '{}:{}'.format(container_id, path), '-'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        for chunk in iter(lambda: process.stdout.read(CHUNK_SIZE), b''):
+            yield chunk
+        _, error = process.communicate()
+        if process.returncode != 0:
+            error = error.decode('utf-8', 'replace').strip()
+            if 'no such file or directory' in error.lower():
+                raise base.NotFound('No such path {}: {}'.format(path, error))
+            raise base.EngineError('Unable to export {}: {}'.format(path, error))
+
+    def import_path(self, image, path, data, volumes=None):
+        container_id = self._output(*(self.podman + ['create'] + _volume_args(volumes) + [image])).strip()
+        try:
+            process = subprocess.Popen(self.podman + ['cp', '-', '{}:{}'.format(container_id, path)], stdin=data)
+            if process.wait() != 0:
+                raise base.EngineError('Unable to import archive in {}'.format(path))
+        finally:
+            self.remove_container(container_id)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+Call policy applied to every call made to a container engine.
+
+An overloaded daemon answers slowly or with errors: instead of failing at
+once, or making things worse with immediate retries, failed calls are retried
+after an exponential backoff with jitter (within a time budget by operation),
+and the calls made to a daemon are limited by a token bucket. Only idempotent
+operations are retried: a failed build or container run may have done part of
+its work (eg. left a container running).
+"""
+
+import logging
+import random
+import threading
+import time
+
+from . import base
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 300
+DEFAULT_TIMEOUTS = {
+    'pull_image': 1800,
+    'push_image': 1800,
+}
+OPERATIONS = (
+    'get_image', 'build_image', 'pull_image', 'push_image', 'tag_image', 'list_images', 'remove_image',
+    'create_volume', 'list_volumes', 'remove_volume', 'run_container', 'run_output', 'start_container',
+    'list_containers', 'remove_container', 'import_path',
+)
+UNSAFE_OPERATIONS = ('build_image', 'run_container', 'run_output', 'start_container')  # never retried
+STREAM_OPERATIONS = ('save_image', 'export_path', 'export_paths')  # generators, only rate limited
+COUNTERS = ('calls', 'retries', 'throttled', 'throttled_time')
+
+
+class TokenBucket(object):
+    """
+    Allow `rate` calls by second on average, and bursts of `burst` calls
+
+    Callers take tokens in advance and wait for the ones they borrowed, so that
+    concurrent callers are served in turn.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, return the time spent waiting for it (in seconds)."""
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class Policy(object):
+    """
+    Call policy settings (shared by engines, each engine having its own token bucket)
+
+    Args:
+        retries (int): number of retries of a failed call (NotFound errors and UNSAFE_OPERATIONS are never retried)
+        delay (float): delay before the first retry, doubled by retry and jittered (in seconds)
+        max_delay (float): maximum delay between two tries (in seconds)
+        rate (float): calls allowed by second on a daemon (0 for no limit)
+        burst (int): calls allowed at once on a daemon (by default, `rate`)
+        timeouts (dict): seconds by operation after which a failed call is not retried anymore
+    """
+
+    def __init__(self, retries=4, delay=0.5, max_delay=30, rate=0, burst=None, timeouts=None):
+        self.retries = retries
+        self.delay = delay
+        self.max_delay = max_delay
+        self.rate = rate
+        self.burst = burst
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+
+    def delays(self):
+        """Yield the delays before each retry (exponential backoff with equal jitter)."""
+        for attempt in range(self.retries):
+            delay = min(self.max_delay, self.delay * 2 ** attempt)
+            yield delay / 2 + random.uniform(0, delay / 2)
+
+
+class PolicyEngine(base.Engine):
+    """
+    Apply `policy` to the calls made to `engine`
+
+    Other attributes (eg. `client`) are the ones of `engine`. Calls, retries and
+    throttled calls (and the time they waited) are counted in `counters`.
+    """
+
+    def __init__(self, engine, policy):
+        self.engine = engine
+        self.policy = policy
+        self.name = engine.name
+        self.base_url = engine.base_url
+        self.bucket = TokenBucket(policy.rate, policy.burst) if policy.rate else None
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name == 'engine':  # not initialized yet
+            raise AttributeError(name)
+        return getattr(self.engine, name)
+
+    def _count(self, **counts):
+        with self._lock:
+            for counter, value in counts.items():
+                self.counters[counter] += value
+
+    def _throttle(self):
+        waited = self.bucket.acquire() if self.bucket else 0
+        if waited:
+            self._count(calls=1, throttled=1, throttled_time=waited)
+        else:
+            with self._lock:
+                self.counters['calls'] += 1
+
+    def call(self, operation, *args, **kwargs):
+        function = getattr(self.engine, operation)
+        deadline = time.time() + self.policy.timeouts.get(operation, DEFAULT_TIMEOUT)
+        delays = iter(()) if operation in UNSAFE_OPERATIONS else self.policy.delays()
+        while True:
+            self._throttle()
+            try:
+                return function(*args, **kwargs)
+            except base.NotFound:
+                raise
+            except base.EngineError as e:
+                delay = next(delays, None)
+                if delay is None or time.time() + delay > deadline:
+                    raise
+                logger.warning('%s failed on %s (%s), retrying in %.1fs...', operation, self, e, delay)
+                self._count(retries=1)
+                time.sleep(delay)
+
+    def stream(self, operation, *args, **kwargs):
+        self._throttle()
+        for chunk in getattr(self.engine, operation)(*args, **kwargs):
+            yield chunk
+
+
+def _operation(name, stream=False):
+    def method(self, *args, **kwargs):
+        return (self.stream if stream else self.call)(name, *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = getattr(base.Engine, name).__doc__
+    return method
+
+
+def add_operations(cls):
+    """Define the engine operations of the wrapper `cls` through its `call` and `stream` methods."""
+    for name in OPERATIONS:
+        setattr(cls, name, _operation(name))
+    for name in STREAM_OPERATIONS:
+        setattr(cls, name, _operation(name, stream=True))
+    return cls
+
+
+add_operations(PolicyEngine)
+
+
+def get_counters(engines):
+    """Sum the counters of the `engines` applying a policy."""
+    counters = dict.fromkeys(COUNTERS, 0)
+    for engine in engines:
+        for counter, value in getattr(engine, 'counters', {}).items():
+            counters[counter] += value
+    return counters
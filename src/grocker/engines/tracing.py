@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+Record every call made to a container engine as a span of the started tracer (see grocker.trace).
+"""
+
+from .. import trace
+from . import base
+from . import policy
+
+
+class TracingEngine(base.Engine):
+    """
+    Record the calls made to `engine` as `engine` spans
+
+    A span records the operation, its target (image, container or volume) or
+    label filter, the engine endpoint, the error it raised (if any) and, for
+    streamed operations, the bytes streamed. Other attributes are the ones of
+    `engine`.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.name = engine.name
+        self.base_url = engine.base_url
+
+    def __getattr__(self, name):
+        if name == 'engine':  # not initialized yet
+            raise AttributeError(name)
+        return getattr(self.engine, name)
+
+    def _span(self, operation, args, kwargs):
+        span_args = {'engine': self.base_url or 'default'}
+        targets = args[1:] if operation == 'build_image' else args  # images are built from a path
+        if targets:
+            span_args['target'] = targets[0]
+        if kwargs.get('label'):
+            span_args['label'] = kwargs['label']
+        return trace.span(operation, 'engine', **span_args)
+
+    def call(self, operation, *args, **kwargs):
+        with self._span(operation, args, kwargs) as span_args:
+            try:
+                return getattr(self.engine, operation)(*args, **kwargs)
+            except base.EngineError as e:
+                span_args['error'] = '{}: {}'.format(type(e).__name__, e)
+                raise
+
+    def stream(self, operation, *args, **kwargs):
+        with self._span(operation, args, kwargs) as span_args:
+            span_args['bytes'] = 0
+            for chunk in getattr(self.engine, operation)(*args, **kwargs):
+                span_args['bytes'] += len(chunk)
+                yield chunk
+
+
+policy.add_operations(TracingEngine)
@@ -3,7 +3,6 @@
 
 
 import contextlib
-import functools
 import io
 import json
 import os.path
@@ -16,6 +15,8 @@ import pip.baseparser
 import pkg_resources
 import yaml
 
+from . import trace
+
 
 def copy_resource(resource, destination, package='grocker'):
     resource_path = pkg_resources.resource_filename(package, resource)
@@ -78,19 +79,15 @@ def pip_conf(pip_conf_path=None):
         yield pip_conf_path
 
 
-def retry(exception, tries=3, delay=1):
-    def decorator(function):
-        @functools.wraps(function)
-        def inner(*args, **kwargs):
-            for i in range(tries):
-                try:
-                    return function(*args, **kwargs)
-                except exception:
-                    if i + 1 == tries:
-                        raise
-                    time.sleep(delay)
-        return inner
-    return decorator
+@contextlib.contextmanager
+def timed(timings, name):
+    """Add the time spent in the `with` block to `timings[name]` (in seconds), and trace it as a stage."""
+    start = time.time()
+    try:
+        with trace.span(name, 'stage'):
+            yield
+    finally:
+        timings[name] = round(timings.get(name, 0) + time.time() - start, 3)
 
 
 def get_version_from_requirement(requirement):
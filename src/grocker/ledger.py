@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+Local build ledger (a SQLite database with a row by build).
+
+It records the inputs, stage durations, cache usage, image size and outcome
+of each build, to report build history and statistics and to predict how
+long a build (or one of its stages) should take.
+"""
+
+import contextlib
+import json
+import os
+import os.path
+import sqlite3
+import time
+
+from . import utils
+
+DEFAULT_PATH = '~/.cache/grocker/ledger.sqlite'
+HIT_ORIGINS = ('local', 'pulled', 'reused')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    release TEXT NOT NULL,
+    image TEXT,
+    runtime TEXT,
+    config_hash TEXT,
+    engine TEXT,
+    outcome TEXT NOT NULL,
+    error TEXT,
+    timings TEXT,
+    cache TEXT,
+    image_size INTEGER
+)
+"""
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+class Ledger(object):
+    """
+    Build ledger stored in the SQLite database `path`
+
+    A connection is opened by call, so that a ledger can be shared between threads.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = os.path.expanduser(path)
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self.connect() as connection:
+            connection.execute(SCHEMA)
+
+    @contextlib.contextmanager
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            with connection:  # commit (or rollback)
+                yield connection
+        finally:
+            connection.close()
+
+    def record(self, engine_name, config, collect, outcome, started, error=None):
+        """
+        Record a build
+
+        Args:
+            engine_name (str): the container engine used
+            config (dict): Grocker config
+            collect (dict): the information collected by the build (release, image, timings, cache, size)
+            outcome (str): `succeeded`, `reused` or `failed`
+            started (float): build start timestamp
+            error (str): why the build failed
+        """
+        with self.connect() as connection:
+            connection.execute(
+                'INSERT INTO builds (started, duration, release, image, runtime, config_hash, engine, outcome, '
+                'error, timings, cache, image_size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    started,
+                    round(time.time() - started, 3),
+                    collect['release'],
+                    collect.get('image'),
+                    config['runtime'],
+                    utils.config_identifier(config),
+                    engine_name,
+                    outcome,
+                    error,
+                    json.dumps(collect.get('timings') or {}, sort_keys=True),
+                    json.dumps(collect.get('cache') or {}, sort_keys=True),
+                    collect.get('size'),
+                ),
+            )
+
+    def _builds(self, query, params=()):
+        with self.connect() as connection:
+            rows = connection.execute(query, params).fetchall()
+        builds = []
+        for row in rows:
+            build = dict(zip(row.keys(), row))
+            build['timings'] = json.loads(build['timings'] or '{}')
+            build['cache'] = json.loads(build['cache'] or '{}')
+            builds.append(build)
+        return builds
+
+    def history(self, limit=20, release=None):
+        """Return the last `limit` builds (of releases matching the SQL LIKE pattern `release`), last first."""
+        if release:
+            return self._builds(
+                'SELECT * FROM builds WHERE release LIKE ? ORDER BY started DESC LIMIT ?', (release, limit),
+            )
+        return self._builds('SELECT * FROM builds ORDER BY started DESC LIMIT ?', (limit,))
+
+    def estimate(self, config, stage=None, samples=10):
+        """
+        Predict the duration of a build (or of one of its `stage`) from the last successful builds
+
+        Builds with the same config are used first, then builds with the same runtime.
+
+        Returns:
+            tuple: the median duration (in seconds) and the number of builds it was computed from (or None)
+        """
+        query = 'SELECT * FROM builds WHERE outcome = ? AND {} = ? ORDER BY started DESC LIMIT ?'
+        for column, value in (('config_hash', utils.config_identifier(config)), ('runtime', config['runtime'])):
+            builds = self._builds(query.format(column), ('succeeded', value, samples))
+            durations = [
+                build['timings'][stage] if stage else build['duration']
+                for build in builds if not stage or stage in build['timings']
+            ]
+            if durations:
+                return _median(durations), len(durations)
+        return None
+
+    def stats(self, since=None):
+        """
+        Aggregate the builds started after the `since` timestamp
+
+        Returns:
+            dict: build count by outcome, stage durations (count, mean and median),
+            cache hit rate by stage and mean image size
+        """
+        builds = self._builds('SELECT * FROM builds WHERE started >= ?', (since or 0,))
+        outcomes, durations, origins = {}, {}, {}
+        for build in builds:
+            outcomes[build['outcome']] = outcomes.get(build['outcome'], 0) + 1
+            if build['outcome'] == 'succeeded':
+                durations.setdefault('build', []).append(build['duration'])
+                for stage, duration in build['timings'].items():
+                    durations.setdefault(stage, []).append(duration)
+            for stage, origin in build['cache'].items():
+                origins.setdefault(stage, []).append(origin)
+
+        sizes = [build['image_size'] for build in builds if build['image_size']]
+        return {
+            'builds': len(builds),
+            'outcomes': outcomes,
+            'durations': {
+                stage: {'count': len(values), 'mean': sum(values) / len(values), 'median': _median(values)}
+                for stage, values in durations.items()
+            },
+            'cache_hit_rates': {
+                stage: sum(1 for origin in values if origin in HIT_ORIGINS) / float(len(values))
+                for stage, values in origins.items()
+            },
+            'image_size': sum(sizes) / len(sizes) if sizes else None,
+        }
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+Host-wide locks shared by the Grocker processes of a host (eg. concurrent CI jobs).
+
+Locks are `flock`-ed files of the lock directory (`GROCKER_LOCK_DIR`, by default
+`~/.cache/grocker/locks`), scoped by container engine (daemon). They are
+released when their process dies.
+
+- A stage lock serializes the builds of a stage (root or compiler image,
+  wheels) with the same fingerprint: later builds wait for the first one, then
+  reuse its result.
+- Build slots limit the number of heavy stages (compilation, image builds) run
+  at the same time by a daemon.
+"""
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import os.path
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = '~/.cache/grocker/locks'
+POLL_INTERVAL = 0.5
+
+_slots = threading.local()  # build slots held by the current thread
+
+
+def lock_path(engine, name):
+    directory = os.path.expanduser(os.environ.get('GROCKER_LOCK_DIR') or DEFAULT_DIRECTORY)
+    if not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except OSError as e:  # created by a concurrent process
+            if e.errno != errno.EEXIST:
+                raise
+    key = '{}|{}|{}'.format(engine.name, engine.base_url or 'default', name)
+    return os.path.join(directory, '{}.lock'.format(hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]))
+
+
+def _try_lock(fp):
+    try:
+        fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except (IOError, OSError) as e:
+        if e.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        return False
+
+
+@contextlib.contextmanager
+def stage_lock(engine, key):
+    """Hold the lock of the stage `key` (eg. an image name) for `engine`, waiting for its holder if needed."""
+    with open(lock_path(engine, 'stage:{}'.format(key)), 'a') as fp:
+        if not _try_lock(fp):
+            logger.info('Waiting for a concurrent build of %s...', key)
+            fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def build_slot(engine, slots):
+    """
+    Hold one of the `slots` build slots of `engine`, waiting for a free one if needed
+
+    Nothing is limited when `slots` is 0 (or None), and a thread already holding
+    a slot does not take another one (heavy stages may be nested).
+    """
+    if not slots or getattr(_slots, 'held', 0):
+        yield
+        return
+
+    files = [open(lock_path(engine, 'slot:{}'.format(i)), 'a') for i in range(slots)]
+    try:
+        waiting = False
+        while True:
+            held = next((fp for fp in files if _try_lock(fp)), None)
+            if held:
+                break
+            if not waiting:
+                logger.info('Waiting for a build slot on %s...', engine)
+                waiting = True
+            time.sleep(POLL_INTERVAL)
+
+        _slots.held = 1
+        try:
+            yield
+        finally:
+            _slots.held = 0
+            fcntl.flock(held, fcntl.LOCK_UN)
+    finally:
+        for fp in files:
+            fp.close()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+Measure the interpreter startup, the import of the app package and the memory it uses.
+
+Run with the python of a runner image by `grocker bench-image`, the result is
+written as JSON on the last line of the output.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+IMPORT_SCRIPT = (
+    "import {package}\n"
+    "with open('/proc/self/status') as fp:\n"
+    "    print([line.split()[1] for line in fp if line.startswith('VmRSS:')][0])\n"
+)
+SLOWEST_MODULES = 10
+
+
+def app_package():
+    """Return the top-level package of the app (GROCKER_APP distribution)."""
+    import pkg_resources
+    name = os.environ['GROCKER_APP']
+    distribution = pkg_resources.get_distribution(name)
+    if distribution.has_metadata('top_level.txt'):
+        return sorted(distribution.get_metadata_lines('top_level.txt'))[0]
+    return name.replace('-', '_')
+
+
+def timed_run(command):
+    """Run `command`, return its duration (in seconds), return code and output (stdout and stderr)."""
+    start = time.time()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    return time.time() - start, process.returncode, stdout.decode('utf-8', 'replace'), stderr.decode('utf-8', 'replace')
+
+
+def parse_importtime(output):
+    """Return the modules of `-X importtime` output, slowest first (self and cumulative times in seconds)."""
+    modules = []
+    for line in output.splitlines():
+        fields = line.split('|')
+        if not line.startswith('import time:') or len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        modules.append({
+            'module': fields[2].strip(),
+            'self': int(fields[0].split(':')[1]) / 1e6,
+            'cumulative': int(fields[1]) / 1e6,
+        })
+    return sorted(modules, key=lambda module: -module['self'])
+
+
+def main():
+    package = sys.argv[1] if len(sys.argv) > 1 else app_package()
+    interpreter, _, _, _ = timed_run([sys.executable, '-c', 'pass'])
+    importtime = ['-X', 'importtime'] if sys.version_info >= (3, 7) else []
+    duration, return_code, stdout, stderr = timed_run(
+        [sys.executable] + importtime + ['-c', IMPORT_SCRIPT.format(package=package)],
+    )
+    if return_code:
+        sys.stderr.write(stderr)
+        sys.exit('Unable to import {}'.format(package))
+
+    modules = parse_importtime(stderr)
+    package_module = [module for module in modules if module['module'] == package]
+    result = {
+        'package': package,
+        'python': sys.version.split()[0],
+        'interpreter': round(interpreter, 6),
+        'import': round(package_module[0]['cumulative'] if package_module else max(duration - interpreter, 0), 6),
+        'rss': int(stdout.split()[-1]) * 1024,
+        'importtime': modules[:SLOWEST_MODULES],
+    }
+    print(json.dumps(result, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
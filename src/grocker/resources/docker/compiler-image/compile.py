@@ -3,28 +3,74 @@
 
 import argparse
 import base64
+import contextlib
+import fcntl
+import hashlib
+import json
 import logging
 import logging.config
+import math
+import multiprocessing
 import os
 import os.path
+import re
+import shutil
+import socket
 import subprocess
+import sys
 import tempfile
+import time
 import zlib
 
 try:  # Python 3+
     import configparser
+    from urllib import error as urllib_error
+    from urllib import request as urllib_request
 except ImportError:  # Python 2.7
-    import configparser as configparser
+    import ConfigParser as configparser
+    import urllib2 as urllib_error
+    import urllib2 as urllib_request
 
 
 WHEELS_DIRECTORY = os.path.expanduser('~/packages')
+REPORTS_DIRECTORY = os.path.join(WHEELS_DIRECTORY, '.reports')  # wheel reports, by Grocker build
+REPORTS_KEPT = 20
+USAGE_PATH = os.path.join(WHEELS_DIRECTORY, '.usage.json')  # last use of each wheel
+COMPACTION_PATH = os.path.join(WHEELS_DIRECTORY, '.compaction.json')  # result of the last compaction
+PROBE_PROJECT = 'grocker-wheelhouse-probe'  # a project missing in every wheelhouse
+COLLECTING_PATTERN = re.compile(r'^Collecting ([A-Za-z0-9][A-Za-z0-9._-]*)')
+BUILDING_PATTERN = re.compile(
+    r'^(?:Running setup\.py bdist_wheel for|Building wheel for) ([A-Za-z0-9][A-Za-z0-9._-]*)'
+    r'(?: \([^)]*\))?: (started|finished)'
+)
+WHEEL_FILE_PATTERN = re.compile(r'([A-Za-z0-9][A-Za-z0-9_.+-]*\.whl)\b')
+REQUIREMENT_PATTERN = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^]]*\])?\s*(?:(===?)\s*([^\s;,#]+))?')
+WHEEL_CACHE_INDEX_ATTEMPTS = 5
+CGROUP_DIRECTORY = '/sys/fs/cgroup'
+BUILD_JOBS_VARIABLES = {  # standard variables setting the parallel jobs of native extension builds
+    'MAKEFLAGS': '-j{}',
+    'CMAKE_BUILD_PARALLEL_LEVEL': '{}',
+    'NPY_NUM_BUILD_JOBS': '{}',
+    'MAX_JOBS': '{}',
+    'GRPC_PYTHON_BUILD_EXT_COMPILER_JOBS': '{}',
+}
 
 
 def arg_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--python', default='python')
     parser.add_argument('--no-color', action='store_true')
-    parser.add_argument('release', nargs='+')
+    parser.add_argument('--no-deps', action='store_true', help="do not build the releases dependencies")
+    parser.add_argument(
+        '--keep-going', action='store_true', help="go on with the other releases when one fails to compile",
+    )
+    parser.add_argument('--wheel-cache', default=os.environ.get('GROCKER_WHEEL_CACHE_URL'))
+    parser.add_argument('--report-id', default=os.environ.get('GROCKER_REPORT_ID'), help="write a wheel report")
+    parser.add_argument('--compact', action='store_true', help="remove unused wheels instead of compiling")
+    parser.add_argument('--unused-days', type=int, help="compact: remove wheels unused for this many days")
+    parser.add_argument('--unused-builds', type=int, help="compact: remove wheels unused by this many last builds")
+    parser.add_argument('--dry-run', action='store_true', help="compact: only report what would be removed")
+    parser.add_argument('release', nargs='*')
 
     return parser
 
@@ -75,12 +121,365 @@ def setup_venv(python):
     return venv
 
 
-def build_wheels(venv, package, package_dir, constraint=None):
+def get_cpu_quota(cgroup_directory=CGROUP_DIRECTORY):
+    """Return the CPU count allowed by the CFS quota of the container cgroup (rounded up, None without quota)."""
+    try:  # cgroup v2
+        with open(os.path.join(cgroup_directory, 'cpu.max')) as fp:
+            quota, period = fp.read().split()[:2]
+    except (IOError, OSError, ValueError):
+        try:  # cgroup v1
+            with open(os.path.join(cgroup_directory, 'cpu', 'cpu.cfs_quota_us')) as fp:
+                quota = fp.read().strip()
+            with open(os.path.join(cgroup_directory, 'cpu', 'cpu.cfs_period_us')) as fp:
+                period = fp.read().strip()
+        except (IOError, OSError):
+            return None
+    if quota in ('max', '-1') or not int(period):
+        return None
+    return max(1, int(math.ceil(float(quota) / int(period))))
+
+
+def get_build_jobs(environ, cgroup_directory=CGROUP_DIRECTORY):
+    """Return the parallel jobs of native extension builds (by default, the usable CPU count)."""
+    if environ.get('GROCKER_BUILD_JOBS'):
+        return int(environ['GROCKER_BUILD_JOBS'])
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # Python 2.7
+        cpus = multiprocessing.cpu_count()
+    quota = get_cpu_quota(cgroup_directory)  # not taken into account by the CPU affinity
+    return min(cpus, quota) if quota else cpus
+
+
+def setup_build_jobs(environ):
+    """Set the parallel build variables in `environ` (unless already set)."""
+    jobs = get_build_jobs(environ)
+    info('Building native extensions with %d parallel jobs...', jobs)
+    for name, template in BUILD_JOBS_VARIABLES.items():
+        environ.setdefault(name, template.format(jobs))
+
+
+def setup_ccache(environ):
+    """
+    Compile native extensions through ccache when its directory is set
+
+    Returns:
+        dict: the ccache statistics before the compilation (see ccache_stats),
+        None when ccache is not used
+    """
+    if not environ.get('CCACHE_DIR'):
+        return None
+    info('Using ccache in %s (max size %s)...', environ['CCACHE_DIR'], environ.get('CCACHE_MAXSIZE', 'default'))
+    environ.setdefault('CC', 'ccache cc')
+    environ.setdefault('CXX', 'ccache c++')
+    return ccache_stats()  # not zeroed, the cache (and its statistics) is shared by concurrent compilations
+
+
+def ccache_stats():
+    """Return the ccache counters by name (empty if `ccache --print-stats` is not supported)."""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(['ccache', '--print-stats'], stderr=devnull)
+    except (subprocess.CalledProcessError, OSError):
+        return {}
+    stats = {}
+    for line in output.decode('utf-8', 'replace').splitlines():
+        fields = line.split('\t')
+        if len(fields) == 2 and fields[1].strip().isdigit() and not fields[0].endswith('_timestamp'):
+            stats[fields[0]] = int(fields[1])
+    return stats
+
+
+def ccache_report(before, after):
+    """Return the ccache statistics of the compilation, the difference of the counters `before` and `after` it."""
+    if not after:
+        return 'ccache: no statistics (ccache --print-stats is not supported)'
+    delta = dict((name, value - before.get(name, 0)) for name, value in after.items())
+    hits = delta.get('direct_cache_hit', 0) + delta.get('preprocessed_cache_hit', 0)
+    misses = delta.get('cache_miss', 0)
+    ratio = 100.0 * hits / (hits + misses) if hits + misses else 0
+    return 'ccache: {} hit(s), {} miss(es), {:.0f}% hit ratio'.format(hits, misses, ratio)
+
+
+def count_download(line, downloads):
+    """Count the archives pip took from its cache (hits) or downloaded (misses) in `downloads`."""
+    line = line.strip()
+    if line.startswith('Using cached '):
+        downloads['hits'] += 1
+    elif line.startswith('Downloading '):
+        downloads['misses'] += 1
+
+
+def pip_cache_report(downloads):
+    total = downloads['hits'] + downloads['misses']
+    ratio = 100.0 * downloads['hits'] / total if total else 0
+    return 'pip cache: {} hit(s), {} miss(es), {:.0f}% hit ratio'.format(downloads['hits'], downloads['misses'], ratio)
+
+
+def normalize(name):
+    """Normalize a project name as in wheel file names."""
+    return re.sub(r'[-_.]+', '_', name).lower()
+
+
+def requirement_pins(requirements):
+    """
+    Return the pinned version of each of `requirements` (release or constraint lines)
+
+    Returns:
+        dict: normalized project name -> pinned version (None when not pinned
+        with `==`)
+    """
+    pins = {}
+    for line in requirements:
+        match = REQUIREMENT_PATTERN.match(line.strip())
+        if match:
+            name = normalize(match.group(1))
+            pins[name] = match.group(3) if match.group(3) and '*' not in match.group(3) else pins.get(name)
+    return pins
+
+
+class WheelReport(object):
+    """
+    Report how the wheel of each requirement of a release was got, following pip output
+
+    A wheel is `compiled` from source (pip built it, the report gives the build
+    duration), `downloaded` (a binary wheel saved in the wheel directory) or
+    `reused` (found in the wheel directory).
+    """
+
+    def __init__(self, package_dir, release):
+        self.package_dir = package_dir
+        self.release = release
+        self.requirements = []
+        self.mentioned = set()  # wheel files named by pip (the ones it reused, downloaded or built)
+        self.started = {}
+        self.durations = {}
+        self.start = time.time()
+        self.before = self.wheels()
+
+    def wheels(self):
+        """Return the wheels of the wheel directory by normalized project name (mtime and file name)."""
+        wheels = {}
+        for filename in os.listdir(self.package_dir):
+            if filename.endswith('.whl'):
+                name = normalize(filename.split('-')[0])
+                wheel = (os.path.getmtime(os.path.join(self.package_dir, filename)), filename)
+                wheels[name] = max(wheels.get(name, wheel), wheel)  # the last built version
+        return wheels
+
+    def feed(self, line, now=None):
+        now = time.time() if now is None else now
+        line = line.strip()
+        self.mentioned.update(WHEEL_FILE_PATTERN.findall(line))
+        match = COLLECTING_PATTERN.match(line)
+        if match and normalize(match.group(1)) not in self.requirements:
+            self.requirements.append(normalize(match.group(1)))
+        match = BUILDING_PATTERN.match(line)
+        if match and match.group(2) == 'started':
+            self.started[normalize(match.group(1))] = now
+        elif match and normalize(match.group(1)) in self.started:
+            name = normalize(match.group(1))
+            self.durations[name] = round(now - self.started.pop(name), 3)
+
+    def used_wheels(self):
+        """Return the wheel files of the wheel directory used by the release."""
+        used = set(entry['wheel'] for entry in self.entries() if entry['wheel'])
+        used.update(name for name in self.mentioned if os.path.exists(os.path.join(self.package_dir, name)))
+        return used
+
+    def entries(self):
+        wheels = self.wheels()
+        entries = []
+        for name in self.requirements:
+            mtime, filename = wheels.get(name, (None, None))
+            if name in self.durations:
+                origin = 'compiled'
+            elif filename and self.before.get(name) == (mtime, filename):
+                origin = 'reused'
+            else:
+                origin = 'downloaded'
+            entries.append({
+                'release': self.release,
+                'requirement': name,
+                'origin': origin,
+                'duration': self.durations.get(name),
+                'wheel': filename,
+                'size': os.path.getsize(os.path.join(self.package_dir, filename)) if filename else None,
+            })
+        return entries
+
+
+def write_report(report_id, entries):
+    """Write the wheel report of this compilation (the other compilations of the build are on other hosts)."""
+    directory = os.path.join(REPORTS_DIRECTORY, report_id)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(os.path.join(directory, '{}.json'.format(socket.gethostname())), 'w') as fp:
+        json.dump(entries, fp, indent=0, sort_keys=True)
+
+    reports = sorted(os.listdir(REPORTS_DIRECTORY), key=lambda n: os.path.getmtime(os.path.join(REPORTS_DIRECTORY, n)))
+    for name in reports[:-REPORTS_KEPT]:  # reports of old builds
+        shutil.rmtree(os.path.join(REPORTS_DIRECTORY, name), ignore_errors=True)
+
+
+def reported_wheels(report_id, package_dir=WHEELS_DIRECTORY, reports_directory=REPORTS_DIRECTORY):
+    """Return the wheel files of `package_dir` listed by the reports of the `report_id` build (from every host)."""
+    directory = os.path.join(reports_directory, report_id)
+    wheels = set()
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        try:
+            with open(os.path.join(directory, name)) as fp:
+                entries = json.load(fp)
+        except (IOError, OSError, ValueError):
+            continue
+        wheels.update(entry['wheel'] for entry in entries if entry.get('wheel'))
+    return set(name for name in wheels if os.path.exists(os.path.join(package_dir, name)))
+
+
+@contextlib.contextmanager
+def usage_lock(path=USAGE_PATH):
+    """Lock the usage file, shared by the compilations using the wheel volume concurrently."""
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)  # released when closed
+        yield
+
+
+def write_usage(usage, path=USAGE_PATH):
+    with open(path + '.tmp', 'w') as fp:
+        json.dump(usage, fp, indent=0, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def read_usage(path=USAGE_PATH):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        return {'builds': 0, 'wheels': {}, 'compacted': []}
+
+
+def record_usage(wheels, path=USAGE_PATH, now=None):
+    """Record the `wheels` (file names) used by this build in the usage file."""
+    with usage_lock(path):
+        usage = read_usage(path)
+        usage['builds'] += 1
+        for filename in wheels:
+            usage['wheels'][filename] = {'used': time.time() if now is None else now, 'build': usage['builds']}
+        usage['compacted'] = sorted(set(usage.get('compacted', [])) - set(wheels))
+        write_usage(usage, path)
+
+
+def unused_wheels(package_dir, usage, days=None, builds=None, now=None):
+    """
+    Return the wheels of `package_dir` unused for `days` days and by the last `builds` builds
+
+    Wheels without usage record (compiled before it was recorded) were last
+    used when they were written, by no recorded build.
+    """
+    now = time.time() if now is None else now
+    unused = []
+    for filename in sorted(os.listdir(package_dir)):
+        if not filename.endswith('.whl'):
+            continue
+        path = os.path.join(package_dir, filename)
+        record = usage['wheels'].get(filename) or {'used': os.path.getmtime(path), 'build': 0}
+        if days is not None and now - record['used'] < days * 86400:
+            continue
+        if builds is not None and record['build'] > usage['builds'] - builds:
+            continue
+        unused.append(filename)
+    return unused
+
+
+def resolution_time(pip, package_dir, repeat=3):
+    """Return the time pip takes to look for a project in `package_dir` (it lists and parses every wheel)."""
+    destination = tempfile.mkdtemp()
+    command = [pip, 'download', '--no-index', '--no-deps', '--find-links', package_dir, '--dest', destination]
+    durations = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.call(command + [PROBE_PROJECT], stdout=devnull, stderr=devnull)  # fails once all scanned
+            durations.append(time.time() - start)
+    shutil.rmtree(destination)
+    return round(min(durations), 3)
+
+
+def compact(package_dir, days=None, builds=None, dry_run=False):
+    """
+    Remove the unused wheels of `package_dir` (see unused_wheels) and write the result in the compaction file
+
+    The pip resolution time is measured before and after (on a copy of the
+    wheelhouse without the removed wheels, made of symbolic links).
+    """
+    usage = read_usage(USAGE_PATH)
+    wheels = [filename for filename in os.listdir(package_dir) if filename.endswith('.whl')]
+    unused = unused_wheels(package_dir, usage, days, builds)
+
+    venv = tempfile.mkdtemp(suffix='.venv')
+    subprocess.check_call([sys.executable, '-m', 'virtualenv', '-p', sys.executable, venv])  # bundled pip, offline
+    pip = os.path.join(venv, 'bin', 'pip')
+    compacted_dir = tempfile.mkdtemp()
+    for filename in set(wheels) - set(unused):
+        os.symlink(os.path.join(package_dir, filename), os.path.join(compacted_dir, filename))
+    result = {
+        'wheels': len(wheels),
+        'removed': len(unused),
+        'freed': sum(os.path.getsize(os.path.join(package_dir, filename)) for filename in unused),
+        'resolution_time': {
+            'before': resolution_time(pip, package_dir),
+            'after': resolution_time(pip, compacted_dir),
+        },
+        'dry_run': dry_run,
+    }
+    shutil.rmtree(compacted_dir)
+    shutil.rmtree(venv)
+
+    for filename in unused:
+        info('%s %s', 'Would remove' if dry_run else 'Removing', filename)
+        if not dry_run:
+            os.remove(os.path.join(package_dir, filename))
+    if not dry_run:
+        with usage_lock(USAGE_PATH):
+            usage = read_usage(USAGE_PATH)
+            for filename in unused:
+                usage['wheels'].pop(filename, None)
+            # not fetched again from the wheel cache, unless a build uses them again
+            usage['compacted'] = sorted(set(usage.get('compacted', [])) | set(unused))
+            write_usage(usage, USAGE_PATH)
+    with open(COMPACTION_PATH, 'w') as fp:
+        json.dump(result, fp, sort_keys=True)
+    info(
+        '%d of %d wheel(s) unused, %.1f MiB freed, pip resolution time %.2fs -> %.2fs.',
+        result['removed'], result['wheels'], result['freed'] / 1024.0 / 1024,
+        result['resolution_time']['before'], result['resolution_time']['after'],
+    )
+    return result
+
+
+def run_pip(command, downloads, report=None):
+    """Run pip, forwarding its output, counting its downloads and following it in `report`."""
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    for line in iter(process.stdout.readline, b''):
+        line = line.decode('utf-8', 'replace')
+        sys.stdout.write(line)
+        sys.stdout.flush()
+        count_download(line, downloads)
+        if report:
+            report.feed(line)
+    if process.wait():
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def build_wheels(venv, package, package_dir, constraint=None, no_deps=False, downloads=None, report=None):
     info('Building wheels for %s...', package)
     pip = os.path.join(venv, 'bin', 'pip')
     constraint_args = ['--constraint', constraint] if constraint else []
+    no_deps_args = ['--no-deps'] if no_deps else []
+    downloads = {'hits': 0, 'misses': 0} if downloads is None else downloads
+    command = [pip, 'wheel', '--wheel-dir', package_dir] + constraint_args + no_deps_args + [package]
     try:
-        subprocess.check_call([pip, 'wheel', '--wheel-dir', package_dir] + constraint_args + [package])
+        run_pip(command, downloads, report)
         return True
     except subprocess.CalledProcessError as exc:
         info(str(exc))
@@ -89,22 +488,204 @@ def build_wheels(venv, package, package_dir, constraint=None):
         return False
 
 
+class WheelCache(object):
+    """
+    Remote wheel cache shared between Grocker builds
+
+    Wheels are stored as `<url>/<wheel filename>` and listed with their sha256
+    in `<url>/index.json`. Only `file://` URLs and plain HTTP GET/PUT are used.
+    The index is updated under a lock (`file://` URLs) or with conditional PUTs
+    (on servers giving an ETag), and checked after each update.
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def _path(self, name):
+        return '{}/{}'.format(self.url, name)[len('file://'):]
+
+    def _read(self, name):
+        return urllib_request.urlopen('{}/{}'.format(self.url, name)).read()
+
+    def _write(self, name, data, headers=None):
+        url = '{}/{}'.format(self.url, name)
+        if url.startswith('file://'):
+            path = self._path(name)
+            with open(path + '.tmp', 'wb') as fp:
+                fp.write(data)
+            os.rename(path + '.tmp', path)
+        else:
+            request = urllib_request.Request(url, data=data, headers=headers or {})
+            request.get_method = lambda: 'PUT'
+            urllib_request.urlopen(request).read()
+
+    def _read_index(self):
+        """Return the index (None if missing) and its ETag (None if the server gives none)."""
+        try:
+            response = urllib_request.urlopen('{}/index.json'.format(self.url))
+            return json.loads(response.read().decode('utf-8')), response.info().get('ETag')
+        except (urllib_error.URLError, IOError, OSError, ValueError):
+            return None, None
+
+    def index(self):
+        return self._read_index()[0] or {}
+
+    def fetch(self, package_dir, requirements=None, skipped=()):
+        """
+        Download the cached wheels missing in `package_dir`
+
+        Args:
+            package_dir (str): wheel directory
+            requirements (dict): only fetch the wheels of these projects (see
+                requirement_pins, the wheels of their pinned version only)
+            skipped (set): wheel files not to fetch, unless `requirements` pin
+                their version (eg. compacted wheels a build needs again)
+        """
+        fetched = 0
+        for name, digest in sorted(self.index().items()):
+            path = os.path.join(package_dir, name)
+            if os.path.exists(path):
+                continue
+            project, version = name.split('-')[:2]
+            pinned = requirements is not None and requirements.get(normalize(project)) == version
+            if name in skipped and not pinned:
+                continue
+            if requirements is not None:
+                if normalize(project) not in requirements or requirements[normalize(project)] not in (None, version):
+                    continue
+            try:
+                data = self._read(name)
+            except (urllib_error.URLError, IOError, OSError) as exc:
+                info('Unable to fetch %s from wheel cache: %s', name, exc)
+                continue
+            if hashlib.sha256(data).hexdigest() != digest:
+                info('Ignoring %s from wheel cache: sha256 mismatch', name)
+                continue
+            with open(path, 'wb') as fp:
+                fp.write(data)
+            fetched += 1
+        info('%d wheel(s) fetched from wheel cache.', fetched)
+
+    def update_index(self, entries):
+        """Add `entries` (wheel file name -> sha256) to the index, keeping the ones added concurrently."""
+        if self.url.startswith('file://'):
+            with open(self._path('index.json.lock'), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # released when closed
+                index = dict(self.index(), **entries)
+                self._write('index.json', json.dumps(index, indent=0, sort_keys=True).encode('utf-8'))
+            return True
+
+        for _ in range(WHEEL_CACHE_INDEX_ATTEMPTS):
+            index, etag = self._read_index()
+            if etag:
+                headers = {'If-Match': etag}
+            else:
+                headers = {'If-None-Match': '*'} if index is None else {}
+            index = dict(index or {}, **entries)
+            try:
+                self._write('index.json', json.dumps(index, indent=0, sort_keys=True).encode('utf-8'), headers)
+            except urllib_error.HTTPError as exc:
+                if exc.code != 412:
+                    raise
+                continue  # updated concurrently
+            if set(entries).issubset(self.index()):  # servers may ignore the conditions
+                return True
+        return False
+
+    def store(self, package_dir):
+        """Upload the wheels of `package_dir` missing in the cache."""
+        index = self.index()
+        stored = {}
+        for name in sorted(os.listdir(package_dir)):
+            if not name.endswith('.whl') or name in index:
+                continue
+            with open(os.path.join(package_dir, name), 'rb') as fp:
+                data = fp.read()
+            try:
+                self._write(name, data)
+            except (urllib_error.URLError, IOError, OSError) as exc:
+                info('Unable to store %s in wheel cache: %s', name, exc)
+                continue
+            stored[name] = hashlib.sha256(data).hexdigest()
+
+        try:
+            if stored and not self.update_index(stored):
+                info('Unable to update the wheel cache index: too many concurrent updates')
+                stored = {}
+        except (urllib_error.URLError, IOError, OSError) as exc:
+            info('Unable to update the wheel cache index: %s', exc)
+            stored = {}
+        info('%d wheel(s) stored in wheel cache.', len(stored))
+
+
+def compile_releases(venv, args, constraints, downloads, package_dir=WHEELS_DIRECTORY):
+    """
+    Build the wheels of the releases given on the command line (exits on failure, unless `--keep-going`)
+
+    Returns:
+        tuple: the wheel report entries and the used wheels of the compiled releases
+    """
+    entries, used = [], set()
+    with tempfile.NamedTemporaryFile() as fp:
+        fp.write(constraints)
+        fp.flush()
+
+        for release in args.release:
+            report = WheelReport(package_dir, release)
+            if not build_wheels(
+                venv, release, package_dir, fp.name, no_deps=args.no_deps, downloads=downloads, report=report,
+            ):
+                if not args.keep_going:
+                    exit(1)
+                info('Unable to compile %s, going on.', release)
+                continue
+            info('Wheels for %s compiled in %.1fs.', release, time.time() - report.start)
+            entries += report.entries()
+            used.update(report.used_wheels())
+    return entries, used
+
+
 def main():
     parser = arg_parser()
     args = parser.parse_args()
     setup_logging(not args.no_color)
 
+    if args.compact:
+        compact(WHEELS_DIRECTORY, args.unused_days, args.unused_builds, args.dry_run)
+        return
+    if not args.release:
+        parser.error('the following arguments are required: release')
+
+    setup_build_jobs(os.environ)
+    ccache_start = setup_ccache(os.environ)
     venv = setup_venv(args.python)
     setup_pip(venv, WHEELS_DIRECTORY)
 
     constraints = os.environ.get('PIP_CONSTRAINT_CONTENT', base64.b64encode(zlib.compress(b'')))
-    with tempfile.NamedTemporaryFile() as fp:
-        fp.write(zlib.decompress(base64.b64decode(constraints)))
-        fp.flush()
+    constraints = zlib.decompress(base64.b64decode(constraints))
 
-        for release in args.release:
-            if not build_wheels(venv, release, WHEELS_DIRECTORY, fp.name):
-                exit(1)
+    wheel_cache = WheelCache(args.wheel_cache) if args.wheel_cache else None
+    if wheel_cache:  # the wheels of the releases and of their pinned dependencies
+        requirements = args.release + ([] if args.no_deps else constraints.decode('utf-8').splitlines())
+        wheel_cache.fetch(
+            WHEELS_DIRECTORY, requirement_pins(requirements), skipped=set(read_usage().get('compacted', [])),
+        )
+
+    downloads = {'hits': 0, 'misses': 0}
+    entries, used = compile_releases(venv, args, constraints, downloads)
+
+    if args.report_id:
+        write_report(args.report_id, entries)
+        used.update(reported_wheels(args.report_id))  # including the ones compiled on other hosts
+    record_usage(used)
+
+    if os.environ.get('PIP_CACHE_DIR'):
+        info(pip_cache_report(downloads))
+    if ccache_start is not None:
+        info(ccache_report(ccache_start, ccache_stats()))
+
+    if wheel_cache:
+        wheel_cache.store(WHEELS_DIRECTORY)
 
 
 if __name__ == '__main__':
@@ -2,7 +2,12 @@
 set -xe
 
 if which apt; then
+    # Download packages through the package cache (only during the build)
+    if [ -n "${PACKAGE_PROXY:-}" ]; then
+        echo "Acquire::http::Proxy \"${PACKAGE_PROXY}\";" > /etc/apt/apt.conf.d/01grocker-proxy
+    fi
     apt install -qy ${SYSTEM_DEPENDENCIES:=}
+    rm -f /etc/apt/apt.conf.d/01grocker-proxy
 elif which apk; then
     apk add --no-cache ${SYSTEM_DEPENDENCIES:=}
 fi
@@ -10,5 +15,6 @@ fi
 # Unfortunately alpine does not support long options
 install -m 0555 -o grocker /tmp/grocker/compile.py /home/grocker/compile.py
 install -m 0777 -o grocker -d /home/grocker/packages
+install -m 0755 -o grocker -d /home/grocker/.cache /home/grocker/.cache/pip /home/grocker/.cache/ccache
 
 rm -r $(dirname $0)
@@ -5,7 +5,7 @@ GROCKER_USER=grocker
 WORKING_DIR=$(dirname $0)
 
 setup_venv() {  # venv runtime *dependencies
-    local venv runtime release constraint_arg wheelhouse pip
+    local venv runtime release constraint_arg wheelhouse trusted_host_arg pip
     venv=$1
     runtime=$2
     shift 2
@@ -15,7 +15,13 @@ setup_venv() {  # venv runtime *dependencies
     else
         constraint_arg=""
     fi
-    wheelhouse=http://${GROCKER_WHEEL_SERVER_IP:=should-be-defined}/
+    if [ -n "${GROCKER_WHEELHOUSE:=}" ]; then  # local wheelhouse (multi-stage build)
+        wheelhouse="${GROCKER_WHEELHOUSE}"
+        trusted_host_arg=""
+    else
+        wheelhouse=http://${GROCKER_WHEEL_SERVER_IP:=should-be-defined}/
+        trusted_host_arg="--trusted-host=${GROCKER_WHEEL_SERVER_IP}"
+    fi
 
     pip=${venv}/bin/pip
 
@@ -23,7 +29,7 @@ setup_venv() {  # venv runtime *dependencies
     # Old pip can not deal with constraint file
     ${pip} install --upgrade pip
     ${pip} install --no-cache-dir --upgrade pip setuptools ${constraint_arg}
-    ${pip} install --no-cache-dir --find-links=${wheelhouse} --trusted-host=${GROCKER_WHEEL_SERVER_IP} --no-index ${constraint_arg} ${release} --no-compile
+    ${pip} install --no-cache-dir --find-links=${wheelhouse} ${trusted_host_arg} --no-index ${constraint_arg} ${release} --no-compile
 }
 
 
@@ -75,5 +81,10 @@ system_provision() {
     fi
 }
 
-only_run_as_root system_provision
-run_as_user provision
+# GROCKER_PROVISION restricts provisioning to the "system" or "venv" step (multi-stage build)
+if [ "${GROCKER_PROVISION:=all}" != "venv" ]; then
+    only_run_as_root system_provision
+fi
+if [ "${GROCKER_PROVISION}" != "system" ]; then
+    run_as_user provision
+fi
@@ -0,0 +1,52 @@
+#!/bin/sh
+# Run nginx, and stop it after GROCKER_IDLE_TIMEOUT seconds without request nor lease (when set).
+set -e
+
+nginx -g 'daemon off;' &
+NGINX_PID=$!
+
+if [ -z "${GROCKER_IDLE_TIMEOUT:-}" ]; then
+    wait $NGINX_PID
+    exit $?
+fi
+
+# Builds using the server hold a lease (/leases/leases/<id>) until they release it
+# (/leases/released/<id>): the server is busy while a lease is held, and just released ones
+# restart its idle time. Leases older than GROCKER_LEASE_TIMEOUT seconds are expired.
+leased () {
+    status=1
+    now=$(date +%s)
+    for lease in /leases/leases/*; do
+        [ -f "$lease" ] || continue
+        released="/leases/released/$(basename "$lease")"
+        if [ -f "$released" ]; then
+            rm -f "$lease" "$released"
+            status=0
+        elif [ $((now - $(stat -c %Y "$lease"))) -lt "${GROCKER_LEASE_TIMEOUT:-10800}" ]; then
+            status=0
+        else
+            rm -f "$lease"
+        fi
+    done
+    for released in /leases/released/*; do  # releases of expired leases
+        [ -f "$released" ] && [ ! -f "/leases/leases/$(basename "$released")" ] && rm -f "$released"
+    done
+    return $status
+}
+
+INTERVAL=5
+IDLE=0
+while kill -0 $NGINX_PID 2>/dev/null; do
+    sleep $INTERVAL
+    if leased || [ -s /tmp/access.log ]; then
+        : > /tmp/access.log  # nginx appends, truncating is safe
+        IDLE=0
+    else
+        IDLE=$((IDLE + INTERVAL))
+    fi
+    if [ $IDLE -ge "$GROCKER_IDLE_TIMEOUT" ]; then
+        nginx -s quit
+        break
+    fi
+done
+wait $NGINX_PID || true
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+Long-running build service.
+
+Builds are submitted through a small HTTP API and stored in a persistent queue
+(a JSON file by job in the state directory), so that queued builds survive a
+restart. Builds of the same release with the same config and options share a
+job: a submission made while an identical job is queued or running returns
+this job, and every client can follow its output.
+
+HTTP API:
+
+- ``POST /builds``: submit a build (``{"release": ..., "config": {...}, ...}``)
+- ``GET /builds``: list jobs
+- ``GET /builds/<id>``: get a job
+- ``GET /builds/<id>/log``: stream the job output until it is finished
+"""
+
+import contextlib
+import hashlib
+import http.server
+import io
+import json
+import logging
+import os
+import os.path
+import queue
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+from . import engines
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+FINISHED = (SUCCEEDED, FAILED)
+
+# config keys which can be overridden by a build request
+CONFIG_KEYS = (
+    'runtime', 'entrypoint_name', 'pip_constraint', 'wheel_cache', 'pip_cache', 'package_cache', 'docker_hosts',
+    'build_slots', 'docker_image_prefix', 'image_base_name', 'volumes', 'ports', 'runner_build_mode',
+    'wheel_server_idle_timeout', 'compiler_cpus', 'compiler_memory', 'build_jobs', 'ccache', 'ccache_size',
+    'compiler_tmpfs', 'compiler_superset',
+)
+OPTION_KEYS = ('image_name', 'build_dependencies', 'build_image', 'push', 'force')
+BOOLEAN_OPTION_KEYS = ('build_dependencies', 'build_image', 'push', 'force')
+
+
+def job_identifier(config, release, options):
+    """
+    Hash everything a build depends on, identical builds are coalesced
+
+    Args:
+        config (dict): Grocker config
+        release (str): the release to build
+        options (dict): build options (see OPTION_KEYS)
+
+    Returns:
+        str: Job identifier (SHA 256)
+    """
+    constraints = b''
+    if config['pip_constraint']:
+        with open(config['pip_constraint'], 'rb') as fp:
+            constraints = fp.read()
+
+    data = json.dumps([
+        release,
+        utils.config_identifier(config),
+        hashlib.sha256(constraints).hexdigest(),
+        config,
+        options,
+    ], sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class JobQueue(object):
+    """
+    Persistent build queue
+
+    Each job is stored in `<directory>/<id>.json` and its output in `<id>.log`.
+    Jobs which were not finished when the queue was last used are queued again.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.jobs = {}
+        self.pending = queue.Queue()
+        self.condition = threading.Condition()
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                with io.open(os.path.join(directory, name), encoding='utf-8') as fp:
+                    job = json.load(fp)
+                self.jobs[job['id']] = job
+
+        for job in sorted(self.jobs.values(), key=lambda x: x['created']):
+            if job['status'] not in FINISHED:
+                logger.info('Resuming job %s (%s)...', job['id'], job['release'])
+                self.update(job['id'], status=QUEUED)
+                self.pending.put(job['id'])
+
+    def _path(self, job_id, extension):
+        return os.path.join(self.directory, '{}.{}'.format(job_id, extension))
+
+    def _save(self, job):
+        path = self._path(job['id'], 'json')
+        with io.open(path + '.tmp', 'w', encoding='utf-8') as fp:
+            fp.write(json.dumps(job, sort_keys=True))
+        os.rename(path + '.tmp', path)
+
+    def submit(self, job_id, request):
+        """
+        Queue a job (unless the same job is already queued or running)
+
+        Returns:
+            tuple: the job and whether it was coalesced in an existing job
+        """
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job and job['status'] not in FINISHED:
+                return dict(job), True
+
+            job = dict(
+                id=job_id,
+                release=request['release'],
+                request=request,
+                status=QUEUED,
+                created=time.time(),
+                started=None,
+                finished=None,
+                result=None,
+                error=None,
+            )
+            io.open(self._path(job_id, 'log'), 'wb').close()
+            self.jobs[job_id] = job
+            self._save(job)
+            self.pending.put(job_id)
+            return dict(job), False
+
+    def get(self, job_id):
+        with self.condition:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self):
+        with self.condition:
+            return sorted((dict(job) for job in self.jobs.values()), key=lambda x: x['created'])
+
+    def update(self, job_id, **kwargs):
+        with self.condition:
+            self.jobs[job_id].update(kwargs)
+            self._save(self.jobs[job_id])
+            self.condition.notify_all()
+
+    def write(self, job_id, data):
+        """Append `data` (bytes) to the job output."""
+        with self.condition:
+            with io.open(self._path(job_id, 'log'), 'ab') as fp:
+                fp.write(data)
+            self.condition.notify_all()
+
+    def follow(self, job_id, timeout=1):
+        """Yield the job output (by chunks) until the job is finished."""
+        with io.open(self._path(job_id, 'log'), 'rb') as fp:
+            while True:
+                with self.condition:
+                    data = fp.read()
+                    finished = self.jobs[job_id]['status'] in FINISHED
+                    if not data and not finished:
+                        self.condition.wait(timeout)
+                if data:
+                    yield data
+                elif finished:
+                    return
+
+
+class JobOutput(object):
+    """
+    Replacement of `sys.stdout` copying what a job thread writes in the job output
+
+    Args:
+        jobs (JobQueue): the job queue
+        stream (file): the replaced stream
+    """
+
+    def __init__(self, jobs, stream):
+        self.jobs = jobs
+        self.stream = stream
+        self.local = threading.local()
+
+    @property
+    def job_id(self):
+        return getattr(self.local, 'job_id', None)
+
+    @job_id.setter
+    def job_id(self, value):
+        self.local.job_id = value
+
+    def write(self, data):
+        if self.job_id:
+            self.jobs.write(self.job_id, data.encode('utf-8'))
+        self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def isatty(self):
+        return False
+
+
+class JobLogHandler(logging.Handler):
+    """Write the log records of job threads in their job output (see JobOutput)."""
+
+    def __init__(self, output):
+        super(JobLogHandler, self).__init__()
+        self.output = output
+        self.setFormatter(logging.Formatter('%(name)s: %(message)s'))
+
+    def emit(self, record):
+        job_id = self.output.job_id
+        if job_id:
+            self.output.jobs.write(job_id, (self.format(record) + '\n').encode('utf-8'))
+
+
+@contextlib.contextmanager
+def capture_output(jobs):
+    """Copy the output (and the Grocker logs) of job threads in their job output."""
+    output = JobOutput(jobs, sys.stdout)
+    handler = JobLogHandler(output)
+    grocker_logger = logging.getLogger('grocker')
+    old_stdout, sys.stdout = sys.stdout, output
+    grocker_logger.addHandler(handler)
+    try:
+        yield output
+    finally:
+        grocker_logger.removeHandler(handler)
+        sys.stdout = old_stdout
+
+
+class BuildServer(object):
+    """
+    Run the queued builds
+
+    The engines (and so their clients) are created once and used by every build.
+
+    Args:
+        jobs (JobQueue): the job queue
+        engine_name (str): the container engine to use
+        build (callable): `build(engine, pool, config, release, pip_conf=..., **options)`
+            building a release and returning the collected information
+        config_paths (list): Grocker config files used as base config
+        pip_conf (str): pip configuration file
+        policy (grocker.engines.Policy): call policy applied to the engines
+    """
+
+    def __init__(self, jobs, engine_name, build, config_paths=(), pip_conf=None, policy=None):
+        self.jobs = jobs
+        self.engine_name = engine_name
+        self.build = build
+        self.config_paths = list(config_paths)
+        self.pip_conf = pip_conf
+        self.policy = policy
+        self.engine = engines.get_engine(engine_name, policy=policy)
+        self.pool = {}  # {<base url>: <engine>}
+
+    def parse_request(self, request):
+        """Return the config and options of a build request (raise ValueError if it is invalid)."""
+        if not isinstance(request, dict) or not request.get('release'):
+            raise ValueError('A release is required')
+        if not isinstance(request.get('config') or {}, dict):
+            raise ValueError('The config must be an object')
+        unknown = set(request.get('config') or {}) - set(CONFIG_KEYS)
+        unknown |= set(request) - set(OPTION_KEYS) - {'release', 'config'}
+        if unknown:
+            raise ValueError('Unknown keys: {}'.format(', '.join(sorted(unknown))))
+        not_booleans = [key for key in BOOLEAN_OPTION_KEYS if key in request and not isinstance(request[key], bool)]
+        if not_booleans:
+            raise ValueError('Not booleans: {}'.format(', '.join(not_booleans)))
+
+        config = utils.parse_config(self.config_paths, **(request.get('config') or {}))
+        try:
+            utils.check_config(config)
+        except RuntimeError as e:
+            raise ValueError(e.args[0] % e.args[1:])
+        if config['pip_constraint'] and not os.path.isfile(config['pip_constraint']):
+            raise ValueError('No such pip constraint file on the server: {}'.format(config['pip_constraint']))
+        options = {k: request[k] for k in OPTION_KEYS if k in request}
+        return config, options
+
+    def submit(self, request):
+        config, options = self.parse_request(request)
+        job_id = job_identifier(config, request['release'], options)
+        job, coalesced = self.jobs.submit(job_id, request)
+        if coalesced:
+            logger.info('Build of %s coalesced in job %s.', request['release'], job_id)
+        return job, coalesced
+
+    def get_pool(self, config):
+        for base_url in config['docker_hosts']:
+            if base_url not in self.pool:
+                self.pool[base_url] = engines.get_engine(self.engine_name, policy=self.policy, base_url=base_url)
+        return [self.pool[base_url] for base_url in config['docker_hosts']]
+
+    def run(self, job_id, output=None):
+        """Run job `job_id` (its output is captured by the JobOutput `output`)."""
+        job = self.jobs.get(job_id)
+        self.jobs.update(job_id, status=RUNNING, started=time.time())
+        if output is not None:
+            output.job_id = job_id
+        try:
+            config, options = self.parse_request(job['request'])
+            result = self.build(
+                self.engine, self.get_pool(config), config, job['release'], pip_conf=self.pip_conf, **options
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            print(traceback.format_exc())
+            self.jobs.update(job_id, status=FAILED, finished=time.time(), error=str(e))
+        else:
+            self.jobs.update(job_id, status=SUCCEEDED, finished=time.time(), result=result)
+        finally:
+            if output is not None:
+                output.job_id = None
+
+    def work(self):
+        output = sys.stdout if isinstance(sys.stdout, JobOutput) else None
+        while True:
+            job_id = self.jobs.pending.get()
+            if job_id is None:
+                return
+            self.run(job_id, output)
+
+    def start(self, workers=1):
+        """Start `workers` threads running the queued builds."""
+        threads = [threading.Thread(target=self.work) for _ in range(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        return threads
+
+
+class BuildRequestHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP API of a BuildServer (`self.server.build_server`)."""
+
+    def send_json(self, code, data):
+        body = json.dumps(data, sort_keys=True).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        if self.path.rstrip('/') != '/builds':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            job, coalesced = self.server.build_server.submit(request)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        self.send_json(200 if coalesced else 202, dict(job, coalesced=coalesced))
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        jobs = self.server.build_server.jobs
+        parts = self.path.strip('/').split('/')
+        if parts == ['builds']:
+            self.send_json(200, jobs.list())
+            return
+
+        job = jobs.get(parts[1]) if len(parts) in (2, 3) and parts[0] == 'builds' else None
+        if job is None or parts[2:] not in ([], ['log']):
+            self.send_json(404, {'error': 'Not found'})
+        elif len(parts) == 2:
+            self.send_json(200, job)
+        else:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.end_headers()
+            for data in jobs.follow(job['id']):
+                self.wfile.write(data)
+                self.wfile.flush()
+
+    def log_message(self, fmt, *args):
+        logger.debug('%s - %s', self.address_string(), fmt % args)
+
+
+class HTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, build_server):
+        http.server.HTTPServer.__init__(self, address, BuildRequestHandler)
+        self.build_server = build_server
+
+
+def serve(address, build_server):
+    """Serve the HTTP API of `build_server` on `address` (a (host, port) tuple) until interrupted."""
+    httpd = HTTPServer(address, build_server)
+    logger.info('Serving builds on http://%s:%s/builds', *httpd.server_address[:2])
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
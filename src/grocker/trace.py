@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+Trace builds as Chrome trace files (opened with chrome://tracing or https://ui.perfetto.dev).
+
+Once a tracer is started, spans (build, stages and engine calls) are recorded
+as complete events of their thread: a span enclosing others (eg. a stage and
+the engine calls it made) is shown as their parent.
+"""
+
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+
+_tracer = None  # the started tracer
+
+
+class Tracer(object):
+    """Record spans in memory, see `span`."""
+
+    def __init__(self):
+        self.events = []
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        """Record the `with` block as a span, yielding its `args` (updated with the block results)."""
+        thread = threading.current_thread()
+        start = time.time()
+        try:
+            yield args
+        finally:
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': int(start * 1e6),
+                'dur': int((time.time() - start) * 1e6),
+                'pid': os.getpid(),
+                'tid': thread.ident,
+                'args': args,
+            }
+            with self.lock:
+                self.events.append(event)
+                self.threads[thread.ident] = thread.name
+
+    def write(self, path):
+        """Write the recorded spans as a Chrome trace file."""
+        with self.lock:
+            metadata = [
+                {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                for tid, name in sorted(self.threads.items())
+            ]
+            events = sorted(self.events, key=lambda event: event['ts'])
+        with io.open(path, 'w') as fp:
+            fp.write(json.dumps({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, default=str))
+
+
+def start():
+    """Start (and return) a tracer recording the spans of every thread."""
+    global _tracer  # pylint: disable=global-statement
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop():
+    """Stop the started tracer and return it (None if there is none)."""
+    global _tracer  # pylint: disable=global-statement
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def is_started():
+    return _tracer is not None
+
+
+@contextlib.contextmanager
+def span(name, category, **args):
+    """Record the `with` block as a span of the started tracer (if any), see Tracer.span."""
+    tracer = _tracer
+    if tracer is None:
+        yield args
+        return
+    with tracer.span(name, category, **args) as span_args:
+        yield span_args
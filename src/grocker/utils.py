@@ -4,6 +4,7 @@
 
 import hashlib
 import itertools
+import json
 import os.path
 
 import docker
@@ -17,12 +18,19 @@ RECORD_SEPARATOR = b'\x1E'
 UNIT_SEPARATOR = b'\x1F'
 
 
-def config_identifier(config):
+def config_identifier(config, role='compiler'):
     """
-    Hash config to get an unique identifier
+    Hash the config inputs of the `role` image to get an unique identifier
+
+    - root: base image, runtime, run dependencies and repositories;
+    - compiler: root inputs and build dependencies.
+
+    So that a build dependency change does not invalidate the root image (and
+    every runner built on it).
 
     Args:
         config (dict): Grocker config
+        role (str): `root` or `compiler` (also used for the wheels, compiled by the compiler)
 
     Returns:
         str: Config identifier (SHA 256)
@@ -30,19 +38,80 @@ def config_identifier(config):
     def unit_list(l):
         return UNIT_SEPARATOR.join(sorted(x.encode('utf-8') for x in l))
 
-    dependencies = unit_list(get_dependencies(config, with_build_dependencies=True))
+    if role not in ('root', 'compiler'):
+        raise ValueError('Unknown role: {}'.format(role))
+
+    run_dependencies = get_dependencies(config)
     repositories = RECORD_SEPARATOR.join(
         unit_list([name] + [cfg[x] for x in sorted(cfg)])
-        for name, cfg in list(config['repositories'].items())
+        for name, cfg in sorted(config['repositories'].items())
     )
     data = GROUP_SEPARATOR.join([
-        dependencies,
+        config['system']['image'].encode('utf-8'),
+        config['runtime'].encode('utf-8'),
+        unit_list(run_dependencies),
         repositories,
     ])
+    if role == 'compiler':
+        build_dependencies = get_dependencies(config, with_build_dependencies=True)[len(run_dependencies):]
+        data = GROUP_SEPARATOR.join([
+            config_identifier(config, 'root').encode('utf-8'),
+            unit_list(build_dependencies),
+        ])
     digest = hashlib.sha256(data)
     return digest.hexdigest()
 
 
+def runner_identifier(config, release, root_image_id):
+    """
+    Hash all the inputs of a runner image build
+
+    Args:
+        config (dict): Grocker config
+        release (str): the release installed in the runner image
+        root_image_id (str): the ID of the root image used as base image
+
+    Returns:
+        str: Runner identifier (SHA 256)
+    """
+    constraints = b''
+    if config['pip_constraint']:
+        with open(config['pip_constraint'], 'rb') as fp:
+            constraints = fp.read()
+
+    image_config = json.dumps(
+        [config['entrypoint_name'], config['volumes'], config['ports'], config['runner_build_mode']],
+        sort_keys=True,
+    )
+    data = GROUP_SEPARATOR.join(x.encode('utf-8') for x in [
+        __version__,
+        release,
+        config_identifier(config),
+        hashlib.sha256(constraints).hexdigest(),
+        root_image_id,
+        image_config,
+    ])
+    digest = hashlib.sha256(data)
+    return digest.hexdigest()
+
+
+def is_pinned_release(config, release):
+    """
+    Return whether building `release` twice with `config` installs the same versions
+
+    The release must be pinned (`==<version>`) and its dependencies pinned by
+    the pip constraint file: only then does the runner fingerprint (see
+    runner_identifier) identify what the image contains.
+    """
+    specifiers = list(pkg_resources.Requirement.parse(release).specifier)
+    return bool(
+        config['pip_constraint']
+        and len(specifiers) == 1
+        and specifiers[0].operator in ('==', '===')
+        and not specifiers[0].version.endswith('*')
+    )
+
+
 def default_image_name(config, release):
     req = pkg_resources.Requirement.parse(release)
     assert str(req.specifier).startswith('=='), "Only fixed version can use default image name."
@@ -63,8 +132,8 @@ def default_image_name(config, release):
     return '/'.join((docker_image_prefix, img_name)) if docker_image_prefix else img_name
 
 
-def docker_get_client(min_version=None):
-    client = docker.from_env()
+def docker_get_client(min_version=None, base_url=None):
+    client = docker.DockerClient(base_url=base_url, version='auto') if base_url else docker.from_env()
     if min_version and client.version()['ApiVersion'].split('.') <= min_version.split('.'):
         raise RuntimeError(
             'Docker API version should be at least {expected} ({current})'.format(
@@ -127,7 +196,8 @@ def get_dependencies(config, with_build_dependencies=False):
         build_dependencies = itertools.chain(
             config['system']['build'],
             get_build_dependencies(runtime_dependencies),
-            get_build_dependencies(config['dependencies'])
+            get_build_dependencies(config['dependencies']),
+            ['ccache'] if config.get('ccache') else [],
         )
 
         dependencies = itertools.chain(dependencies, build_dependencies)
@@ -135,6 +205,15 @@ def get_dependencies(config, with_build_dependencies=False):
     return list(dependencies)
 
 
+def check_config(config):
+    """Raise RuntimeError if grocker does not know some config values."""
+    if config['runtime'] not in config['system']['runtime']:
+        raise RuntimeError('Unknown runtime: %s', config['runtime'])
+
+    if config['runner_build_mode'] not in ('wheel-server', 'multi-stage'):
+        raise RuntimeError('Unknown runner build mode: %s', config['runner_build_mode'])
+
+
 def parse_config(config_paths, **kwargs):
     """
     Generate config regarding precedence order
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+Watch mode: rebuild the stages invalidated by a change of the build inputs.
+
+Each stage gets a key computed from its inputs and from the key of the
+previous stage, so that invalidating a stage invalidates all the following
+ones.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import os.path
+import time
+
+from .builders import naming
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('root', 'compiler', 'wheels', 'runner')
+
+
+def _digest(*items):
+    data = json.dumps(items, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def _file_digest(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as fp:
+        return hashlib.sha256(fp.read()).hexdigest()
+
+
+def stage_keys(config, release, image_name, pip_conf_path=None):
+    """
+    Compute the key of each build stage
+
+    Args:
+        config (dict): Grocker config
+        release (str): the release to build
+        image_name (str): the runner image name
+        pip_conf_path (str): pip configuration file
+
+    Returns:
+        dict: `{<stage>: <key>}`, a key changes when an input of its stage (or of a previous stage) changes
+    """
+    root = _digest(naming.image_name(config, 'root'), config['system']['image'], config['repositories'])
+    compiler = _digest(root, naming.image_name(config, 'compiler'))
+    wheels = _digest(
+        compiler,
+        release,
+        _file_digest(config['pip_constraint']),
+        _file_digest(pip_conf_path),
+        config['wheel_cache'],
+        config['docker_hosts'],
+    )
+    runner = _digest(
+        wheels,
+        image_name,
+        config['entrypoint_name'],
+        config['volumes'],
+        config['ports'],
+        config['runner_build_mode'],
+    )
+    return dict(zip(STAGES, (root, compiler, wheels, runner)))
+
+
+def invalidated_stages(previous, current):
+    """Return the stages whose key changed (all of them when there is no `previous` keys)."""
+    return [stage for stage in STAGES if (previous or {}).get(stage) != current[stage]]
+
+
+def get_mtimes(paths):
+    """Return the modification time of each path (None for missing paths)."""
+    return {path: os.stat(path).st_mtime if os.path.exists(path) else None for path in paths if path}
+
+
+def wait_for_changes(paths, mtimes, interval=1.0):
+    """Poll `paths` every `interval` seconds until their modification times differ from `mtimes`."""
+    while True:
+        current = get_mtimes(paths)
+        if current != mtimes:
+            changed = sorted(path for path in set(current) | set(mtimes) if current.get(path) != mtimes.get(path))
+            logger.info('Changed: %s', ', '.join(changed))
+            return current
+        time.sleep(interval)
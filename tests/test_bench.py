@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+
+
+import importlib.util
+import json
+import unittest
+
+import pkg_resources
+
+from grocker import bench
+from grocker import engines
+
+
+def load_probe_script():
+    path = pkg_resources.resource_filename('grocker', bench.PROBE_RESOURCE)
+    spec = importlib.util.spec_from_file_location('grocker_probe', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+PROBE_RESULT = {
+    'package': 'foo',
+    'python': '3.9.2',
+    'interpreter': 0.02,
+    'import': 0.3,
+    'rss': 30 * 1024 * 1024,
+    'importtime': [{'module': 'foo', 'self': 0.1, 'cumulative': 0.3}],
+}
+
+
+class BenchImageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = engines.get_engine('fake')
+        self.engine.client.run_output = [b'Starting...\n', json.dumps(PROBE_RESULT).encode('utf-8')]
+
+    def test_bench_image(self):
+        result = bench.bench_image(self.engine, 'grocker-test:1', runs=3, command=['--version'])
+
+        self.assertEqual(result['package'], 'foo')
+        self.assertEqual(sorted(result['metrics']), sorted(bench.METRICS))
+        self.assertEqual(result['samples']['rss'], [30 * 1024 * 1024] * 3)
+        self.assertEqual(result['metrics']['import'], {'first': 0.3, 'min': 0.3, 'median': 0.3, 'max': 0.3})
+        self.assertEqual(result['importtime'], PROBE_RESULT['importtime'])
+
+        probes = [run for run in self.engine.client.runs if run.get('entrypoint')]
+        self.assertEqual(len(probes), 3)
+        self.assertEqual(probes[0]['entrypoint'][:2], [bench.PYTHON, '-c'])
+        self.assertEqual(probes[0]['command'], [])
+        self.assertEqual(self.engine.client.containers.objects, {})  # all removed
+
+    def test_bench_image_without_command(self):
+        result = bench.bench_image(self.engine, 'grocker-test:1', runs=1, package='bar')
+
+        self.assertNotIn('entrypoint', result['metrics'])
+        self.assertEqual(self.engine.client.runs[-1]['command'], ['bar'])
+
+    def test_probe_failure(self):
+        self.engine.client.run_output = []
+        with self.assertRaises(bench.BenchError):
+            bench.bench_image(self.engine, 'grocker-test:1', runs=1)
+
+    def test_regressions(self):
+        result = bench.bench_image(self.engine, 'grocker-test:1', runs=1)
+        baseline = json.loads(json.dumps(result))
+        self.assertEqual(bench.regressions(result, baseline), [])
+
+        baseline['metrics']['import']['median'] = 0.2
+        self.assertEqual(bench.regressions(result, baseline), [('import', 0.2, 0.3)])
+        self.assertEqual(bench.regressions(result, baseline, tolerance=0.6), [])
+
+
+class ProbeTestCase(unittest.TestCase):
+    probe_script = load_probe_script()
+
+    def test_parse_importtime(self):
+        output = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       120 |        120 |   _io',
+            'import time:      2500 |       3000 |     foo.bar',
+            'import time:       800 |       4000 | foo',
+            'Traceback (most recent call last):',
+        ])
+        modules = self.probe_script.parse_importtime(output)
+
+        self.assertEqual([module['module'] for module in modules], ['foo.bar', 'foo', '_io'])
+        self.assertEqual(modules[1], {'module': 'foo', 'self': 0.0008, 'cumulative': 0.004})
@@ -3,11 +3,16 @@
 # Copyright (c) Polyconseil SAS. All rights reserved.
 
 
+import http.server
 import os
 import re
+import socketserver
 import subprocess
 import tempfile
+import threading
 import unittest
+import urllib.error
+import urllib.request
 import uuid
 
 import docker.errors
@@ -15,6 +20,7 @@ import yaml
 
 import grocker.utils
 import grocker.six
+from grocker.builders import naming
 
 
 def docker_rmi(image):
@@ -46,6 +52,30 @@ def docker_inspect(image):
     return client.images.get(image).attrs
 
 
+class MirrorHandler(http.server.BaseHTTPRequestHandler):
+    """Stand-in package mirror: an HTTP proxy recording the URLs it forwards."""
+    requests = []
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.requests.append(self.path)
+        try:
+            response = urllib.request.urlopen(self.path)
+            status, body = response.getcode(), response.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, b''
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
 class AbstractBuildTestCase(unittest.TestCase):
     dependencies = yaml.safe_load("""
         - libzbar0: libzbar-dev
@@ -138,6 +168,15 @@ class BuildTestCase(AbstractBuildTestCase):
         }
         self.check(config, 'grocker-test-project[pep8]==2.0', ['-c', 'pip list'], 'pep8')
 
+    def test_multi_stage(self):
+        config = {
+            'entrypoint_name': '/bin/bash',
+            'dependencies': self.dependencies,
+            'runner_build_mode': 'multi-stage',
+        }
+        _, inspect_data = self.check(config, 'grocker-test-project==2.0', ['-c', 'pip list'], 'qrcode')
+        self.assertEqual(inspect_data['Config']['Labels']['grocker.image.role'], 'runner')
+
     def test_with_docker_prefix(self):
         config = {
             'entrypoint_name': '/bin/bash'
@@ -209,6 +248,35 @@ class BuildTestCase(AbstractBuildTestCase):
         self.check(config, 'grocker-test-project==2.0', ['-c', script], 'True')
 
 
+class PackageCacheTestCase(AbstractBuildTestCase):
+
+    def setUp(self):
+        del MirrorHandler.requests[:]
+        self.mirror = ThreadingHTTPServer(('0.0.0.0', 0), MirrorHandler)
+        threading.Thread(target=self.mirror.serve_forever).start()
+        network = grocker.utils.docker_get_client().networks.get('bridge')
+        gateway = network.attrs['IPAM']['Config'][0]['Gateway']  # the host, as seen by build containers
+        self.config = {
+            'dependencies': ['ed'],
+            'entrypoint_name': '/bin/bash',
+            'package_cache': 'http://{}:{}'.format(gateway, self.mirror.server_port),
+        }
+        self.root_image = naming.image_name(grocker.utils.parse_config([], **self.config), 'root')
+        docker_rmi(self.root_image)  # provision it through the mirror
+
+    def tearDown(self):
+        self.mirror.shutdown()
+        self.mirror.server_close()
+        docker_rmi(self.root_image)
+
+    def test_package_cache(self):
+        script = 'test -e /etc/apt/apt.conf.d/01grocker-proxy || echo "no proxy"'
+        self.check(self.config, 'grocker-test-project==2.0', ['-c', script], 'no proxy')
+
+        self.assertTrue(any('/dists/' in url for url in MirrorHandler.requests), MirrorHandler.requests)
+        self.assertTrue(any(re.search(r'/ed_[^/]*\.deb$', url) for url in MirrorHandler.requests))
+
+
 class BuildCustomRuntimeTestCase(BuildTestCase):
     runtime = 'python2.7'
 
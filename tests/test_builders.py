@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+
+
+import os
+import tempfile
+import time
+
+from grocker import builders
+from grocker import engines
+from grocker import locks
+from grocker import six
+from grocker import utils
+from grocker.builders import build
+from grocker.builders import naming
+from grocker.builders import warm
+
+import testing
+
+
+class RunnerReuseTestCase(testing.LockDirTestCase):
+    release = 'grocker-test-project==2.0'
+
+    def setUp(self):
+        super(RunnerReuseTestCase, self).setUp()
+        self.engine = engines.get_engine('fake')
+        self.config = utils.parse_config([])
+
+    def build(self, name, config=None):
+        config = config or self.config
+        fingerprint = builders.runner_fingerprint(self.engine, config, self.release)
+        image = builders.find_runner_image(self.engine, name, fingerprint)
+        if image:
+            return image, True
+        builders.build_runner_image(
+            self.engine, config, name, self.release,
+            labels={'grocker.runner.fingerprint': fingerprint},
+        )
+        return self.engine.get_image(name), False
+
+    def test_same_inputs(self):
+        image, reused = self.build('grocker-test:1')
+        self.assertFalse(reused)
+        self.assertEqual(self.build('grocker-test:1'), (image, True))
+
+    def test_retag(self):
+        image, _ = self.build('grocker-test:1')
+        other_image, reused = self.build('grocker-test:2')
+        self.assertTrue(reused)
+        self.assertEqual(other_image.id, image.id)
+        self.assertIn('grocker-test:2', other_image.tags)
+
+    def test_different_inputs(self):
+        image, _ = self.build('grocker-test:1')
+        with tempfile.NamedTemporaryFile() as fp:
+            fp.write(b'qrcode==5.2')
+            fp.flush()
+            config = dict(self.config, pip_constraint=fp.name)
+            other_image, reused = self.build('grocker-test:1', config)
+        self.assertFalse(reused)
+        self.assertNotEqual(other_image.id, image.id)
+
+    def test_registry(self):
+        config = dict(self.config, docker_image_prefix='registry.local')  # root image is pushed too
+        image, _ = self.build('registry.local/grocker-test:1', config)
+        self.engine.push_image('registry.local/grocker-test:1')
+
+        registry = self.engine.client.registry
+        self.engine = engines.get_engine('fake')
+        self.engine.client.registry = registry
+        pulled, reused = self.build('registry.local/grocker-test:1', config)
+        self.assertTrue(reused)
+        self.assertEqual(pulled.id, image.id)
+
+    def test_registry_keeps_local_image(self):
+        config = dict(self.config, docker_image_prefix='registry.local')
+        self.build('registry.local/grocker-test:1', config)
+        self.engine.push_image('registry.local/grocker-test:1')
+
+        registry = self.engine.client.registry
+        self.engine = engines.get_engine('fake')
+        self.engine.client.registry = registry
+        labels = {'grocker.runner.fingerprint': 'other'}
+        local_image = self.engine.client.images.add('registry.local/grocker-test:1', labels)
+
+        self.assertIsNone(builders.find_runner_image(self.engine, 'registry.local/grocker-test:1', 'y'))
+        self.assertEqual(self.engine.get_image('registry.local/grocker-test:1').id, local_image.id)
+
+
+class PackageCacheTestCase(testing.LockDirTestCase):
+
+    def setUp(self):
+        super(PackageCacheTestCase, self).setUp()
+        self.engine = engines.get_engine('fake')
+        self.config = utils.parse_config([])
+
+    def proxies(self):
+        return [(build['buildargs'] or {}).get('PACKAGE_PROXY') for build in self.engine.client.builds]
+
+    def test_disabled(self):
+        with build.package_cache(self.engine, self.config) as (proxy, extra_hosts):
+            self.assertIsNone(proxy)
+            self.assertIsNone(extra_hosts)
+        builders.get_or_build_root_image(self.engine, self.config)
+        builders.get_or_build_compiler_image(self.engine, self.config)
+        self.assertEqual(self.proxies(), [None, None])
+
+    def test_url(self):
+        config = dict(self.config, package_cache='http://apt-cache.local:3142')
+        builders.get_or_build_root_image(self.engine, config)
+        builders.get_or_build_compiler_image(self.engine, config)
+        self.assertEqual(self.proxies(), ['http://apt-cache.local:3142'] * 2)
+        self.assertEqual(self.engine.client.runs, [])
+
+    def test_managed(self):
+        config = dict(self.config, package_cache='managed')
+        with build.package_cache(self.engine, config) as (proxy, extra_hosts):
+            self.assertEqual(proxy, 'http://grocker-package-cache:3142')
+            self.assertEqual(extra_hosts, {'grocker-package-cache': '127.0.0.1'})
+            self.assertEqual(len(self.engine.client.containers.objects), 1)
+        self.assertEqual(self.engine.client.containers.objects, {})
+
+        run, = self.engine.client.runs
+        self.assertEqual(run['volumes'], {
+            naming.package_cache_volume_name(): {'bind': build.PACKAGE_CACHE_DIRECTORY, 'mode': 'rw'},
+        })
+        builders.get_or_build_root_image(self.engine, config)
+        self.assertEqual(self.proxies(), [None, 'http://grocker-package-cache:3142'])  # cache image, then root image
+
+    def test_managed_build_args(self):
+        config = dict(self.config, package_cache='managed')
+        builders.get_or_build_root_image(self.engine, config)
+        self.engine.remove_image(naming.image_name(config, 'root'))
+        self.engine.client.ip_address = '127.0.0.2'  # the proxy container IP address changed
+        builders.get_or_build_root_image(self.engine, config)
+
+        first, second = self.engine.client.builds[1:]  # the cache image, then the root image twice
+        self.assertEqual(first['buildargs'], second['buildargs'])  # the layer cache is used
+        self.assertEqual(first['extra_hosts'], {'grocker-package-cache': '127.0.0.1'})
+        self.assertEqual(second['extra_hosts'], {'grocker-package-cache': '127.0.0.2'})
+
+
+class CacheFromTestCase(testing.LockDirTestCase):
+
+    def setUp(self):
+        super(CacheFromTestCase, self).setUp()
+        self.engine = engines.get_engine('fake')
+        self.config = utils.parse_config([])
+
+    def cache_from(self):
+        return [image_build.get('cache_from') for image_build in self.engine.client.builds]
+
+    def test_local_images(self):
+        other_config = dict(self.config, dependencies=self.config['dependencies'] + ['libjpeg62'])
+        builders.get_or_build_root_image(self.engine, self.config)
+        builders.get_or_build_root_image(self.engine, other_config)
+        builders.get_or_build_root_image(self.engine, dict(self.config, runtime='python2.7'))
+
+        self.assertEqual(self.cache_from(), [[], [naming.image_name(self.config, 'root')], []])
+        labels = self.engine.get_image(naming.image_name(self.config, 'root')).labels
+        self.assertEqual(labels['grocker.runtime'], self.config['runtime'])
+
+    def test_registry(self):
+        config = dict(self.config, docker_image_prefix='registry.local')
+        builders.get_or_build_root_image(self.engine, config)
+        latest = naming.image_name(config, 'root', latest=True)
+        self.assertIn(latest, self.engine.client.registry)
+
+        registry = self.engine.client.registry
+        self.engine = engines.get_engine('fake')  # a fresh node
+        self.engine.client.registry = registry
+        other_config = dict(config, dependencies=config['dependencies'] + ['libjpeg62'])
+        builders.get_or_build_root_image(self.engine, other_config)
+
+        self.assertEqual(self.cache_from(), [[latest]])
+        self.assertEqual(
+            self.engine.get_image(latest).id, self.engine.get_image(naming.image_name(other_config, 'root')).id,
+        )
+
+
+    def test_compiler_image(self):
+        config = dict(self.config, docker_image_prefix='registry.local')
+        builders.get_or_build_compiler_image(self.engine, config)
+        other_config = dict(config, dependencies=config['dependencies'] + ['libjpeg62'])
+        builders.get_or_build_compiler_image(self.engine, other_config)
+
+        compiler_builds = [b for b in self.engine.client.builds if b['labels']['grocker.image.role'] == 'compiler']
+        self.assertEqual([b.get('cache_from') for b in compiler_builds], [None, None])
+        self.assertNotIn(naming.image_name(config, 'compiler', latest=True), self.engine.client.registry)
+
+        builders.get_or_build_compiler_image(self.engine, dict(config, compiler_superset=True, runtime='python2.7'))
+        self.assertIn(  # a candidate of the superset compiler images of other hosts
+            naming.image_name(dict(config, runtime='python2.7'), 'compiler', latest=True), self.engine.client.registry,
+        )
+
+
+class CompilerSupersetTestCase(testing.LockDirTestCase):
+
+    def setUp(self):
+        super(CompilerSupersetTestCase, self).setUp()
+        self.engine = engines.get_engine('fake')
+        self.config = utils.parse_config([], compiler_superset=True)
+        system = dict(self.config['system'], build=self.config['system']['build'] + ['libxml2-dev'])
+        self.big_config = dict(self.config, system=system)  # same root image, one more build dependency
+
+    def test_labels(self):
+        builders.get_or_build_compiler_image(self.engine, self.config)
+        labels = self.engine.get_image(naming.image_name(self.config, 'compiler')).labels
+        self.assertEqual(
+            labels[build.COMPILER_BASE_LABEL],
+            '{}-{}'.format(self.config['runtime'], utils.config_identifier(self.config, 'root')),
+        )
+        self.assertEqual(
+            labels[build.COMPILER_PACKAGES_LABEL].split(),
+            sorted(set(utils.get_dependencies(self.config, with_build_dependencies=True))),
+        )
+
+    def test_superset(self):
+        big_image = builders.get_or_build_compiler_image(self.engine, self.big_config)
+        cache = {}
+        image = builders.get_or_build_compiler_image(self.engine, self.config, cache)
+
+        self.assertEqual(image.id, big_image.id)
+        self.assertIn(naming.image_name(self.config, 'compiler'), image.tags)
+        self.assertEqual(cache['compiler'], 'reused')
+        self.assertEqual(len(self.engine.client.builds), 1)  # the big compiler image only
+
+    def test_subset(self):
+        image = builders.get_or_build_compiler_image(self.engine, self.config)
+        big_image = builders.get_or_build_compiler_image(self.engine, self.big_config)
+        self.assertNotEqual(image.id, big_image.id)
+
+    def test_disabled(self):
+        config = dict(self.config, compiler_superset=False)
+        big_image = builders.get_or_build_compiler_image(self.engine, self.big_config)
+        image = builders.get_or_build_compiler_image(self.engine, config)
+        self.assertNotEqual(image.id, big_image.id)
+
+    def test_other_prefix(self):
+        big_config = dict(self.big_config, docker_image_prefix='registry.example.com/other')
+        big_image = builders.get_or_build_compiler_image(self.engine, big_config)
+        image = builders.get_or_build_compiler_image(self.engine, self.config)
+        self.assertEqual(image.id, big_image.id)
+
+    def test_other_root_image(self):
+        config = dict(self.config, runtime='python2.7')
+        big_image = builders.get_or_build_compiler_image(self.engine, self.big_config)
+        image = builders.get_or_build_compiler_image(self.engine, config)
+        self.assertNotEqual(image.id, big_image.id)
+
+        config = dict(self.config, dependencies=self.config['dependencies'] + ['libjpeg62'])
+        image = builders.get_or_build_compiler_image(self.engine, config)
+        self.assertNotEqual(image.id, big_image.id)
+
+
+class WheelServerTestCase(testing.LockDirTestCase):
+
+    def setUp(self):
+        super(WheelServerTestCase, self).setUp()
+        self.engine = engines.get_engine('fake')
+        self.config = utils.parse_config([])
+
+    def containers(self, status='running'):
+        return self.engine.list_containers(label='grocker.image.role=wheel-server', status=status)
+
+    def test_per_build(self):
+        with build.wheel_server(self.engine, self.config) as server_ip:
+            self.assertEqual(server_ip, '127.0.0.1')
+            self.assertEqual(len(self.containers()), 1)
+        self.assertEqual(self.containers(), [])
+
+    def test_no_ip_address(self):
+        self.engine.client.ip_address = ''  # eg. rootless podman
+        with self.assertRaises(engines.EngineError):
+            with build.wheel_server(self.engine, self.config):
+                pass
+        self.assertEqual(self.containers(), [])
+
+    def test_shared(self):
+        config = dict(self.config, wheel_server_idle_timeout=600)
+        for _ in range(2):
+            with build.wheel_server(self.engine, config) as server_ip:
+                self.assertEqual(server_ip, '127.0.0.1')
+
+        container, = self.containers()
+        self.assertEqual(container.labels[build.WHEEL_SERVER_VOLUME_LABEL], naming.wheel_volume_name(config))
+        run, = self.engine.client.runs
+        self.assertEqual(run['environment'], {'GROCKER_IDLE_TIMEOUT': '600', 'GROCKER_LEASE_TIMEOUT': '10800'})
+        self.assertEqual(run['volumes'][naming.wheel_server_volume_name(config)]['bind'], '/leases')
+
+    def test_shared_lease(self):
+        config = dict(self.config, wheel_server_idle_timeout=600)
+        leases = self.engine.client.volumes.create(naming.wheel_server_volume_name(config)).files
+        with build.wheel_server(self.engine, config):
+            lease, = leases
+            self.assertTrue(lease.startswith('leases/'))  # held while the build uses the server
+        self.assertEqual(sorted(leases), [lease, 'released/' + lease[len('leases/'):]])
+
+    def test_shared_expired(self):
+        config = dict(self.config, wheel_server_idle_timeout=600)
+        with build.wheel_server(self.engine, config):
+            pass
+        old_container, = self.containers()
+
+        state_path = locks.lock_path(self.engine, 'wheel-server:{}'.format(naming.wheel_volume_name(config)))
+        os.utime(state_path, (time.time() - 400, time.time() - 400))  # it may stop before being requested
+        with build.wheel_server(self.engine, config):
+            pass
+        self.assertEqual(len(self.containers()), 2)
+
+        self.engine.client.containers.objects[old_container.id].status = 'exited'  # idle timeout
+        with build.wheel_server(self.engine, config):
+            pass
+        self.assertNotIn(old_container.id, [container.id for container in self.containers()])
+        self.assertEqual(self.containers('exited'), [])
+
+
+class WarmTestCase(testing.LockDirTestCase):
+    release = 'grocker-test-project==2.0'
+
+    def setUp(self):
+        super(WarmTestCase, self).setUp()
+        self.tmp_dir = six.TemporaryDirectory()
+        self.engine = engines.get_engine('fake')
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def test_config_matrix(self):
+        matrix = warm.config_matrix([])
+        self.assertEqual([(path, config['runtime']) for path, config in matrix], [
+            (None, 'python2.7'), (None, 'python3.4'),
+        ])
+        matrix = warm.config_matrix([], ['python3.4'], docker_image_prefix='docker.example.com')
+        self.assertEqual([config['docker_image_prefix'] for _, config in matrix], ['docker.example.com'])
+        self.assertRaises(RuntimeError, warm.config_matrix, [], ['python4'])
+
+    def test_warm(self):
+        matrix = warm.config_matrix([])
+        pip_conf = os.path.join(self.tmp_dir.name, 'pip.conf')
+        with open(pip_conf, 'w') as fp:
+            fp.write('[global]\n')
+        results = warm.warm(self.engine, [], matrix, releases=[self.release], pip_conf_path=pip_conf)
+
+        for (_, config), result in zip(matrix, results):
+            self.assertNotIn('error', result)
+            self.assertEqual(set(result['timings']), {'root', 'compiler', 'wheel-server', 'wheels'})
+            self.engine.get_image(naming.image_name(config, 'root'))
+            self.engine.get_image(naming.image_name(config, 'compiler'))
+        self.assertEqual(sorted(result['cache']['wheel-server'] for result in results), ['built', 'local'])
+        self.assertEqual([run['command'][2:] for run in self.engine.client.runs], [[self.release]] * 2)
+
+        results = warm.warm(self.engine, [], matrix)  # already warm
+        self.assertEqual({stage for result in results for stage in result['cache'].values()}, {'local'})
+
+    def test_failure(self):
+        matrix = warm.config_matrix([], ['python3.4'])
+        matrix.append((None, dict(matrix[0][1], runtime='python4')))  # not in the system runtimes
+        results = warm.warm(self.engine, [], matrix)
+        self.assertNotIn('error', results[0])
+        self.assertIn('error', results[1])
@@ -0,0 +1,571 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+
+
+import hashlib
+import http.server
+import importlib.util
+import io
+import json
+import os
+import os.path
+import threading
+import unittest
+
+import pkg_resources
+
+import grocker
+from grocker import engines
+from grocker import six
+from grocker import utils
+from grocker.builders import naming
+from grocker.builders import wheels
+
+import testing
+
+
+def load_compile_script():
+    path = pkg_resources.resource_filename('grocker', 'resources/docker/compiler-image/compile.py')
+    spec = importlib.util.spec_from_file_location('grocker_compile', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_file(directory, name, content):
+    with io.open(os.path.join(directory, name), 'wb') as fp:
+        fp.write(content)
+
+
+class WheelCacheTestCase(unittest.TestCase):
+    compile_script = load_compile_script()
+
+    def setUp(self):
+        self.cache_dir = six.TemporaryDirectory()
+        self.first_dir = six.TemporaryDirectory()
+        self.second_dir = six.TemporaryDirectory()
+        self.cache = self.compile_script.WheelCache('file://{}'.format(self.cache_dir.name))
+
+    def tearDown(self):
+        for directory in (self.cache_dir, self.first_dir, self.second_dir):
+            directory.__exit__(None, None, None)
+
+    def test_store_and_fetch(self):
+        write_file(self.first_dir.name, 'a-1.0-py2.py3-none-any.whl', b'a')
+        write_file(self.first_dir.name, 'b-1.0.tar.gz', b'b')  # not a wheel
+        self.cache.store(self.first_dir.name)
+
+        with open(os.path.join(self.cache_dir.name, 'index.json')) as fp:
+            index = json.load(fp)
+        self.assertEqual(index, {'a-1.0-py2.py3-none-any.whl': hashlib.sha256(b'a').hexdigest()})
+
+        self.cache.fetch(self.second_dir.name)
+        self.assertEqual(os.listdir(self.second_dir.name), ['a-1.0-py2.py3-none-any.whl'])
+
+    def test_corrupted_wheel(self):
+        write_file(self.first_dir.name, 'a-1.0-py2.py3-none-any.whl', b'a')
+        self.cache.store(self.first_dir.name)
+        write_file(self.cache_dir.name, 'a-1.0-py2.py3-none-any.whl', b'corrupted')
+
+        self.cache.fetch(self.second_dir.name)
+        self.assertEqual(os.listdir(self.second_dir.name), [])
+
+    def test_empty_cache(self):
+        self.assertEqual(self.cache.index(), {})
+        self.cache.fetch(self.second_dir.name)
+        self.assertEqual(os.listdir(self.second_dir.name), [])
+
+    def test_fetch_requirements(self):
+        for name in ('a-1.0-py2.py3-none-any.whl', 'a-2.0-py2.py3-none-any.whl', 'b_c-1.0-py2.py3-none-any.whl'):
+            write_file(self.first_dir.name, name, b'a')
+        self.cache.store(self.first_dir.name)
+
+        requirements = self.compile_script.requirement_pins(['A==2.0', 'b.c', 'd==1.0'])
+        self.assertEqual(requirements, {'a': '2.0', 'b_c': None, 'd': '1.0'})
+        self.cache.fetch(self.second_dir.name, requirements)
+        self.assertEqual(
+            sorted(os.listdir(self.second_dir.name)), ['a-2.0-py2.py3-none-any.whl', 'b_c-1.0-py2.py3-none-any.whl'],
+        )
+
+    def test_fetch_compacted(self):
+        for name in ('a-1.0-py2.py3-none-any.whl', 'b-1.0-py2.py3-none-any.whl'):
+            write_file(self.first_dir.name, name, b'a')
+        self.cache.store(self.first_dir.name)
+
+        compacted = {'a-1.0-py2.py3-none-any.whl', 'b-1.0-py2.py3-none-any.whl'}
+        requirements = self.compile_script.requirement_pins(['a==1.0', 'b'])
+        self.cache.fetch(self.second_dir.name, requirements, skipped=compacted)
+        self.assertEqual(os.listdir(self.second_dir.name), ['a-1.0-py2.py3-none-any.whl'])  # needed again
+
+    def test_requirement_pins(self):
+        lines = ['foo[bar] == 1.0 ; python_version < "3"', 'baz>=1.0', 'qux==1.*', '# comment', '-e .', '']
+        self.assertEqual(self.compile_script.requirement_pins(lines), {'foo': '1.0', 'baz': None, 'qux': None})
+
+    def test_store_keeps_index(self):
+        write_file(self.first_dir.name, 'a-1.0-py2.py3-none-any.whl', b'a')
+        write_file(self.second_dir.name, 'b-1.0-py2.py3-none-any.whl', b'b')
+        self.cache.store(self.first_dir.name)
+        self.cache.store(self.second_dir.name)
+        self.assertEqual(sorted(self.cache.index()), ['a-1.0-py2.py3-none-any.whl', 'b-1.0-py2.py3-none-any.whl'])
+
+
+class MemoryStoreHandler(http.server.BaseHTTPRequestHandler):
+    """Plain HTTP GET/PUT store, giving ETags and supporting conditional PUTs."""
+    store = {}
+
+    def etag(self):
+        return '"{}"'.format(hashlib.sha256(self.store[self.path]).hexdigest()) if self.path in self.store else None
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path not in self.store:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('ETag', self.etag())
+        self.end_headers()
+        self.wfile.write(self.store[self.path])
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        if_match, if_none_match = self.headers.get('If-Match'), self.headers.get('If-None-Match')
+        if (if_match and if_match != self.etag()) or (if_none_match == '*' and self.path in self.store):
+            self.send_error(412)
+            return
+        self.store[self.path] = data
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpWheelCacheTestCase(unittest.TestCase):
+    compile_script = WheelCacheTestCase.compile_script
+
+    def setUp(self):
+        MemoryStoreHandler.store.clear()
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), MemoryStoreHandler)
+        threading.Thread(target=self.server.serve_forever).start()
+        url = 'http://127.0.0.1:{}/wheels'.format(self.server.server_port)
+        self.cache = self.compile_script.WheelCache(url)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_store_and_fetch(self):
+        with six.TemporaryDirectory() as first_dir, six.TemporaryDirectory() as second_dir:
+            write_file(first_dir, 'a-1.0-py2.py3-none-any.whl', b'a')
+            self.cache.store(first_dir)
+            self.assertEqual(MemoryStoreHandler.store['/wheels/a-1.0-py2.py3-none-any.whl'], b'a')
+
+            self.cache.fetch(second_dir)
+            self.assertEqual(os.listdir(second_dir), ['a-1.0-py2.py3-none-any.whl'])
+
+    def test_concurrent_store(self):
+        other_cache = self.compile_script.WheelCache(self.cache.url)
+        read_index = self.cache._read_index  # pylint: disable=protected-access
+        reads = []
+
+        def racing_read_index():  # another build updates the index between our read and write
+            result = read_index()
+            reads.append(result)
+            if len(reads) == 2:
+                other_cache.store(other_dir)
+            return result
+
+        self.cache._read_index = racing_read_index  # pylint: disable=protected-access
+        with six.TemporaryDirectory() as first_dir, six.TemporaryDirectory() as other_dir:
+            write_file(first_dir, 'a-1.0-py2.py3-none-any.whl', b'a')
+            write_file(other_dir, 'b-1.0-py2.py3-none-any.whl', b'b')
+            self.cache.store(first_dir)
+
+        self.assertEqual(sorted(self.cache.index()), ['a-1.0-py2.py3-none-any.whl', 'b-1.0-py2.py3-none-any.whl'])
+        self.assertGreater(len(reads), 3)  # the first update was rejected
+
+
+class GetWheelCacheTestCase(unittest.TestCase):
+
+    def test_no_wheel_cache(self):
+        self.assertEqual(wheels.get_wheel_cache(utils.parse_config([])), (None, {}))
+
+    def test_http_wheel_cache(self):
+        config = utils.parse_config([], wheel_cache='http://cache.local/wheels/')
+        url, volumes = wheels.get_wheel_cache(config)
+        self.assertEqual(url, 'http://cache.local/wheels/{}-{}'.format(
+            config['runtime'], utils.config_identifier(config),
+        ))
+        self.assertEqual(volumes, {})
+
+    def test_directory_wheel_cache(self):
+        with six.TemporaryDirectory() as tmp_dir:
+            config = utils.parse_config([], wheel_cache=tmp_dir)
+            url, volumes = wheels.get_wheel_cache(config)
+            self.assertEqual(url, 'file:///home/grocker/wheel-cache')
+            (directory, bind), = volumes.items()
+            self.assertTrue(os.path.isdir(directory))
+            self.assertEqual(os.path.dirname(directory), tmp_dir)
+            self.assertEqual(bind['bind'], '/home/grocker/wheel-cache')
+
+
+class PipCacheTestCase(testing.LockDirTestCase):
+    compile_script = WheelCacheTestCase.compile_script
+
+    def test_count_downloads(self):
+        downloads = {'hits': 0, 'misses': 0}
+        for line in [
+            'Collecting qrcode==5.2\n',
+            '  Using cached qrcode-5.2.tar.gz (29 kB)\n',
+            'Collecting six\n',
+            '  Downloading six-1.10.0-py2.py3-none-any.whl\n',
+            'Collecting Pillow\n',
+            '  Using cached Pillow-4.0.0.tar.gz\n',
+        ]:
+            self.compile_script.count_download(line, downloads)
+        self.assertEqual(downloads, {'hits': 2, 'misses': 1})
+        self.assertEqual(
+            self.compile_script.pip_cache_report(downloads), 'pip cache: 2 hit(s), 1 miss(es), 67% hit ratio',
+        )
+        self.assertEqual(
+            self.compile_script.pip_cache_report({'hits': 0, 'misses': 0}),
+            'pip cache: 0 hit(s), 0 miss(es), 0% hit ratio',
+        )
+
+    def test_compile_wheels(self):
+        engine = engines.get_engine('fake')
+        wheels.compile_wheels(engine, utils.parse_config([]), 'grocker-test-project==2.0', None)
+        wheels.compile_wheels(engine, utils.parse_config([], pip_cache=True), 'grocker-test-project==2.0', None)
+
+        without_cache, with_cache = engine.client.runs
+        self.assertNotIn('PIP_CACHE_DIR', without_cache['environment'])
+        self.assertEqual(with_cache['environment']['PIP_CACHE_DIR'], wheels.PIP_CACHE_MOUNT_POINT)
+        self.assertEqual(
+            with_cache['volumes'][naming.pip_cache_volume_name()], {'bind': wheels.PIP_CACHE_MOUNT_POINT, 'mode': 'rw'},
+        )
+        volume, = engine.list_volumes(label='grocker.image.role=pip-cache')
+        self.assertEqual(volume.name, naming.pip_cache_volume_name())
+
+
+class BuildJobsTestCase(testing.LockDirTestCase):
+    compile_script = WheelCacheTestCase.compile_script
+
+    def test_build_jobs(self):
+        self.assertIsNone(wheels.get_build_jobs(utils.parse_config([])))
+        self.assertEqual(wheels.get_build_jobs(utils.parse_config([], compiler_cpus=1.5)), 2)
+        self.assertEqual(wheels.get_build_jobs(utils.parse_config([], compiler_cpus=1.5, build_jobs=8)), 8)
+
+    def test_environment(self):
+        environ = {'GROCKER_BUILD_JOBS': '3', 'MAX_JOBS': '1'}
+        self.compile_script.setup_build_jobs(environ)
+        self.assertEqual(environ['MAKEFLAGS'], '-j3')
+        self.assertEqual(environ['NPY_NUM_BUILD_JOBS'], '3')
+        self.assertEqual(environ['MAX_JOBS'], '1')  # already set
+
+        environ = {}
+        self.compile_script.setup_build_jobs(environ)
+        self.assertGreaterEqual(int(environ['CMAKE_BUILD_PARALLEL_LEVEL']), 1)
+
+    def test_cpu_quota(self):
+        with six.TemporaryDirectory() as cgroup_dir:
+            self.assertIsNone(self.compile_script.get_cpu_quota(cgroup_dir))
+            write_file(cgroup_dir, 'cpu.max', b'max 100000\n')
+            self.assertIsNone(self.compile_script.get_cpu_quota(cgroup_dir))
+            write_file(cgroup_dir, 'cpu.max', b'150000 100000\n')
+            self.assertEqual(self.compile_script.get_cpu_quota(cgroup_dir), 2)
+            cpus = self.compile_script.get_build_jobs({}, os.path.join(cgroup_dir, 'missing'))
+            self.assertEqual(self.compile_script.get_build_jobs({}, cgroup_dir), min(2, cpus))
+
+        with six.TemporaryDirectory() as cgroup_dir:  # cgroup v1
+            os.mkdir(os.path.join(cgroup_dir, 'cpu'))
+            write_file(cgroup_dir, 'cpu/cpu.cfs_quota_us', b'-1\n')
+            write_file(cgroup_dir, 'cpu/cpu.cfs_period_us', b'100000\n')
+            self.assertIsNone(self.compile_script.get_cpu_quota(cgroup_dir))
+            write_file(cgroup_dir, 'cpu/cpu.cfs_quota_us', b'50000\n')
+            self.assertEqual(self.compile_script.get_cpu_quota(cgroup_dir), 1)
+
+    def test_compile_wheels(self):
+        engine = engines.get_engine('fake')
+        wheels.compile_wheels(engine, utils.parse_config([]), 'grocker-test-project==2.0', None)
+        config = utils.parse_config([], compiler_cpus=2, compiler_memory='4g')
+        wheels.compile_wheels(engine, config, 'grocker-test-project==2.0', None)
+
+        unlimited, limited = engine.client.runs
+        self.assertNotIn('GROCKER_BUILD_JOBS', unlimited['environment'])
+        self.assertNotIn('cpu_quota', unlimited)
+        self.assertEqual(limited['environment']['GROCKER_BUILD_JOBS'], '2')
+        self.assertEqual(limited['cpu_quota'], 2 * limited['cpu_period'])
+        self.assertEqual(limited['mem_limit'], '4g')
+
+
+class CcacheTestCase(testing.LockDirTestCase):
+    compile_script = WheelCacheTestCase.compile_script
+
+    def test_compiler_image(self):
+        config = utils.parse_config([])
+        ccache_config = utils.parse_config([], ccache=True)
+        self.assertIn('ccache', utils.get_dependencies(ccache_config, with_build_dependencies=True))
+        self.assertNotIn('ccache', utils.get_dependencies(config, with_build_dependencies=True))
+        self.assertEqual(utils.config_identifier(config, 'root'), utils.config_identifier(ccache_config, 'root'))
+        self.assertNotEqual(utils.config_identifier(config), utils.config_identifier(ccache_config))
+
+    def test_disabled(self):
+        environ = {}
+        self.assertIsNone(self.compile_script.setup_ccache(environ))
+        self.assertEqual(environ, {})
+
+    def test_stats(self):
+        with six.TemporaryDirectory() as bin_dir:
+            write_file(bin_dir, 'ccache', b'\n'.join([
+                b'#!/bin/sh', b'[ "$1" = --print-stats ] || exit 1',
+                b'printf "stats_updated_timestamp\\t1700000000\\ndirect_cache_hit\\t3\\ncache_miss\\t5\\n"', b'',
+            ]))
+            os.chmod(os.path.join(bin_dir, 'ccache'), 0o755)
+            old_path = os.environ['PATH']
+            os.environ['PATH'] = os.pathsep.join([bin_dir, old_path])
+            try:
+                environ = {'CCACHE_DIR': '/home/grocker/.cache/ccache'}
+                stats = self.compile_script.setup_ccache(environ)  # never zeroed, shared by concurrent compilations
+            finally:
+                os.environ['PATH'] = old_path
+        self.assertEqual(stats, {'direct_cache_hit': 3, 'cache_miss': 5})
+        self.assertEqual(environ['CC'], 'ccache cc')
+
+    def test_report(self):
+        before = {'direct_cache_hit': 3, 'preprocessed_cache_hit': 1, 'cache_miss': 5}
+        after = {'direct_cache_hit': 10, 'preprocessed_cache_hit': 2, 'cache_miss': 7, 'files_in_cache': 40}
+        self.assertEqual(
+            self.compile_script.ccache_report(before, after), 'ccache: 8 hit(s), 2 miss(es), 80% hit ratio',
+        )
+        self.assertIn('not supported', self.compile_script.ccache_report({}, {}))
+
+    def test_compile_wheels(self):
+        engine = engines.get_engine('fake')
+        config = utils.parse_config([], ccache=True, compiler_tmpfs='2g')
+        wheels.compile_wheels(engine, config, 'grocker-test-project==2.0', None)
+
+        run, = engine.client.runs
+        self.assertEqual(
+            run['volumes'][naming.ccache_volume_name()], {'bind': wheels.CCACHE_MOUNT_POINT, 'mode': 'rw'},
+        )
+        self.assertEqual(run['environment']['CCACHE_DIR'], wheels.CCACHE_MOUNT_POINT)
+        self.assertEqual(run['environment']['CCACHE_MAXSIZE'], '5G')
+        self.assertEqual(run['environment']['TMPDIR'], wheels.TMPFS_MOUNT_POINT)
+        self.assertEqual(run['tmpfs'], {wheels.TMPFS_MOUNT_POINT: 'size=2g,mode=1777,exec'})
+        volume, = engine.list_volumes(label='grocker.image.role=ccache')
+        self.assertEqual(volume.name, naming.ccache_volume_name())
+
+
+class WheelReportTestCase(testing.LockDirTestCase):
+    compile_script = WheelCacheTestCase.compile_script
+
+    def setUp(self):
+        super(WheelReportTestCase, self).setUp()
+        self.tmp_dir = six.TemporaryDirectory()
+        self.package_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def test_report(self):
+        write_file(self.package_dir, 'six-1.10.0-py2.py3-none-any.whl', b'six')
+        report = self.compile_script.WheelReport(self.package_dir, 'grocker-test-project==2.0')
+        for now, line in [
+            (0, 'Collecting grocker-test-project==2.0\n'),
+            (1, 'Collecting qrcode==5.2 (from grocker-test-project==2.0)\n'),
+            (2, 'Collecting six (from qrcode==5.2)\n'),
+            (3, 'Collecting Pillow (from grocker-test-project==2.0)\n'),
+            (10, '  Building wheel for Pillow (setup.py): started\n'),
+            (25, "  Building wheel for Pillow (setup.py): finished with status 'done'\n"),
+            (26, '  Running setup.py bdist_wheel for grocker-test-project: started\n'),
+            (28, "  Running setup.py bdist_wheel for grocker-test-project: finished with status 'done'\n"),
+        ]:
+            report.feed(line, now=now)
+        write_file(self.package_dir, 'qrcode-5.2-py2.py3-none-any.whl', b'qrcode')
+        write_file(self.package_dir, 'Pillow-4.0.0-cp34-cp34m-linux_x86_64.whl', b'Pillow')
+        write_file(self.package_dir, 'grocker_test_project-2.0-py3-none-any.whl', b'project')
+
+        entries = {entry['requirement']: entry for entry in report.entries()}
+        self.assertEqual(sorted(entries), ['grocker_test_project', 'pillow', 'qrcode', 'six'])
+        self.assertEqual(
+            {name: (entry['origin'], entry['duration']) for name, entry in entries.items()},
+            {
+                'grocker_test_project': ('compiled', 2),
+                'pillow': ('compiled', 15),
+                'qrcode': ('downloaded', None),
+                'six': ('reused', None),
+            },
+        )
+        self.assertEqual(entries['pillow']['wheel'], 'Pillow-4.0.0-cp34-cp34m-linux_x86_64.whl')
+        self.assertEqual(entries['pillow']['size'], 6)
+
+    def test_summary(self):
+        entry = {'release': 'grocker-test-project==2.0', 'wheel': 'Pillow-4.0.0.whl', 'size': 10}
+        summary = wheels.summarize_wheel_report([
+            dict(entry, requirement='pillow', origin='compiled', duration=15),  # on another Docker host
+            dict(entry, requirement='pillow', origin='reused', duration=None),
+            dict(entry, requirement='qrcode', origin='downloaded', duration=None),
+            dict(entry, requirement='grocker_test_project', origin='compiled', duration=2),
+        ])
+        self.assertEqual(
+            (summary['compiled'], summary['downloaded'], summary['reused'], summary['compile_time'], summary['size']),
+            (2, 1, 0, 17, 30),
+        )
+        self.assertEqual(
+            [entry['requirement'] for entry in summary['packages']], ['pillow', 'grocker_test_project', 'qrcode'],
+        )
+
+    def test_read_report(self):
+        engine = engines.get_engine('fake')
+        config = utils.parse_config([])
+        wheels.compile_wheels(engine, config, 'grocker-test-project==2.0', None, report_id='build-1')
+        run, = engine.client.runs
+        self.assertEqual(run['environment']['GROCKER_REPORT_ID'], 'build-1')
+
+        volume = engine.client.volumes.objects[naming.wheel_volume_name(config)]
+        volume.files['.reports/build-1/compiler-1.json'] = json.dumps([{'requirement': 'six'}]).encode()
+        volume.files['.reports/build-1/compiler-2.json'] = json.dumps([{'requirement': 'qrcode'}]).encode()
+        volume.files['.reports/build-0/compiler-1.json'] = json.dumps([{'requirement': 'pillow'}]).encode()
+        self.assertEqual(
+            sorted(entry['requirement'] for entry in wheels.read_wheel_report(engine, config, 'build-1')),
+            ['qrcode', 'six'],
+        )
+
+
+class CompileReleasesTestCase(unittest.TestCase):
+    compile_script = WheelCacheTestCase.compile_script
+
+    def setUp(self):
+        self.tmp_dir = six.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.__exit__, None, None, None)
+        self.package_dir = os.path.join(self.tmp_dir.name, 'packages')
+        os.mkdir(self.package_dir)
+        os.mkdir(os.path.join(self.tmp_dir.name, 'bin'))
+        pip = os.path.join(self.tmp_dir.name, 'bin', 'pip')
+        write_file(self.tmp_dir.name, 'bin/pip', b'\n'.join([  # a pip failing to build the broken project
+            b'#!/bin/sh', b'for arg; do :; done', b'echo "Collecting $arg"',
+            b'case $arg in broken*) exit 1;; esac', b'',
+        ]))
+        os.chmod(pip, 0o755)
+
+    def compile_releases(self, *argv):
+        args = self.compile_script.arg_parser().parse_args(list(argv))
+        downloads = {'hits': 0, 'misses': 0}
+        return self.compile_script.compile_releases(self.tmp_dir.name, args, b'', downloads, self.package_dir)
+
+    def test_failure(self):
+        with self.assertRaises(SystemExit):
+            self.compile_releases('--no-deps', 'broken==1.0', 'six==1.10.0')
+
+    def test_keep_going(self):
+        entries, _ = self.compile_releases('--no-deps', '--keep-going', 'broken==1.0', 'six==1.10.0')
+        self.assertEqual([entry['release'] for entry in entries], ['six==1.10.0'])
+
+
+class WheelUsageTestCase(testing.LockDirTestCase):
+    compile_script = WheelCacheTestCase.compile_script
+
+    def setUp(self):
+        super(WheelUsageTestCase, self).setUp()
+        self.tmp_dir = six.TemporaryDirectory()
+        self.package_dir = self.tmp_dir.name
+        self.usage_path = os.path.join(self.package_dir, '.usage.json')
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def test_used_wheels(self):
+        write_file(self.package_dir, 'six-1.9.0-py2.py3-none-any.whl', b'six')
+        write_file(self.package_dir, 'six-1.10.0-py2.py3-none-any.whl', b'six')
+        report = self.compile_script.WheelReport(self.package_dir, 'six==1.9.0')
+        report.feed('Collecting six==1.9.0\n')
+        report.feed('  File was already downloaded {}/six-1.9.0-py2.py3-none-any.whl\n'.format(self.package_dir))
+        report.feed('Skipping qrcode-5.2-py2.py3-none-any.whl, due to already being wheel.\n')  # not in the directory
+
+        self.assertEqual(report.used_wheels(), {  # the newest six wheel comes from the report entries
+            'six-1.9.0-py2.py3-none-any.whl', 'six-1.10.0-py2.py3-none-any.whl',
+        })
+
+    def test_unused_wheels(self):
+        for name in ('a-1.0-py3-none-any.whl', 'b-1.0-py3-none-any.whl', 'c-1.0-py3-none-any.whl'):
+            write_file(self.package_dir, name, b'wheel')
+        os.utime(os.path.join(self.package_dir, 'c-1.0-py3-none-any.whl'), (0, 0))  # not recorded, old
+        day = 86400
+        self.compile_script.record_usage(['a-1.0-py3-none-any.whl'], self.usage_path, now=10 * day)
+        self.compile_script.record_usage(['b-1.0-py3-none-any.whl'], self.usage_path, now=20 * day)
+        self.compile_script.record_usage(['b-1.0-py3-none-any.whl'], self.usage_path, now=30 * day)
+        usage = self.compile_script.read_usage(self.usage_path)
+        self.assertEqual(usage['builds'], 3)
+
+        def unused(**kwargs):
+            return self.compile_script.unused_wheels(self.package_dir, usage, now=31 * day, **kwargs)
+
+        self.assertEqual(unused(days=15), ['a-1.0-py3-none-any.whl', 'c-1.0-py3-none-any.whl'])
+        self.assertEqual(unused(days=30), ['c-1.0-py3-none-any.whl'])
+        self.assertEqual(unused(builds=2), ['a-1.0-py3-none-any.whl', 'c-1.0-py3-none-any.whl'])
+        self.assertEqual(unused(builds=3), ['c-1.0-py3-none-any.whl'])
+        self.assertEqual(unused(days=30, builds=2), ['c-1.0-py3-none-any.whl'])  # all criteria
+
+    def test_compacted_wheels(self):
+        compacted = ['a-1.0-py3-none-any.whl', 'b-1.0-py3-none-any.whl']
+        with open(self.usage_path, 'w') as fp:
+            json.dump({'builds': 1, 'wheels': {}, 'compacted': compacted}, fp)
+        self.compile_script.record_usage(['a-1.0-py3-none-any.whl'], self.usage_path)  # built again
+        self.assertEqual(self.compile_script.read_usage(self.usage_path)['compacted'], ['b-1.0-py3-none-any.whl'])
+
+    def test_concurrent_usage(self):
+        def record():
+            for _ in range(20):
+                self.compile_script.record_usage(['a-1.0-py3-none-any.whl'], self.usage_path)
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.compile_script.read_usage(self.usage_path)['builds'], 80)  # no lost update
+
+    def test_reported_wheels(self):
+        reports_dir = os.path.join(self.package_dir, '.reports', 'abcd')
+        os.makedirs(reports_dir)
+        write_file(self.package_dir, 'a-1.0-py3-none-any.whl', b'wheel')
+        write_file(self.package_dir, 'b-1.0-py3-none-any.whl', b'wheel')
+        write_file(reports_dir, 'main.json', json.dumps([
+            {'requirement': 'a', 'wheel': 'a-1.0-py3-none-any.whl'}, {'requirement': 'c', 'wheel': None},
+        ]).encode())
+        write_file(reports_dir, 'shard.json', json.dumps([  # gathered with its wheels from another host
+            {'requirement': 'b', 'wheel': 'b-1.0-py3-none-any.whl'},
+            {'requirement': 'd', 'wheel': 'd-1.0-py3-none-any.whl'},  # not in the wheel directory
+        ]).encode())
+
+        wheel_files = self.compile_script.reported_wheels(
+            'abcd', self.package_dir, os.path.join(self.package_dir, '.reports'),
+        )
+        self.assertEqual(wheel_files, {'a-1.0-py3-none-any.whl', 'b-1.0-py3-none-any.whl'})
+        self.assertEqual(self.compile_script.reported_wheels('other', self.package_dir, reports_dir), set())
+
+    def test_compaction_image(self):
+        engine = engines.get_engine('fake')
+        config = utils.parse_config([])
+        volume = wheels.get_or_create_wheel_volume(engine, config)
+        self.assertIsNone(wheels.compaction_image(engine, volume))
+
+        labels = {'grocker.version': grocker.__version__, 'grocker.image.role': 'compiler'}
+        engine.client.images.add('grocker-compiler-other', dict(labels, **{'grocker.runtime': 'python2.7'}))
+        self.assertIsNone(wheels.compaction_image(engine, volume))
+        engine.client.images.add('grocker-compiler', dict(labels, **{'grocker.runtime': config['runtime']}))
+        self.assertEqual(wheels.compaction_image(engine, volume), 'grocker-compiler')
+
+    def test_compact_wheelhouse(self):
+        engine = engines.get_engine('fake')
+        config = utils.parse_config([])
+        volume = wheels.get_or_create_wheel_volume(engine, config)
+        engine.client.volumes.objects[volume.name].files['.compaction.json'] = json.dumps({'removed': 2}).encode()
+
+        self.assertEqual([v.name for v in wheels.wheel_volumes(engine)], [volume.name])
+        self.assertEqual(wheels.wheel_volumes(engine, runtimes=['python2.7']), [])
+        result = wheels.compact_wheelhouse(engine, 'grocker-compiler', volume.name, unused_builds=5, dry_run=True)
+
+        self.assertEqual(result, {'removed': 2})
+        run, = engine.client.runs
+        self.assertEqual(run['command'], ['--compact', '--unused-builds', '5', '--dry-run'])
+        self.assertEqual(run['volumes'], {volume.name: {'bind': wheels.WHEELHOUSE_MOUNT_POINT, 'mode': 'rw'}})
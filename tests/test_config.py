@@ -11,8 +11,11 @@ import unittest
 import itertools
 
 from grocker import __version__
+from grocker.builders import naming
+from grocker.utils import config_identifier
 from grocker.utils import parse_config
 from grocker.utils import default_image_name
+from grocker.utils import is_pinned_release
 import grocker.six as grocker_six
 
 
@@ -115,3 +118,49 @@ class DefaultImageNameTC(unittest.TestCase):
             }
             got = default_image_name(config, release)
             self.assertEqual(got, expected.format(__version__))
+
+
+class ConfigIdentifierTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = parse_config([])
+
+    def assert_changed(self, config, root, compiler):
+        self.assertEqual(config_identifier(config, 'root') != config_identifier(self.config, 'root'), root)
+        self.assertEqual(config_identifier(config) != config_identifier(self.config), compiler)
+
+    def test_build_dependency(self):
+        self.assert_changed(dict(self.config, dependencies=[{'libzbar0': 'libzbar-dev'}]), root=True, compiler=True)
+        config = dict(self.config, dependencies=['libzbar0'])
+        self.config = dict(self.config, dependencies=[{'libzbar0': 'libzbar-dev'}])
+        self.assert_changed(config, root=False, compiler=True)
+
+    def test_base_image(self):
+        system = dict(self.config['system'], image='debian:stretch')
+        self.assert_changed(dict(self.config, system=system), root=True, compiler=True)
+
+    def test_runtime(self):
+        self.assert_changed(dict(self.config, runtime='python2.7'), root=True, compiler=True)
+
+    def test_runner_config(self):
+        config = dict(self.config, ports=[8080], pip_constraint='constraints.txt')
+        self.assert_changed(config, root=False, compiler=False)
+
+    def test_image_names(self):
+        config = dict(self.config, dependencies=[{'libzbar0': 'libzbar-dev'}])
+        other_config = dict(self.config, dependencies=[{'libzbar0': 'libzbar-dev2'}])
+        self.assertEqual(naming.image_name(config, 'root'), naming.image_name(other_config, 'root'))
+        self.assertNotEqual(naming.image_name(config, 'compiler'), naming.image_name(other_config, 'compiler'))
+        self.assertNotEqual(naming.wheel_volume_name(config), naming.wheel_volume_name(other_config))
+
+
+class PinnedReleaseTestCase(unittest.TestCase):
+
+    def test_is_pinned_release(self):
+        config = dict(parse_config([]), pip_constraint='constraints.txt')
+        self.assertTrue(is_pinned_release(config, 'foo==1.0'))
+        self.assertTrue(is_pinned_release(config, 'foo===1.0'))
+        self.assertFalse(is_pinned_release(config, 'foo==1.*'))
+        self.assertFalse(is_pinned_release(config, 'foo>=1.0'))
+        self.assertFalse(is_pinned_release(config, 'foo'))
+        self.assertFalse(is_pinned_release(dict(config, pip_constraint=None), 'foo==1.0'))
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+
+
+import json
+import tempfile
+
+from grocker import engines
+from grocker import utils
+from grocker.builders import distributed
+from grocker.builders import naming
+
+import testing
+
+
+class DistributedCompileTestCase(testing.LockDirTestCase):
+    release = 'grocker-test-project==2.0'
+
+    def setUp(self):
+        super(DistributedCompileTestCase, self).setUp()
+        self.constraint = tempfile.NamedTemporaryFile()
+        self.constraint.write(b'# pinned dependencies\nqrcode==5.2\nsix==1.10.0\nPillow==4.0.0\nrequests>=2\n-e .\n')
+        self.constraint.flush()
+        self.config = utils.parse_config([], pip_constraint=self.constraint.name)
+        self.engine = engines.get_engine('fake', base_url='tcp://docker-1:2375')
+        self.pool = [
+            engines.get_engine('fake', base_url='tcp://docker-{}:2375'.format(i))
+            for i in (2, 3)
+        ]
+
+    def tearDown(self):
+        self.constraint.close()
+
+    def wheel_volume(self, engine):
+        return engine.client.volumes.create(naming.wheel_volume_name(self.config))
+
+    def commands(self, engine):
+        return [run['command'][2:] for run in engine.client.runs]
+
+    def test_pinned_requirements(self):
+        self.assertEqual(
+            distributed.get_pinned_requirements(self.config),
+            ['Pillow==4.0.0', 'qrcode==5.2', 'six==1.10.0'],
+        )
+        self.assertEqual(distributed.get_pinned_requirements(utils.parse_config([])), [])
+
+    def test_shard(self):
+        self.assertEqual(distributed.shard([1, 2, 3, 4, 5], 2), [[1, 3, 5], [2, 4]])
+        self.assertEqual(distributed.shard([1], 3), [[1], [], []])
+
+    def test_compile(self):
+        for engine in self.pool:
+            self.wheel_volume(engine).files['{}-1.0-py3-none-any.whl'.format(engine.base_url[6:14])] = b'wheel'
+
+        import_path = self.engine.import_path
+
+        def checked_import_path(image, *args, **kwargs):
+            self.engine.get_image(image)  # built before gathering the wheels of the other engines
+            return import_path(image, *args, **kwargs)
+
+        self.engine.import_path = checked_import_path
+        distributed.compile_wheels(self.engine, self.pool, self.config, self.release, None)
+
+        self.assertEqual(
+            self.commands(self.engine), [['--no-deps', '--keep-going', 'Pillow==4.0.0'], [self.release]],
+        )
+        self.assertEqual(self.commands(self.pool[0]), [['--no-deps', '--keep-going', 'qrcode==5.2']])
+        self.assertEqual(self.commands(self.pool[1]), [['--no-deps', '--keep-going', 'six==1.10.0']])
+        self.assertEqual(len(self.engine.client.builds), 2)  # root and compiler images, built once
+        self.assertEqual(self.wheel_volume(self.engine).files, {})  # not compiled by the shards (see test_gather)
+
+    def test_gather(self):
+        source, = self.pool[:1]
+        report = [{'requirement': 'qrcode', 'wheel': 'qrcode-5.2-py3-none-any.whl'}]
+        self.wheel_volume(source).files.update({
+            'qrcode-5.2-py3-none-any.whl': b'qrcode',
+            'six-1.9.0-py3-none-any.whl': b'six',  # compiled by another build
+            '.usage.json': b'{}',
+            '.compaction.json': b'{}',
+            '.reports/1234/docker-2.json': json.dumps(report).encode(),
+            '.reports/5678/docker-2.json': b'[]',
+        })
+
+        distributed.gather_wheels(source, self.engine, self.config, '1234')
+
+        self.assertEqual(self.wheel_volume(self.engine).files, {
+            'qrcode-5.2-py3-none-any.whl': b'qrcode',
+            '.reports/1234/docker-2.json': json.dumps(report).encode(),
+        })
+
+    def test_no_pool(self):
+        distributed.compile_wheels(self.engine, [], self.config, self.release, None)
+        self.assertEqual(self.commands(self.engine), [[self.release]])
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+
+
+import json
+import os.path
+import unittest
+
+from grocker import __version__
+from grocker import cleanners
+from grocker import engines
+from grocker import helpers
+from grocker import six
+from grocker import trace
+from grocker.builders import op
+
+import testing
+
+
+class FakeEngineTestCase(testing.LockDirTestCase):
+
+    def setUp(self):
+        super(FakeEngineTestCase, self).setUp()
+        self.engine = engines.get_engine('fake')
+
+    def build(self, engine):
+        return op.docker_build_image(engine, '/nowhere', 'grocker-test:1', role='root')
+
+    def test_get_or_build_image(self):
+        self.assertRaises(engines.ImageNotFound, self.engine.get_image, 'grocker-test:1')
+        image = op.docker_get_or_build_image(self.engine, 'grocker-test:1', self.build)
+        self.assertEqual(image.tags, ['grocker-test:1'])
+        self.assertEqual(image.labels['grocker.image.role'], 'root')
+        self.assertEqual(image.labels['grocker.version'], __version__)
+        self.assertEqual(self.engine.get_image('grocker-test:1'), image)
+
+    def test_get_or_build_prefixed_image(self):
+        image = op.docker_get_or_build_image(self.engine, 'registry.local/grocker-test:1', self.build_prefixed)
+        self.assertEqual(len(image.digests), 1)  # image was pushed
+
+        other_engine = engines.get_engine('fake')
+        other_engine.client.registry = self.engine.client.registry
+        pulled = op.docker_get_or_build_image(other_engine, 'registry.local/grocker-test:1', self.fail)
+        self.assertEqual(pulled.id, image.id)
+
+    def test_failed_build(self):
+        self.build(self.engine)
+        self.engine.client.failing_builds.add('grocker-test:1')
+        with self.assertRaises(RuntimeError):  # the image of the previous build is not returned
+            self.build(self.engine)
+
+    def build_prefixed(self, engine):
+        return op.docker_build_image(engine, '/nowhere', 'registry.local/grocker-test:1', role='root')
+
+    def test_data_volume(self):
+        volume = op.get_or_create_data_volume(self.engine, 'grocker-test', 'wheel', labels={'a': 'b'})
+        self.assertEqual(volume.labels, {'grocker.version': __version__, 'grocker.image.role': 'wheel', 'a': 'b'})
+        self.assertEqual(self.engine.list_volumes(label='a=b'), [volume])
+        self.assertEqual(self.engine.list_volumes(label='a=c'), [])
+
+    def test_export_volume(self):
+        with six.TemporaryDirectory() as tmp_dir:
+            op.docker_export_volume(self.engine, 'grocker-test:1', 'grocker-test', '/home/grocker/packages', tmp_dir)
+            self.assertTrue(os.path.isdir(os.path.join(tmp_dir, 'packages')))
+
+    def test_run_container(self):
+        op.docker_run_container(self.engine, 'grocker-test:1', ['true'])
+        self.assertEqual(self.engine.list_containers(), [])  # container is removed
+
+    def test_purge(self):
+        engine = engines.get_engine('fake', images=3, volumes=2, containers=1)
+        cleanners.docker_purge_container(engine)
+        cleanners.docker_purge_volumes(engine)
+        cleanners.docker_purge_images(engine, runner=True)
+        self.assertEqual(engine.list_containers(), [])
+        self.assertEqual(engine.list_volumes(), [])
+        self.assertEqual(engine.list_images(), [])
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, engines.get_engine, 'unknown')
+
+
+class PolicyEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = engines.get_engine('fake', policy=engines.Policy(retries=2, delay=0.001))
+        self.failures = []
+
+    def failing(self, error, times):
+        def list_volumes(*args, **kwargs):
+            if len(self.failures) < times:
+                self.failures.append(error)
+                raise error('daemon overloaded')
+            return []
+        self.engine.engine.list_volumes = list_volumes
+
+    def test_retry(self):
+        self.failing(engines.EngineError, 2)
+        self.assertEqual(self.engine.list_volumes(), [])
+        self.assertEqual(self.engine.counters['calls'], 3)
+        self.assertEqual(self.engine.counters['retries'], 2)
+
+    def test_retries_exhausted(self):
+        self.failing(engines.EngineError, 3)
+        self.assertRaises(engines.EngineError, self.engine.list_volumes)
+        self.assertEqual(self.engine.counters['retries'], 2)
+
+    def test_timeout(self):
+        self.engine.policy.timeouts['list_volumes'] = 0
+        self.failing(engines.EngineError, 1)
+        self.assertRaises(engines.EngineError, self.engine.list_volumes)
+        self.assertEqual(self.engine.counters['retries'], 0)
+
+    def test_unsafe_operation(self):
+        def run_container(*args, **kwargs):
+            self.failures.append(engines.EngineError)
+            raise engines.EngineError('daemon overloaded')
+        self.engine.engine.run_container = run_container
+        self.assertRaises(engines.EngineError, self.engine.run_container, 'grocker-test:1')
+        self.assertEqual(self.failures, [engines.EngineError])
+        self.assertEqual(self.engine.counters['retries'], 0)
+
+    def test_not_found(self):
+        self.failing(engines.NotFound, 1)
+        self.assertRaises(engines.NotFound, self.engine.list_volumes)
+        self.assertEqual(self.engine.counters['retries'], 0)
+
+    def test_rate_limit(self):
+        engine = engines.get_engine('fake', policy=engines.Policy(rate=100, burst=2))
+        for _ in range(4):
+            engine.list_volumes()
+        self.assertEqual(engine.counters['calls'], 4)
+        self.assertEqual(engine.counters['throttled'], 2)
+        self.assertGreater(engine.counters['throttled_time'], 0)
+
+    def test_delegation(self):
+        self.assertIs(self.engine.client, self.engine.engine.client)
+        self.assertEqual(self.engine.name, 'fake')
+
+
+class TracingEngineTestCase(testing.LockDirTestCase):
+
+    def setUp(self):
+        super(TracingEngineTestCase, self).setUp()
+        self.tracer = trace.start()
+        self.engine = engines.get_engine('fake', policy=engines.Policy(), tracing=True)
+
+    def tearDown(self):
+        trace.stop()
+
+    def spans(self, category):
+        return [event for event in self.tracer.events if event['cat'] == category]
+
+    def test_stage_spans(self):
+        timings = {}
+        with helpers.timed(timings, 'root'):
+            op.docker_get_or_build_image(
+                self.engine, 'grocker-test:1',
+                lambda engine: op.docker_build_image(engine, '/nowhere', 'grocker-test:1'),
+            )
+
+        stage, = self.spans('stage')
+        self.assertEqual(stage['name'], 'root')
+        calls = self.spans('engine')
+        self.assertEqual([call['name'] for call in calls], [
+            'get_image', 'get_image', 'pull_image', 'build_image', 'get_image',
+        ])
+        for call in calls:
+            self.assertEqual((call['tid'], call['args']['target']), (stage['tid'], 'grocker-test:1'))
+            self.assertGreaterEqual(call['ts'], stage['ts'])
+            self.assertLessEqual(call['ts'] + call['dur'], stage['ts'] + stage['dur'])
+        self.assertTrue(calls[0]['args']['error'].startswith('ImageNotFound'))
+
+    def test_streamed_bytes(self):
+        self.engine.client.images.add('grocker-test:1', {})
+        size = sum(len(chunk) for chunk in self.engine.save_image('grocker-test:1'))
+        call, = self.spans('engine')
+        self.assertEqual(call['args']['bytes'], size)
+
+    def test_write(self):
+        self.engine.list_volumes(label='grocker.image.role=wheel')
+        with six.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'trace.json')
+            self.tracer.write(path)
+            with open(path) as fp:
+                thread, call = json.load(fp)['traceEvents']
+        self.assertEqual((thread['ph'], call['ph']), ('M', 'X'))
+        self.assertEqual(call['args'], {'engine': 'default', 'label': 'grocker.image.role=wheel'})
+
+    def test_not_started(self):
+        trace.stop()
+        self.engine.list_volumes()
+        self.assertEqual(self.tracer.events, [])
+
+
+class PodmanEngineTestCase(unittest.TestCase):
+    """Podman engine, running a stand-in podman command."""
+
+    def setUp(self):
+        self.tmp_dir = six.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.__exit__, None, None, None)
+        self.podman = os.path.join(self.tmp_dir.name, 'podman')
+        with open(self.podman, 'w') as fp:
+            fp.write('\n'.join([
+                '#!/bin/sh',
+                'case $1 in',
+                '    create|run) echo 1234 ;;',
+                '    rm) ;;',
+                '    cp) echo "Error: ${2#*:} could not be found on container 1234: no such file or directory" >&2',
+                '        exit 125 ;;',
+                '    container) echo \'[{"Id": "1234", "Name": "c", "NetworkSettings": {"IPAddress": ""}}]\' ;;',
+                'esac',
+                '',
+            ]))
+        os.chmod(self.podman, 0o755)
+        self.engine = engines.get_engine('podman', podman=self.podman)
+
+    def test_export_missing_path(self):
+        with self.assertRaises(engines.NotFound):
+            list(self.engine.export_path('grocker-compiler', '/home/grocker/packages/.usage.json'))
+        with self.assertRaises(engines.NotFound):
+            list(self.engine.export_paths('grocker-compiler', '/home/grocker/packages', ['a-1.0-py3-none-any.whl']))
+
+    def test_container_without_ip_address(self):
+        container = self.engine.start_container('grocker-wheel-server')  # eg. rootless podman
+        self.assertIsNone(container.ip_address)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+
+
+import os.path
+import time
+import unittest
+
+from grocker import __main__ as grocker_main
+from grocker import engines
+from grocker import ledger
+from grocker import six
+from grocker import utils
+
+import testing
+
+
+class LedgerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = six.TemporaryDirectory()
+        self.ledger = ledger.Ledger(os.path.join(self.tmp_dir.name, 'ledger', 'ledger.sqlite'))
+        self.config = utils.parse_config([])
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def record(self, release, outcome='succeeded', duration=10, config=None, **collect):
+        collect = dict(collect, release=release, image='grocker-test:1')
+        self.ledger.record('fake', config or self.config, collect, outcome, time.time() - duration)
+
+    def test_history(self):
+        self.record('foo==1.0')
+        self.record('bar==1.0', outcome='failed')
+        self.record('foo==2.0')
+
+        self.assertEqual([x['release'] for x in self.ledger.history()], ['foo==2.0', 'bar==1.0', 'foo==1.0'])
+        self.assertEqual([x['release'] for x in self.ledger.history(limit=1)], ['foo==2.0'])
+        self.assertEqual([x['release'] for x in self.ledger.history(release='foo==%')], ['foo==2.0', 'foo==1.0'])
+        self.assertEqual(self.ledger.history()[1]['outcome'], 'failed')
+
+    def test_estimate(self):
+        self.assertIsNone(self.ledger.estimate(self.config))
+        self.record('foo==1.0', duration=10, timings={'runner': 4})
+        self.record('foo==1.0', duration=30, timings={'runner': 6})
+        self.record('foo==1.0', outcome='failed', duration=100)
+
+        duration, count = self.ledger.estimate(self.config)
+        self.assertEqual(count, 2)
+        self.assertAlmostEqual(duration, 20, places=1)
+        self.assertEqual(self.ledger.estimate(self.config, 'runner'), (5, 2))
+        self.assertIsNone(self.ledger.estimate(self.config, 'wheels'))
+
+        other_config = dict(self.config, dependencies=['libzbar0'])  # same runtime
+        self.assertEqual(self.ledger.estimate(other_config, 'runner'), (5, 2))
+        self.assertIsNone(self.ledger.estimate(dict(self.config, runtime='python2.7')))
+
+    def test_stats(self):
+        self.record('foo==1.0', timings={'root': 2}, cache={'root': 'built', 'runner': 'built'}, size=100)
+        self.record('foo==1.0', outcome='reused', cache={'runner': 'reused'}, size=100)
+        self.record('foo==2.0', timings={'root': 4}, cache={'root': 'local', 'runner': 'built'}, size=200)
+
+        stats = self.ledger.stats()
+        self.assertEqual(stats['builds'], 3)
+        self.assertEqual(stats['outcomes'], {'succeeded': 2, 'reused': 1})
+        self.assertEqual(stats['durations']['root'], {'count': 2, 'mean': 3, 'median': 3})
+        self.assertEqual(stats['cache_hit_rates']['root'], 0.5)
+        self.assertAlmostEqual(stats['cache_hit_rates']['runner'], 1 / 3.0)
+        self.assertAlmostEqual(stats['image_size'], 400 / 3.0)
+        self.assertEqual(self.ledger.stats(since=time.time())['builds'], 0)
+
+
+class BuildReleaseTestCase(testing.LockDirTestCase):
+    release = 'grocker-test-project==2.0'
+
+    def setUp(self):
+        super(BuildReleaseTestCase, self).setUp()
+        self.tmp_dir = six.TemporaryDirectory()
+        self.ledger = ledger.Ledger(os.path.join(self.tmp_dir.name, 'ledger.sqlite'))
+        self.engine = engines.get_engine('fake')
+        constraint = os.path.join(self.tmp_dir.name, 'constraints.txt')
+        with open(constraint, 'w') as fp:
+            fp.write('qrcode==5.2\n')
+        self.config = dict(utils.parse_config([]), pip_constraint=constraint)
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def build(self, **options):
+        return grocker_main.build_release(
+            self.engine, [], self.config, self.release, ledger=self.ledger,
+            build_dependencies=False, push=False, **options
+        )
+
+    def test_record(self):
+        collect = self.build()
+        self.assertEqual(collect['cache'], {'root': 'built', 'runner': 'built'})
+        self.assertEqual(set(collect['timings']), {'root', 'runner'})
+        self.assertEqual(self.build()['cache'], {'root': 'local', 'runner': 'reused'})
+
+        first, second = reversed(self.ledger.history())
+        self.assertEqual((first['outcome'], first['engine'], first['release']), ('succeeded', 'fake', self.release))
+        self.assertEqual(first['image_size'], self.engine.get_image(collect['image']).size)
+        self.assertEqual(second['outcome'], 'reused')
+
+    def test_failure(self):
+        self.engine.client.api.build = None  # not callable
+        with self.assertRaises(TypeError):
+            self.build()
+        build, = self.ledger.history()
+        self.assertEqual(build['outcome'], 'failed')
+        self.assertIn('not callable', build['error'])
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+
+
+import os
+import threading
+import time
+
+from grocker import engines
+from grocker import locks
+from grocker.builders import op
+
+import testing
+
+
+class LocksTestCase(testing.LockDirTestCase):
+
+    def setUp(self):
+        super(LocksTestCase, self).setUp()
+        self.engine = engines.get_engine('fake')
+        self.running = []
+        self.peak = 0
+
+    def builder(self, name):
+        def build(engine):
+            self.running.append(name)
+            self.peak = max(self.peak, len(self.running))
+            time.sleep(0.05)
+            self.running.remove(name)
+            return engine.client.images.add(name, {})
+        return build
+
+    def run_threads(self, *targets):
+        threads = [threading.Thread(target=target) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def get_or_build(self, name, cache, slots=None):
+        return lambda: op.docker_get_or_build_image(self.engine, name, self.builder(name), cache, slots=slots)
+
+    def test_stage_lock(self):
+        first, second = {}, {}
+        self.run_threads(self.get_or_build('grocker-test:1', first), self.get_or_build('grocker-test:1', second))
+        self.assertEqual(sorted(list(first.values()) + list(second.values())), ['built', 'local'])
+        self.assertEqual(self.engine.client.images.objects['grocker-test:1'].tags, ['grocker-test:1'])
+
+    def test_build_slots(self):
+        self.run_threads(*[self.get_or_build('grocker-test:{}'.format(i), {}, slots=1) for i in range(3)])
+        self.assertEqual(self.peak, 1)
+
+        self.run_threads(*[self.get_or_build('grocker-other:{}'.format(i), {}, slots=3) for i in range(3)])
+        self.assertEqual(self.peak, 3)
+
+    def test_nested_build_slots(self):
+        with locks.build_slot(self.engine, 1):
+            with locks.build_slot(self.engine, 1):  # does not wait for itself
+                pass
+
+    def test_engine_scope(self):
+        other_engine = engines.get_engine('fake', base_url='tcp://docker-2:2375')
+        self.assertNotEqual(locks.lock_path(self.engine, 'slot:0'), locks.lock_path(other_engine, 'slot:0'))
+        self.assertEqual(os.path.dirname(locks.lock_path(self.engine, 'slot:0')), self.lock_dir.name)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+
+
+import hashlib
+import json
+import os.path
+import tarfile
+import unittest
+import zlib
+
+from grocker import engines
+from grocker import six
+from grocker.builders import oci
+from grocker.engines import fake
+
+
+class ExportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = six.TemporaryDirectory()
+        self.engine = engines.get_engine('fake')
+        self.engine.client.images.add('grocker-test:1', {'grocker.image.role': 'runner'})
+        self.engine.client.images.add('grocker-test:2', {'grocker.image.role': 'runner'})
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def export(self, name, **kwargs):
+        return oci.export_image(self.engine, name, os.path.join(self.tmp_dir.name, name + '.tar'), **kwargs)
+
+    def read_archive(self, path):
+        with tarfile.open(path) as tar:
+            return {member.name: tar.extractfile(member).read() for member in tar.getmembers()}
+
+    def test_export(self):
+        result = self.export('grocker-test:1')
+        self.assertEqual((result['layers'], result['skipped_layers']), (2, 0))
+        self.assertEqual(set(result['timings']), {'transfer', 'compress', 'write'})
+
+        files = self.read_archive(result['archive'])
+        self.assertEqual(json.loads(files['oci-layout'].decode()), {'imageLayoutVersion': '1.0.0'})
+        descriptor, = json.loads(files['index.json'].decode())['manifests']
+        self.assertEqual(descriptor['annotations'], {'org.opencontainers.image.ref.name': 'grocker-test:1'})
+
+        blobs = {'sha256:' + hashlib.sha256(data).hexdigest(): data for data in files.values()}
+        manifest = json.loads(blobs[descriptor['digest']].decode())
+        config = json.loads(blobs[manifest['config']['digest']].decode())
+        self.assertEqual(config['config']['Labels'], {'grocker.image.role': 'runner'})
+
+        layers = [zlib.decompress(blobs[layer['digest']], 16 + zlib.MAX_WBITS) for layer in manifest['layers']]
+        self.assertEqual(layers[0], fake.BASE_LAYER)
+        self.assertEqual(
+            ['sha256:' + hashlib.sha256(layer).hexdigest() for layer in layers], config['rootfs']['diff_ids'],
+        )
+        self.assertEqual({layer['mediaType'] for layer in manifest['layers']}, {oci.MEDIA_TYPES['gzip']})
+
+    def test_previous_manifest(self):
+        first = self.export('grocker-test:1')
+        second = self.export('grocker-test:2', previous_manifest=first['manifest'])
+        self.assertEqual((second['layers'], second['skipped_layers']), (2, 1))
+
+        with open(first['manifest']) as fp:
+            first_manifest = json.load(fp)['manifest']
+        with open(second['manifest']) as fp:
+            second_manifest = json.load(fp)['manifest']
+        self.assertEqual(second_manifest['layers'][0], first_manifest['layers'][0])  # shared base layer
+        base_layer = 'blobs/sha256/' + first_manifest['layers'][0]['digest'][7:]
+        self.assertNotIn(base_layer, self.read_archive(second['archive']))
+
+    @unittest.skipIf(oci.zstandard, 'zstandard is installed')
+    def test_zstd_unavailable(self):
+        with self.assertRaises(RuntimeError):
+            self.export('grocker-test:1', compression='zstd')
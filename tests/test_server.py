@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+
+
+import json
+import logging
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from grocker import server
+from grocker import six
+
+
+def fake_build(engine, pool, config, release, pip_conf=None, **options):
+    print('Building {}'.format(release))
+    logging.getLogger('grocker.builders').warning('Not pushing any image')
+    if release == 'broken':
+        raise RuntimeError('Build failed')
+    return {'release': release, 'image': 'grocker-test:1', 'options': options}
+
+
+class JobQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = six.TemporaryDirectory()
+
+    def tearDown(self):
+        self.state_dir.__exit__(None, None, None)
+
+    def test_coalesce(self):
+        jobs = server.JobQueue(self.state_dir.name)
+        job, coalesced = jobs.submit('a', {'release': 'foo'})
+        self.assertFalse(coalesced)
+        self.assertEqual(jobs.submit('a', {'release': 'foo'}), (job, True))
+
+        jobs.update('a', status=server.SUCCEEDED)
+        _, coalesced = jobs.submit('a', {'release': 'foo'})
+        self.assertFalse(coalesced)  # finished jobs are built again
+
+    def test_resume(self):
+        jobs = server.JobQueue(self.state_dir.name)
+        jobs.submit('a', {'release': 'foo'})
+        jobs.submit('b', {'release': 'bar'})
+        jobs.update('a', status=server.RUNNING)
+        jobs.update('b', status=server.FAILED)
+
+        jobs = server.JobQueue(self.state_dir.name)
+        self.assertEqual(jobs.get('a')['status'], server.QUEUED)
+        self.assertEqual(jobs.get('b')['status'], server.FAILED)
+        self.assertEqual(jobs.pending.get_nowait(), 'a')
+        self.assertTrue(jobs.pending.empty())
+
+
+class BuildServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = six.TemporaryDirectory()
+        self.jobs = server.JobQueue(self.state_dir.name)
+        self.build_server = server.BuildServer(self.jobs, 'fake', fake_build)
+
+    def tearDown(self):
+        self.state_dir.__exit__(None, None, None)
+
+    def test_job_identifier(self):
+        job, _ = self.build_server.submit({'release': 'foo==1.0', 'push': False})
+        other_job, _ = self.build_server.submit({'release': 'foo==1.0', 'config': {'runtime': 'python2.7'}})
+        self.assertNotEqual(job['id'], other_job['id'])
+        self.assertEqual(self.build_server.submit({'release': 'foo==1.0', 'push': False}), (job, True))
+
+    def test_invalid_request(self):
+        with self.assertRaises(ValueError):
+            self.build_server.submit({})
+        with self.assertRaises(ValueError):
+            self.build_server.submit({'release': 'foo', 'config': {'system': {}}})
+        with self.assertRaises(ValueError):
+            self.build_server.submit({'release': 'foo', 'config': {'runtime': 'cobol'}})
+        with self.assertRaises(ValueError):
+            self.build_server.submit({'release': 'foo', 'config': {'pip_constraint': '/nope.txt'}})
+        with self.assertRaises(ValueError):
+            self.build_server.submit({'release': 'foo', 'config': ['runtime', 'python3.9']})
+        with self.assertRaises(ValueError):
+            self.build_server.submit({'release': 'foo', 'push': 'false'})
+
+    def test_run(self):
+        job, _ = self.build_server.submit({'release': 'foo==1.0', 'push': False})
+        broken_job, _ = self.build_server.submit({'release': 'broken'})
+        with server.capture_output(self.jobs) as output:
+            self.build_server.run(job['id'], output)
+            self.build_server.run(broken_job['id'], output)
+
+        job = self.jobs.get(job['id'])
+        self.assertEqual(job['status'], server.SUCCEEDED)
+        self.assertEqual(job['result']['options'], {'push': False})
+        self.assertEqual(
+            b''.join(self.jobs.follow(job['id'])),
+            b'Building foo==1.0\ngrocker.builders: Not pushing any image\n',
+        )
+
+        broken_job = self.jobs.get(broken_job['id'])
+        self.assertEqual(broken_job['status'], server.FAILED)
+        self.assertEqual(broken_job['error'], 'Build failed')
+        self.assertIn(b'RuntimeError: Build failed', b''.join(self.jobs.follow(broken_job['id'])))
+
+
+class HTTPServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = six.TemporaryDirectory()
+        self.jobs = server.JobQueue(self.state_dir.name)
+        self.build_server = server.BuildServer(self.jobs, 'fake', fake_build)
+        self.httpd = server.HTTPServer(('127.0.0.1', 0), self.build_server)
+        threading.Thread(target=self.httpd.serve_forever).start()
+        self.url = 'http://127.0.0.1:{}/builds'.format(self.httpd.server_port)
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.state_dir.__exit__(None, None, None)
+
+    def request(self, path='', data=None):
+        request = urllib.request.Request(
+            self.url + path,
+            data=json.dumps(data).encode('utf-8') if data is not None else None,
+            headers={'Content-Type': 'application/json'},
+        )
+        with urllib.request.urlopen(request) as response:
+            body = response.read()
+            return response.status, json.loads(body.decode('utf-8')) if not path.endswith('/log') else body
+
+    def test_build(self):
+        status, job = self.request(data={'release': 'foo==1.0'})
+        self.assertEqual((status, job['status'], job['coalesced']), (202, server.QUEUED, False))
+        status, coalesced_job = self.request(data={'release': 'foo==1.0'})
+        self.assertEqual((status, coalesced_job['id'], coalesced_job['coalesced']), (200, job['id'], True))
+
+        with server.capture_output(self.jobs):
+            self.build_server.start()
+            self.jobs.pending.put(None)  # stop the worker once the job is done
+            _, log = self.request('/{}/log'.format(job['id']))
+        self.assertIn(b'Building foo==1.0\n', log)
+
+        _, job = self.request('/{}'.format(job['id']))
+        self.assertEqual(job['status'], server.SUCCEEDED)
+        _, jobs = self.request()
+        self.assertEqual([x['id'] for x in jobs], [job['id']])
+
+    def test_errors(self):
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.request(data={'version': '1.0'})
+        self.assertEqual(cm.exception.code, 400)
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.request(data={'release': 'foo==1.0', 'config': {'pip_constraint': '/nope.txt'}})
+        self.assertEqual(cm.exception.code, 400)
+        for data in ({'release': 'foo==1.0', 'config': 'python3.9'}, {'release': 'foo==1.0', 'force': 1}):
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                self.request(data=data)
+            self.assertEqual(cm.exception.code, 400)
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.request('/unknown')
+        self.assertEqual(cm.exception.code, 404)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+
+
+import os
+import os.path
+import threading
+import time
+import unittest
+
+from grocker import helpers
+from grocker import six
+from grocker import utils
+from grocker import watch
+
+
+class StageKeysTestCase(unittest.TestCase):
+    release = 'grocker-test-project==2.0'
+
+    def setUp(self):
+        self.tmp_dir = six.TemporaryDirectory()
+        self.constraint = os.path.join(self.tmp_dir.name, 'constraints.txt')
+        with open(self.constraint, 'w') as fp:
+            fp.write('qrcode==5.2\n')
+        self.config = utils.parse_config([], pip_constraint=self.constraint)
+        self.keys = self.stage_keys(self.config)
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def stage_keys(self, config, release=None):
+        return watch.stage_keys(config, release or self.release, 'grocker-test:1')
+
+    def test_first_build(self):
+        self.assertEqual(watch.invalidated_stages(None, self.keys), list(watch.STAGES))
+        self.assertEqual(watch.invalidated_stages(self.keys, self.stage_keys(self.config)), [])
+
+    def test_dependencies(self):
+        config = dict(self.config, dependencies=['libzbar0'])
+        self.assertEqual(watch.invalidated_stages(self.keys, self.stage_keys(config)), list(watch.STAGES))
+
+    def test_constraint(self):
+        with open(self.constraint, 'w') as fp:
+            fp.write('qrcode==5.3\n')
+        self.assertEqual(watch.invalidated_stages(self.keys, self.stage_keys(self.config)), ['wheels', 'runner'])
+
+    def test_release(self):
+        keys = self.stage_keys(self.config, 'grocker-test-project==2.1')
+        self.assertEqual(watch.invalidated_stages(self.keys, keys), ['wheels', 'runner'])
+
+    def test_runner_config(self):
+        config = dict(self.config, ports=[8080])
+        self.assertEqual(watch.invalidated_stages(self.keys, self.stage_keys(config)), ['runner'])
+
+
+class WatchTestCase(unittest.TestCase):
+
+    def test_wait_for_changes(self):
+        with six.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, '.grocker.yml')
+            mtimes = watch.get_mtimes([path, None])
+            self.assertEqual(mtimes, {path: None})
+
+            timer = threading.Timer(0.05, lambda: open(path, 'w').close())
+            timer.start()
+            self.assertEqual(watch.wait_for_changes([path], mtimes, interval=0.01), watch.get_mtimes([path]))
+            timer.join()
+
+    def test_timed(self):
+        timings = {}
+        for _ in range(2):
+            with helpers.timed(timings, 'runner'):
+                time.sleep(0.01)
+        self.assertGreaterEqual(timings['runner'], 0.02)
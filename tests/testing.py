@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Polyconseil SAS. All rights reserved.
+"""
+Base test cases shared by the test modules.
+"""
+
+import os
+import unittest
+
+from grocker import six
+
+
+class LockDirTestCase(unittest.TestCase):
+    """Test case using its own lock directory (`GROCKER_LOCK_DIR`, see grocker.locks), not the one of the user."""
+
+    def setUp(self):
+        super(LockDirTestCase, self).setUp()
+        self.lock_dir = six.TemporaryDirectory()
+        self.addCleanup(self.lock_dir.__exit__, None, None, None)
+
+        old_lock_dir = os.environ.get('GROCKER_LOCK_DIR')
+        os.environ['GROCKER_LOCK_DIR'] = self.lock_dir.name
+        if old_lock_dir is None:
+            self.addCleanup(os.environ.pop, 'GROCKER_LOCK_DIR', None)
+        else:
+            self.addCleanup(os.environ.__setitem__, 'GROCKER_LOCK_DIR', old_lock_dir)